@@ -1,65 +1,304 @@
 # -*- coding: utf-8 -*-
 
+import argparse
+import subprocess
+import sys
 import warnings
+from src import PATH_PROFILE, PATH_TRACE
 
 warnings.filterwarnings("ignore")
 
-from src.data.make_dataset import load_data
-from src.reports.reports import (
-    answer_complementary_data_analysis,
-    answer_covid_impact_on_revenue,
-    answer_first_question,
-    answer_fourth_question,
-    answer_second_question,
-    answer_third_question,
-    header_covid_impact_on_revenue,
-    header_q1,
-    header_q2,
-    header_q3,
-    header_q4,
-)
-from src.models.train_model import (
-    train_covid_impact_model,
-    train_price_model_q1,
-    train_reservations_model_q3,
-    train_revenue_model_q1,
-    train_revenue_model_q2,
-)
-
-
-def main():
-    """Main function"""
-
-    df_listings, df_daily_revenue = load_data()
-
-    # Question 01
-    header_q1()
-    train_price_model_q1(df_listings, df_daily_revenue)
-    train_revenue_model_q1(df_listings, df_daily_revenue)
-    answer_first_question()
-
-    # Question 02
-    header_q2()
-    train_revenue_model_q2(df_listings, df_daily_revenue)
-    answer_second_question(df_listings, df_daily_revenue)
-
-    # Question 03
-    header_q3()
-    train_reservations_model_q3(df_daily_revenue)
-    answer_third_question(df_daily_revenue)
-
-    # Question 04
-    header_q4()
-    answer_fourth_question(df_daily_revenue)
-
-    # Impact of Covid-19 pandemic on revenue
-    header_covid_impact_on_revenue()
-    train_covid_impact_model(df_listings, df_daily_revenue)
-    answer_covid_impact_on_revenue(df_listings, df_daily_revenue)
-
-    # Complementary Data Analysis
-    answer_complementary_data_analysis(df_daily_revenue)
+# Heavy dependencies (sklearn, xgboost, seaborn, matplotlib) are
+# imported inside the commands that need them, so answering a single question
+# only pays for the imports of that question.
+
+COMMANDS = ["q1", "q2", "q3", "q4", "covid", "extra", "all"]
+
+# Stages whose outputs each command wants; the stages producing their
+# inputs, like the training of the models, are run first when needed.
+COMMAND_STAGES = {
+    "q1": ["answer_q1"],
+    "q2": ["answer_q2", "plot_real_pred_data", "plot_seasonal_decomposed_q2"],
+    "q3": ["answer_q3", "plot_seasonal_decomposed_q3"],
+    "q4": ["answer_q4"],
+    "covid": ["answer_covid", "plot_revenue_loss_due_to_covid"],
+    "extra": ["answer_extra", "plot_revenue_per_date", "plot_hist_reservation_advance"],
+}
+
+COMMAND_MODULES = {
+    "q1": ["src.data.make_dataset", "src.reports.reports"],
+    "q2": [
+        "src.data.make_dataset",
+        "src.reports.reports",
+        "src.visualization.visualize",
+    ],
+    "q3": [
+        "src.data.make_dataset",
+        "src.reports.reports",
+        "src.visualization.visualize",
+    ],
+    "q4": ["src.data.make_dataset", "src.reports.reports"],
+    "covid": [
+        "src.data.make_dataset",
+        "src.reports.reports",
+        "src.visualization.visualize",
+    ],
+    "extra": [
+        "src.data.make_dataset",
+        "src.reports.reports",
+        "src.visualization.visualize",
+    ],
+}
+
+TRAINING_MODULES = ["src.models.train_model"]
+
+# Modules imported by `main` itself to run any command.
+PIPELINE_MODULES = ["src.instrumentation", "src.pipeline"]
+
+# Import time budgets in seconds, as (without training, with training),
+# measured in a fresh interpreter. For reference, on a development laptop the
+# imports take 0.3 s for q1/q4 without training, 1.2 s with training, and
+# 1.5 s/1.8 s for the commands that plot figures.
+IMPORT_TIME_BUDGETS = {
+    "q1": (0.75, 2.5),
+    "q2": (3.0, 3.5),
+    "q3": (3.0, 3.5),
+    "q4": (0.75, 2.5),
+    "covid": (3.0, 3.5),
+    "extra": (3.0, 3.5),
+    "all": (3.0, 3.5),
+}
+
+
+def command_sections(command: str):
+    """Returns the sections run by a command, in order."""
+    return list(COMMAND_STAGES) if command == "all" else [command]
+
+
+def main(
+    command: str = "all",
+    train: bool = True,
+    n_workers: int = 1,
+    n_threads: int = None,
+    trace: str = None,
+    profile: str = None,
+    force: bool = False,
+    append: bool = False,
+    n_shards: int = None,
+):
+    """Main function
+
+    Parameters
+    ----------
+    command : str, optional
+        Question to be answered, one of COMMANDS, by default "all".
+    train : bool, optional
+        Whether to train the models before answering, by default True.
+        Otherwise the models stored in 'models/' are used.
+    n_workers : int, optional
+        Number of processes running the stages of the pipeline, by default
+        1. With more than one worker, independent stages, like the training
+        of different models and the plots, run concurrently.
+    n_threads : int, optional
+        Number of threads of each training job, by default None (the
+        number of cores divided by the number of workers).
+    trace : str, optional
+        If given, the wall time, CPU time, peak memory and row counts of the
+        loaders, builders, trainers, answers and plots are written to this
+        JSON file and summarized at the end, by default None.
+    profile : str, optional
+        If given, the cProfile statistics of the stage with the largest self
+        time are written to this file, by default None.
+    force : bool, optional
+        Whether to run every stage, even the ones whose outputs are newer
+        than their inputs, by default False.
+    append : bool, optional
+        Whether to ingest the rows appended to the daily revenue file into
+        the persisted company revenue sums and train and answer from them
+        where possible, instead of the full datasets, by default False.
+    n_shards : int, optional
+        If given, the company revenue sums and the reservation counts are
+        computed once as a map-reduce over this number of shards of listings,
+        on n_workers processes, and the models of questions 1 (revenue), 2 and
+        3 and the covid impact are trained from them, by default None.
+    """
+    from src.instrumentation import enable_tracing
+    from src.pipeline import run_pipeline
+
+    if trace or profile:
+        enable_tracing(profile=bool(profile))
+
+    targets = [
+        stage
+        for section in command_sections(command)
+        for stage in COMMAND_STAGES[section]
+    ]
+
+    run_pipeline(targets, train, force, n_workers, n_threads, append, n_shards)
+
+    if trace or profile:
+        report_trace(trace, profile)
+
+
+def report_trace(trace: str = None, profile: str = None):
+    """Prints the summary of the trace and writes the trace and the profile
+    of the hottest stage.
+
+    Parameters
+    ----------
+    trace : str, optional
+        Path of the JSON trace, by default None (not written).
+    profile : str, optional
+        Path of the cProfile statistics, by default None (not written).
+    """
+    from src.instrumentation import (
+        disable_tracing,
+        dump_hottest_profile,
+        dump_trace,
+        format_trace_summary,
+    )
+
+    disable_tracing()
+
+    print(format_trace_summary())
+
+    if trace:
+        dump_trace(trace)
+        print("Trace written to " + trace)
+
+    if profile:
+        name = dump_hottest_profile(profile)
+        if name is not None:
+            print("Profile of {} written to {}".format(name, profile))
+
+
+def check_import_time(command: str, train: bool):
+    """Measures, in a fresh interpreter, the time to import the modules
+    used by a command and compares it with its budget.
+
+    Parameters
+    ----------
+    command : str
+        One of COMMANDS.
+    train : bool
+        Whether the training modules are imported too.
+
+    Returns
+    -------
+    bool
+        Returns True if the import time is within the budget.
+    """
+    modules = PIPELINE_MODULES + sorted(
+        {
+            module
+            for section in command_sections(command)
+            for module in COMMAND_MODULES[section]
+        }
+    )
+    if train:
+        modules += TRAINING_MODULES
+
+    code = (
+        "import time, warnings; warnings.filterwarnings('ignore'); "
+        "start = time.perf_counter(); "
+        + "; ".join("import " + module for module in modules)
+        + "; print(time.perf_counter() - start)"
+    )
+    elapsed = float(subprocess.check_output([sys.executable, "-c", code]))
+    budget = IMPORT_TIME_BUDGETS[command][int(train)]
+
+    print(
+        "Import time of '{}' ({}): {:.2f} s, budget {:.2f} s".format(
+            command, "train" if train else "no-train", elapsed, budget
+        )
+    )
+
+    return elapsed <= budget
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description=main.__doc__.splitlines()[0])
+    parser.add_argument(
+        "command",
+        nargs="?",
+        default="all",
+        choices=COMMANDS,
+        help="question to be answered (default: all)",
+    )
+    parser.add_argument(
+        "--train",
+        dest="train",
+        action="store_true",
+        default=True,
+        help="train the models before answering (default)",
+    )
+    parser.add_argument(
+        "--no-train",
+        dest="train",
+        action="store_false",
+        help="answer with the models stored in 'models/'",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of processes running independent stages in parallel",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=None,
+        help="number of threads of each training job",
+    )
+    parser.add_argument(
+        "--check-import-time",
+        action="store_true",
+        help="only measure the import time of the command against its budget",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="run every stage, even the up to date ones",
+    )
+    parser.add_argument(
+        "--trace",
+        nargs="?",
+        const=PATH_TRACE,
+        default=None,
+        help="record the time and memory of each stage (default path: %(const)s)",
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const=PATH_PROFILE,
+        default=None,
+        help="write a cProfile dump of the hottest stage (default path: %(const)s)",
+    )
+    aggregates = parser.add_mutually_exclusive_group()
+    aggregates.add_argument(
+        "--append",
+        action="store_true",
+        help="ingest the appended daily revenue rows and train from the sums",
+    )
+    aggregates.add_argument(
+        "--shards",
+        type=int,
+        default=None,
+        help="compute the sums once over this number of shards of listings",
+    )
+    args = parser.parse_args()
+
+    if args.check_import_time:
+        sys.exit(0 if check_import_time(args.command, args.train) else 1)
+
+    main(
+        args.command,
+        args.train,
+        args.workers,
+        args.threads,
+        args.trace,
+        args.profile,
+        args.force,
+        args.append,
+        args.shards,
+    )
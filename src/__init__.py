@@ -6,6 +6,12 @@ PATH_LISTINGS = "data/raw/listings-challenge.csv"
 
 PATH_DAILY_REVENUE = "data/raw/daily_revenue.csv"
 
+PATH_DATA_CACHE = "data/processed"
+
+PATH_DATA_AGGREGATES = "data/processed/aggregates"
+
+PATH_RAW_DIGESTS = "data/processed/raw_digests.json"
+
 PATH_PLOT_REVENUE_PER_DATE = "reports/figures/revenue_per_date.png"
 
 PATH_HISTOGRAM_BOOKINGS = "reports/figures/histogram_reservation_advance.png"
@@ -42,8 +48,83 @@ PATH_PREPROCESSOR_COVID_IMPACT = "models/preprocessor_covid_impact_model.pickle"
 
 PATH_REGRESSOR_COVID_IMPACT = "models/regressor_covid_impact_model.pickle"
 
+PATH_MODEL_REGISTRY = "models/registry"
+
+PATH_BENCHMARK_BASELINE = "reports/benchmarks/baseline.json"
+
+PATH_BENCHMARK_RESULTS = "reports/benchmarks/results.json"
+
+PATH_ANSWERS = "reports/answers"
+
+PATH_TRACE = "reports/trace.json"
+
+PATH_PROFILE = "reports/profile.prof"
+
+PATH_TRAINING_RESULTS = "reports/training_results.json"
+
 REFERENCE_DATE = "2022-03-15"
 
+DAILY_REVENUE_CHUNK_SIZE = 1_000_000
+
+DAILY_REVENUE_DTYPES = {
+    "listing": "category",
+    "date": "object",
+    "occupancy": "float32",
+    "blocked": "float32",
+    "revenue": "float64",
+    "last_offered_price": "float64",
+    "creation_date": "object",
+}
+
+LISTINGS_DTYPES = {
+    "Comissão": "float64",
+    "Cama Casal": "float32",
+    "Cama Solteiro": "float32",
+    "Cama Queen": "float32",
+    "Cama King": "float32",
+    "Sofá Cama Solteiro": "float32",
+    "Travesseiros": "float32",
+    "Taxa de Limpeza": "float64",
+    "Capacidade": "float32",
+}
+
+# Rows repeating the header text inside the listings file.
+LISTINGS_NA_VALUES = {
+    "Cama Casal": ["Quantidade de Camas Casal"],
+    "Cama Solteiro": ["Quantidade de Camas Solteiro"],
+    "Cama Queen": ["Quantidade de Camas Queen"],
+    "Cama King": ["Quantidade de Camas King"],
+    "Sofá Cama Solteiro": ["Quantidade de Sofás Cama Solteiro"],
+    "Banheiros": ["Banheiros"],
+    "Capacidade": ["Capacidade"],
+}
+
+# Columns mixing comma and dot decimals, such as '1,50' and '3.1'.
+LISTINGS_MIXED_DECIMAL_COLUMNS = ["Banheiros"]
+
+LISTINGS_INT8_COLUMNS = [
+    "Cama Casal",
+    "Cama Solteiro",
+    "Cama Queen",
+    "Cama King",
+    "Sofá Cama Solteiro",
+    "Travesseiros",
+    "Banheiros",
+    "Capacidade",
+]
+
+BENCHMARK_ROWS = [10_000, 1_000_000, 10_000_000]
+
+BENCHMARK_THRESHOLD = 0.25
+
+PLOT_HISTOGRAM_BINS = 100
+
+PLOT_MAX_POINTS = 1600
+
+SEASONAL_PERIOD = 365
+
+DECOMPOSITION_CACHE_SIZE = 32
+
 FEATURES_PRICE_MODEL_Q1 = [
     "Categoria",
     "Quartos",
@@ -0,0 +1,473 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from src import (
+    BENCHMARK_ROWS,
+    BENCHMARK_THRESHOLD,
+    PATH_BENCHMARK_BASELINE,
+    PATH_BENCHMARK_RESULTS,
+    PATH_DAILY_REVENUE,
+    PATH_LISTINGS,
+    PATH_MODEL_REGISTRY,
+)
+from src.data.synthetic import write_synthetic_dataset
+
+STAGE_GROUPS = ["load", "features", "training", "inference"]
+
+# Differences in wall time below this number of seconds are never flagged,
+# since they are within the noise of timing short stages.
+BENCHMARK_MIN_SECONDS = 0.05
+
+
+def load_stages():
+    """Returns the data loading stages."""
+    from src.data.make_dataset import load_data, process_data
+
+    def load(state):
+        state["df_listings"], state["df_daily_revenue"] = process_data()
+
+    def load_cached(state):
+        load_data(use_cache=True)
+
+    def warm_cache(state):
+        load_data(use_cache=True)
+
+    return [("load", load, None), ("load_cached", load_cached, warm_cache)]
+
+
+def clear_caches(state):
+    """Empties the in-memory caches of the features, so each measured run of
+    a stage starts cold instead of reusing the work of the previous stage or
+    run."""
+    from src.commons import build_calendar_table
+    from src.features.company_revenue import clear_company_revenue_cache
+    from src.features.decomposition import clear_decomposition_cache
+
+    clear_company_revenue_cache()
+    clear_decomposition_cache()
+    build_calendar_table.cache_clear()
+
+
+def feature_stages():
+    """Returns the feature building stages and the sharded aggregates
+    stages."""
+    from src.features import build_features
+    from src.features.sharded import sharded_aggregates
+
+    stages = []
+    for name in [
+        "price_model_q1",
+        "revenue_model_q1",
+        "revenue_model_q2",
+        "reservations_model_q3",
+        "covid_impact_model",
+    ]:
+        builder = getattr(build_features, "build_features_" + name)
+
+        def stage(
+            state, builder=builder, uses_listings=name != "reservations_model_q3"
+        ):
+            datasets = ["df_listings", "df_daily_revenue"][not uses_listings :]
+            builder(*[state[dataset] for dataset in datasets])
+
+        stages.append(("features_" + name, stage, None))
+
+    # Sharded aggregates with 1, 2, 4... workers up to the number of cores,
+    # to measure how the map-reduce scales.
+    n_workers = 1
+    while n_workers <= (os.cpu_count() or 1):
+
+        def sharded(state, n_workers=n_workers):
+            sharded_aggregates(
+                state["df_listings"], state["df_daily_revenue"], n_workers=n_workers
+            )
+
+        stages.append(("aggregates_sharded_{:d}".format(n_workers), sharded, None))
+        n_workers *= 2
+
+    return stages
+
+
+def training_stages():
+    """Returns the model training stages, each one starting from an empty
+    registry entry so the model is always trained."""
+    from src.models.train_model import TRAINING_JOBS
+
+    stages = []
+    for name, (train, uses_listings, _) in TRAINING_JOBS.items():
+
+        def stage(state, train=train, uses_listings=uses_listings):
+            datasets = ["df_listings", "df_daily_revenue"][not uses_listings :]
+            train(*[state[dataset] for dataset in datasets], n_jobs=state["n_jobs"])
+
+        def forget(state, name=name):
+            path = os.path.join(PATH_MODEL_REGISTRY, name + ".json")
+            if os.path.exists(path):
+                os.remove(path)
+
+        stages.append(("train_" + name, stage, forget))
+
+    return stages
+
+
+def inference_stages():
+    """Returns the answering stages, which predict with the trained models
+    and plot the figures."""
+    from src.reports import reports
+
+    def datasets(*names):
+        return lambda state: [state[name] for name in names]
+
+    answers = [
+        ("answer_q1", reports.answer_first_question, datasets()),
+        (
+            "answer_q2",
+            reports.answer_second_question,
+            datasets("df_listings", "df_daily_revenue"),
+        ),
+        ("answer_q3", reports.answer_third_question, datasets("df_daily_revenue")),
+        ("answer_q4", reports.answer_fourth_question, datasets("df_daily_revenue")),
+        (
+            "answer_covid",
+            reports.answer_covid_impact_on_revenue,
+            datasets("df_listings", "df_daily_revenue"),
+        ),
+        (
+            "answer_extra",
+            reports.answer_complementary_data_analysis,
+            datasets("df_daily_revenue"),
+        ),
+    ]
+
+    return [
+        (name, lambda state, answer=answer, args=args: answer(*args(state)), None)
+        for name, answer, args in answers
+    ]
+
+
+STAGES = {
+    "load": load_stages,
+    "features": feature_stages,
+    "training": training_stages,
+    "inference": inference_stages,
+}
+
+
+def measure(stage, state: dict, trace_memory: bool = False):
+    """Runs a stage once, measuring either its wall time or the peak
+    memory allocated while it runs.
+
+    The two are measured in separate runs, as tracing the allocations with
+    tracemalloc slows down allocation heavy stages and would skew the wall
+    time.
+
+    Parameters
+    ----------
+    stage : Callable
+        Function of the benchmark state.
+    state : dict
+        Benchmark state shared between the stages.
+    trace_memory : bool, optional
+        Whether to measure the peak memory instead of the wall time, by
+        default False.
+
+    Returns
+    -------
+    float
+        Returns the wall time in seconds, or the peak memory in bytes.
+    """
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            stage(state)
+        wall = time.perf_counter() - start
+        if trace_memory:
+            return tracemalloc.get_traced_memory()[1]
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+
+    return wall
+
+
+def run_benchmarks(
+    sizes: list = BENCHMARK_ROWS,
+    groups: list = STAGE_GROUPS,
+    repeat: int = 1,
+    n_jobs: int = None,
+    seed: int = 0,
+):
+    """Runs the benchmark stages on synthetic datasets of each size.
+
+    Each size is run in a temporary working directory holding the synthetic
+    raw files and the models, figures and caches written by the stages, so
+    the files of the project are never touched.
+
+    Parameters
+    ----------
+    sizes : list, optional
+        Number of rows of each synthetic daily revenue dataset, by default
+        BENCHMARK_ROWS.
+    groups : list, optional
+        Stage groups to run, among STAGE_GROUPS, by default all of them.
+        The datasets are always loaded; training runs before inference
+        whenever inference is requested, since it needs the models.
+    repeat : int, optional
+        Number of timed runs of each stage, the fastest one being kept, by
+        default 1. The peak memory is measured by one more run. The caches
+        of the features are emptied before each run.
+    n_jobs : int, optional
+        Number of threads of the training stages, by default None (no limit).
+    seed : int, optional
+        Seed of the synthetic datasets, by default 0.
+
+    Returns
+    -------
+    list
+        Returns one dict per stage and size with the keys 'stage', 'group',
+        'rows', 'wall_s', 'peak_mb' and 'rows_per_s'.
+    """
+    if "inference" in groups and "training" not in groups:
+        groups = list(groups) + ["training"]
+
+    results = []
+    cwd = os.getcwd()
+    path_listings = os.path.abspath(PATH_LISTINGS)
+
+    for rows in sizes:
+        with tempfile.TemporaryDirectory(prefix="benchmark-") as workspace:
+            for directory in ["data/raw", "models", "reports/figures"]:
+                os.makedirs(os.path.join(workspace, directory))
+
+            write_synthetic_dataset(
+                os.path.join(workspace, PATH_DAILY_REVENUE),
+                path_listings=os.path.join(workspace, PATH_LISTINGS),
+                n_rows=rows,
+                seed=seed,
+                source_listings=path_listings,
+            )
+
+            state = {"n_jobs": n_jobs}
+            os.chdir(workspace)
+            try:
+                for group in STAGE_GROUPS:
+                    if group != "load" and group not in groups:
+                        continue
+
+                    for name, stage, setup in STAGES[group]():
+                        timings = []
+                        for trace_memory in [False] * repeat + [True]:
+                            clear_caches(state)
+                            if setup is not None:
+                                setup(state)
+                            timings.append(measure(stage, state, trace_memory))
+
+                        wall, peak = min(timings[:-1]), timings[-1]
+                        results.append(
+                            {
+                                "stage": name,
+                                "group": group,
+                                "rows": rows,
+                                "wall_s": wall,
+                                "peak_mb": peak / 2**20,
+                                "rows_per_s": rows / wall if wall > 0 else None,
+                            }
+                        )
+                        print(format_result(results[-1]), flush=True)
+            finally:
+                os.chdir(cwd)
+
+    return results
+
+
+def compare_results(
+    results: list,
+    baseline: list,
+    threshold: float = BENCHMARK_THRESHOLD,
+    min_seconds: float = BENCHMARK_MIN_SECONDS,
+):
+    """Compares the wall times of benchmark results with a baseline.
+
+    Parameters
+    ----------
+    results : list
+        Results as returned by `run_benchmarks`.
+    baseline : list
+        Results of a previous run.
+    threshold : float, optional
+        Relative slowdown above which a stage is flagged, by default
+        BENCHMARK_THRESHOLD.
+    min_seconds : float, optional
+        Absolute slowdown, in seconds, below which a stage is never flagged,
+        by default BENCHMARK_MIN_SECONDS.
+
+    Returns
+    -------
+    list
+        Returns the results found in the baseline with the added keys
+        'baseline_s', 'ratio' and 'regression'.
+    """
+    reference = {(result["stage"], result["rows"]): result for result in baseline}
+
+    comparison = []
+    for result in results:
+        previous = reference.get((result["stage"], result["rows"]))
+        if previous is None:
+            continue
+
+        ratio = result["wall_s"] / previous["wall_s"] if previous["wall_s"] else np.inf
+        comparison.append(
+            dict(
+                result,
+                baseline_s=previous["wall_s"],
+                ratio=ratio,
+                regression=bool(
+                    ratio > 1 + threshold
+                    and result["wall_s"] - previous["wall_s"] > min_seconds
+                ),
+            )
+        )
+
+    return comparison
+
+
+def format_result(result: dict):
+    """Formats a benchmark result as a line of the summary table."""
+    line = "{:<34} {:>11,d} {:>10.3f} s {:>10.1f} MB {:>14,.0f} rows/s".format(
+        result["stage"],
+        result["rows"],
+        result["wall_s"],
+        result["peak_mb"],
+        result["rows_per_s"] or 0,
+    )
+
+    if "ratio" in result:
+        line += " {:>6.2f}x{}".format(
+            result["ratio"], "  SLOWER" if result["regression"] else ""
+        )
+
+    return line
+
+
+def environment():
+    """Returns the versions of the interpreter, libraries and machine on
+    which the benchmarks ran."""
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "machine": platform.machine(),
+        "system": platform.system(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def dump_results(results: list, path: str):
+    """Writes benchmark results to a JSON file.
+
+    Parameters
+    ----------
+    results : list
+        Results as returned by `run_benchmarks`.
+    path : str
+        Complete path of the JSON file.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"environment": environment(), "results": results}, f, indent=4)
+
+
+def load_results(path: str):
+    """Reads benchmark results from a JSON file written by `dump_results`.
+
+    Parameters
+    ----------
+    path : str
+        Complete path of the JSON file.
+
+    Returns
+    -------
+    list
+        Returns the benchmark results.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)["results"]
+
+
+def main():
+    """Command line entry point of the benchmark suite.
+
+    Returns
+    -------
+    int
+        Returns 1 if any stage is slower than the baseline beyond the
+        threshold, 0 otherwise.
+    """
+    parser = argparse.ArgumentParser(description="Pipeline benchmarks")
+    parser.add_argument(
+        "--rows",
+        type=int,
+        nargs="+",
+        default=BENCHMARK_ROWS,
+        help="sizes of the synthetic datasets",
+    )
+    parser.add_argument(
+        "--groups", nargs="+", default=STAGE_GROUPS, choices=STAGE_GROUPS
+    )
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--output", default=PATH_BENCHMARK_RESULTS)
+    parser.add_argument("--baseline", default=PATH_BENCHMARK_BASELINE)
+    parser.add_argument("--threshold", type=float, default=BENCHMARK_THRESHOLD)
+    parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help="store the results as the new baseline",
+    )
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.rows, args.groups, args.repeat, args.threads)
+    dump_results(results, args.output)
+
+    if args.update_baseline:
+        dump_results(results, args.baseline)
+        print("Baseline written to " + args.baseline)
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("No baseline at {}, nothing to compare".format(args.baseline))
+        return 0
+
+    comparison = compare_results(results, load_results(args.baseline), args.threshold)
+
+    print("\nComparison with " + args.baseline)
+    for result in comparison:
+        print(format_result(result))
+
+    regressions = [result["stage"] for result in comparison if result["regression"]]
+    if regressions:
+        print(
+            "{:d} stage(s) slower than the baseline by more than {:.0%}".format(
+                len(regressions), args.threshold
+            )
+        )
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,15 @@
-import holidays
+import contextlib
+import hashlib
+import json
+import os
+import tempfile
+import numpy as np
 import pandas as pd
 import pickle
 from datetime import datetime
-from sklearn.base import TransformerMixin
+from functools import lru_cache
 from typing import Any
 
-BRAZILIAN_HOLIDAYS = holidays.Brazil()
-
 WEEK_DAY_ORDER = {
     0: "Mon",
     1: "Tue",
@@ -17,77 +20,234 @@ WEEK_DAY_ORDER = {
     6: "Sun",
 }
 
+DAY_OF_WEEK_FEATURES = [
+    "day_of_week_" + name for name in sorted(WEEK_DAY_ORDER.values())[1:]
+]
+
 
-def is_holiday(date: datetime):
-    """Check if the input is a Brazilian holiday.
+def dump_pickle(variable: Any, path: str):
+    """Writes a pickled representation of obj to the open file object file.
 
     Parameters
     ----------
-    date : datetime
-        Datetime with the date to be analyzed.
+    variable : Any
+        Object to be seriaized to a pickle file
+    path : str
+        Complete file path to the dumped file
+    """
+    with open(path, "wb") as f:
+        pickle.dump(variable, f)
+
+
+def load_pickle(path: str):
+    """Read and return an object from the pickle data stored in a file.
+
+    Parameters
+    ----------
+    path : str
+        Complete path to the pickle file.
 
     Returns
     -------
-    int
-        Returns 1 if the passed date is a holiday and 0 otherwise.
+    Any
+        Object in the pickle file.
     """
-    return int(date in BRAZILIAN_HOLIDAYS)
+    with open(path, "rb") as f:
+        variable = pickle.load(f)
+    return variable
 
 
-def transform_dataframe(transformer: TransformerMixin, dataframe: pd.DataFrame):
-    """Applies sklearn transform in pandas dataframe and
-    converts the result in pandas dataframe
+def hash_files(paths: list, chunk_size: int = 1 << 20):
+    """Computes a single SHA-256 digest over the contents of a list of files.
 
     Parameters
     ----------
-    transformer : TransformerMixin
-       A pandas-like transform.
-    dataframe : pd.DataFrame
-        A dataframe to be transforme.
+    paths : list
+        Paths of the files to be hashed, in a fixed order.
+    chunk_size : int, optional
+        Number of bytes read at a time, by default 1 MiB.
 
     Returns
     -------
-    pd.DataFrame
-        Returns the transformed dataframe.
+    str
+        Hexadecimal digest of the files contents.
     """
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(str(path).encode("utf-8"))
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(chunk_size), b""):
+                digest.update(block)
+    return digest.hexdigest()
 
-    return pd.DataFrame(
-        transformer.transform(dataframe),
-        columns=dataframe.columns,
-        index=dataframe.index,
-    )
 
+def file_digest(path: str, stamps: str, chunk_size: int = 1 << 20):
+    """Computes the SHA-256 digest of a file, reusing the digest stored in
+    a stamps file while the size and modification time of the file are the
+    ones stored with it.
 
-def dump_pickle(variable: Any, path: str):
-    """Writes a pickled representation of obj to the open file object file.
+    Parameters
+    ----------
+    path : str
+        Path of the file to be hashed.
+    stamps : str
+        Path of the JSON file keeping the digest, size and modification time
+        of the hashed files, created if needed.
+    chunk_size : int, optional
+        Number of bytes read at a time, by default 1 MiB.
+
+    Returns
+    -------
+    str
+        Hexadecimal digest of the file, as `hash_files([path])`.
+    """
+    stat = os.stat(path)
+    stamp = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+    try:
+        with open(stamps, "r", encoding="utf-8") as f:
+            known = json.load(f)
+    except (OSError, ValueError):
+        known = {}
+
+    entry = known.get(os.path.abspath(path), {})
+    if all(entry.get(name) == value for name, value in stamp.items()):
+        return entry["sha256"]
+
+    known[os.path.abspath(path)] = dict(stamp, sha256=hash_files([path], chunk_size))
+
+    with _atomic_file(stamps) as f:
+        f.write(json.dumps(known, indent=2).encode("utf-8"))
+
+    return known[os.path.abspath(path)]["sha256"]
+
+
+@contextlib.contextmanager
+def _atomic_file(path: str):
+    """Opens a temporary file next to a path for binary writing, which
+    replaces the path when closed without error, so readers never see a
+    partially written file."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, temporary = tempfile.mkstemp(dir=directory, suffix=".tmp")
+
+    try:
+        with os.fdopen(fd, "wb") as f:
+            yield f
+        os.replace(temporary, path)
+    except BaseException:
+        os.remove(temporary)
+        raise
+
+
+def dump_dataframe_npz(dataframe: pd.DataFrame, path: str):
+    """Writes a dataframe to a columnar numpy archive, keeping its dtypes.
+
+    Each column is stored as a separate typed array. Nullable integer,
+    categorical, datetime and text columns are stored together with the
+    masks or categories needed to rebuild them, and the JSON serializable
+    `attrs` of the dataframe are kept with the dtypes. The archive is
+    written to a temporary file which then replaces path.
 
     Parameters
     ----------
-    variable : Any
-        Object to be seriaized to a pickle file
+    dataframe : pd.DataFrame
+        Dataframe to be serialized.
     path : str
-        Complete file path to the dumped file
+        Complete file path to the dumped file.
     """
-    with open(path, "wb") as f:
-        pickle.dump(variable, f)
+    arrays = {}
+    columns = []
+
+    for i, column in enumerate(dataframe.columns):
+        series = dataframe[column]
+        key = "c{:d}".format(i)
+        dtype = series.dtype
+        mask = series.isna().to_numpy()
+
+        if isinstance(dtype, pd.CategoricalDtype):
+            kind = "category"
+            arrays[key] = series.cat.codes.to_numpy()
+            categories = np.asarray(dtype.categories)
+            if not pd.api.types.is_numeric_dtype(categories.dtype):
+                categories = categories.astype(str)
+            arrays[key + "_categories"] = categories
+        elif pd.api.types.is_datetime64_any_dtype(dtype):
+            kind = "datetime"
+            arrays[key] = series.to_numpy().view("int64")
+        elif pd.api.types.is_extension_array_dtype(dtype) and hasattr(
+            dtype, "numpy_dtype"
+        ):
+            kind = "masked"
+            arrays[key] = series.to_numpy(dtype=dtype.numpy_dtype, na_value=0)
+            arrays[key + "_mask"] = mask
+        elif pd.api.types.is_numeric_dtype(dtype) or pd.api.types.is_bool_dtype(dtype):
+            kind = "numeric"
+            arrays[key] = series.to_numpy()
+        elif pd.api.types.infer_dtype(series, skipna=True) == "integer":
+            kind = "object_integer"
+            arrays[key] = series.where(~mask, 0).to_numpy(dtype="int64")
+            arrays[key + "_mask"] = mask
+        else:
+            kind = "text"
+            arrays[key] = np.asarray(series.where(~mask, "").astype(str), dtype=str)
+            arrays[key + "_mask"] = mask
+
+        columns.append({"name": column, "kind": kind, "dtype": str(dtype)})
+
+    arrays["__meta__"] = np.array(
+        json.dumps({"columns": columns, "attrs": dataframe.attrs})
+    )
 
+    with _atomic_file(path) as f:
+        np.savez(f, **arrays)
 
-def load_pickle(path: str):
-    """Read and return an object from the pickle data stored in a file.
+
+def load_dataframe_npz(path: str):
+    """Reads a dataframe written by `dump_dataframe_npz`.
 
     Parameters
     ----------
     path : str
-        Complete path to the pickle file.
+        Complete path to the numpy archive.
 
     Returns
     -------
-    Any
-        Object in the pickle file.
+    pd.DataFrame
+        The dataframe with its original columns, dtypes and attrs.
     """
-    with open(path, "rb") as f:
-        variable = pickle.load(f)
-    return variable
+    with np.load(path, allow_pickle=False) as archive:
+        meta = json.loads(str(archive["__meta__"]))
+        data = {}
+
+        for i, column in enumerate(meta["columns"]):
+            key = "c{:d}".format(i)
+            values = archive[key]
+            kind = column["kind"]
+
+            if kind == "category":
+                categories = archive[key + "_categories"]
+                if categories.dtype.kind == "U":
+                    categories = categories.astype(object)
+                data[column["name"]] = pd.Categorical.from_codes(
+                    values, categories=categories
+                )
+            elif kind == "datetime":
+                data[column["name"]] = values.view(column["dtype"])
+            elif kind == "masked":
+                data[column["name"]] = pd.array(values, dtype=column["dtype"])
+                data[column["name"]][archive[key + "_mask"]] = pd.NA
+            elif kind in ("text", "object_integer"):
+                values = values.astype(object)
+                values[archive[key + "_mask"]] = np.nan
+                data[column["name"]] = values
+            else:
+                data[column["name"]] = values
+
+    dataframe = pd.DataFrame(data, columns=[c["name"] for c in meta["columns"]])
+    dataframe.attrs.update(meta.get("attrs", {}))
+
+    return dataframe
 
 
 def to_date(datetime: datetime):
@@ -106,51 +266,87 @@ def to_date(datetime: datetime):
     return datetime.strftime("%Y-%m-%d")
 
 
-def decompose_date_ymd(dataframe: pd.DataFrame, date_column: str):
-    """Decomposes date column into three columns of year, month and day.
+@lru_cache(maxsize=32)
+def build_calendar_table(first_year: int, last_year: int):
+    """Builds a table with the date features of every day between the
+    first day of `first_year` and the last day of `last_year`.
 
     Parameters
     ----------
-    dataframe : pd.DataFrame
-        Pandas dataframe containing a date column.
-    date_column : str
-        A column containing date in datetime format.
+    first_year : int
+        First year covered by the table.
+    last_year : int
+        Last year covered by the table.
 
     Returns
     -------
     pd.DataFrame
-        Returns the dataframe with date decomposed into three columns.
+        Returns a dataframe with one row per day, in order, and the columns
+        'year', 'month', 'day', 'holiday' and the one hot encoding structure
+        for 'day of week'. The table is shared between callers and must not
+        be modified.
     """
+    import holidays
 
-    dataframe["year"] = dataframe[date_column].dt.year
-    dataframe["month"] = dataframe[date_column].dt.month
-    dataframe["day"] = dataframe[date_column].dt.day
+    dates = pd.date_range(
+        start="{:d}-01-01".format(first_year), end="{:d}-12-31".format(last_year)
+    )
 
-    return dataframe
+    holidays_dates = np.array(
+        list(holidays.Brazil(years=range(first_year, last_year + 1)).keys()),
+        dtype="datetime64[D]",
+    )
 
+    calendar = pd.DataFrame(
+        {
+            "year": dates.year.astype("int64"),
+            "month": dates.month.astype("int64"),
+            "day": dates.day.astype("int64"),
+            "holiday": np.isin(
+                dates.values.astype("datetime64[D]"), holidays_dates
+            ).astype("int64"),
+        }
+    )
+
+    day_of_week = dates.dayofweek.values
+    for number, name in WEEK_DAY_ORDER.items():
+        column = "day_of_week_" + name
+        if column in DAY_OF_WEEK_FEATURES:
+            calendar[column] = (day_of_week == number).astype("uint8")
+
+    return calendar[["year", "month", "day", "holiday"] + DAY_OF_WEEK_FEATURES]
 
-def add_day_of_week(dataframe: pd.DataFrame, date_column: str):
-    """Adds a column to a dataframe containing the day of week
-    correspondent to the date.
+
+def calendar_positions(dates: pd.Series):
+    """Maps each date to its row in the calendar table covering all dates.
 
     Parameters
     ----------
-    dataframe : pd.DataFrame
-        Pandas dataframe containing a date column.
-    date_column : str
-        A column containing date in datetime format.
+    dates : pd.Series
+        A series of dates in datetime format.
 
     Returns
     -------
-    pd.DataFrame
-        Returns the dataframe containing a column indicating the day of week.
+    tuple
+        Returns the calendar table, the row position of each date in it
+        and a boolean mask of the missing dates.
     """
+    days = dates.to_numpy(dtype="datetime64[ns]").astype("datetime64[D]")
+    missing = np.isnat(days)
 
-    dataframe["day_of_week"] = dataframe[date_column].dt.dayofweek.replace(
-        WEEK_DAY_ORDER
-    )
+    if missing.all():
+        years = [pd.Timestamp.today().year] * 2
+    else:
+        years = days[~missing].astype("datetime64[Y]").astype(int) + 1970
+        years = [int(years.min()), int(years.max())]
 
-    return dataframe
+    calendar = build_calendar_table(*years)
+
+    first_day = np.datetime64("{:d}-01-01".format(years[0]), "D")
+    positions = (days - first_day).astype("int64")
+    positions[missing] = 0
+
+    return calendar, positions, missing
 
 
 def get_date_from_ymd(
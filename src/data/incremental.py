@@ -0,0 +1,473 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import pandas as pd
+import src
+from src import (
+    DAILY_REVENUE_CHUNK_SIZE,
+    DAILY_REVENUE_DTYPES,
+    PATH_DAILY_REVENUE,
+    PATH_DATA_AGGREGATES,
+    PATH_LISTINGS,
+)
+from src.commons import dump_dataframe_npz, hash_files, load_dataframe_npz
+from src.data import listing_ids, make_dataset
+from src.data.listing_ids import ListingDictionary
+from src.data.make_dataset import clean_daily_revenue_dataset, read_listings_dataset
+from src.features import build_features, company_revenue
+from src.features.build_features import build_listings_features
+from src.features.company_revenue import (
+    COMPANY_REVENUE_GROUPS,
+    add_company_revenue,
+    company_revenue_nights,
+    sum_company_revenue,
+)
+from src.instrumentation import traced
+
+# Number of bytes read at a time when scanning a source file.
+WATERMARK_BLOCK_SIZE = 1 << 20
+
+# Number of bytes hashed at each end of the ingested part of a source file.
+WATERMARK_WINDOW = 1 << 16
+
+
+class _BoundedReader(io.RawIOBase):
+    """Reads a binary file from its current position up to a number of
+    bytes, so a byte range of a file can be parsed as a csv file."""
+
+    def __init__(self, f, size: int):
+        self.f = f
+        self.remaining = size
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = self.f.readinto(memoryview(buffer)[: min(len(buffer), self.remaining)])
+        self.remaining -= size
+        return size
+
+
+def aggregates_key():
+    """Computes the key of the persisted aggregates from the listings file
+    and the source code computing the company revenue. The aggregates of
+    every source are recomputed when it changes.
+
+    Returns
+    -------
+    str
+        Hexadecimal digest identifying the current listings and code.
+    """
+    return hash_files(
+        [
+            PATH_LISTINGS,
+            src.__file__,
+            make_dataset.__file__,
+            build_features.__file__,
+            listing_ids.__file__,
+            company_revenue.__file__,
+            __file__,
+        ]
+    )
+
+
+def source_fingerprint(path: str, offset: int):
+    """Returns the hash of the first and the last WATERMARK_WINDOW bytes of
+    a file before an offset, such as the header and the last rows ingested.
+
+    Its cost does not grow with the file, so it is checked on every append.
+    A rewrite of the file changes these bytes, unless it leaves both ends of
+    the ingested rows as they were.
+    """
+    digest = hashlib.sha256(str(offset).encode("utf-8"))
+
+    with open(path, "rb") as f:
+        digest.update(f.read(min(offset, WATERMARK_WINDOW)))
+        tail = max(WATERMARK_WINDOW, offset - WATERMARK_WINDOW)
+        if tail < offset:
+            f.seek(tail)
+            digest.update(f.read(offset - tail))
+
+    return digest.hexdigest()
+
+
+def source_stat(path: str):
+    """Returns the size and the modification time of a file, which tell
+    whether it may have changed since it was ingested."""
+    stat = os.stat(path)
+
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def complete_lines_end(path: str):
+    """Returns the offset after the last line break of a file, so a line
+    being written is left for the next ingestion."""
+    with open(path, "rb") as f:
+        position = f.seek(0, os.SEEK_END)
+        while position > 0:
+            start = max(0, position - WATERMARK_BLOCK_SIZE)
+            f.seek(start)
+            newline = f.read(position - start).rfind(b"\n")
+            if newline >= 0:
+                return start + newline + 1
+            position = start
+
+    return 0
+
+
+def read_daily_revenue_range(
+    path: str, start: int, end: int, chunksize: int = DAILY_REVENUE_CHUNK_SIZE
+):
+    """Reads and cleans the rows of a byte range of a daily revenue file.
+
+    Parameters
+    ----------
+    path : str
+        Path to the daily revenue csv file.
+    start : int
+        Offset of the first row, after the header at least.
+    end : int
+        Offset after the last row.
+    chunksize : int, optional
+        Number of rows parsed at a time, by default DAILY_REVENUE_CHUNK_SIZE.
+
+    Yields
+    ------
+    pd.DataFrame
+        The cleaned chunks of the daily revenue dataframe.
+    """
+    with open(path, "rb") as f:
+        names = f.readline().decode("utf-8").strip().split(",")
+        start = max(start, f.tell())
+        if start >= end:
+            return
+
+        f.seek(start)
+        reader = pd.read_csv(
+            io.BufferedReader(_BoundedReader(f, end - start)),
+            header=None,
+            names=names,
+            usecols=list(DAILY_REVENUE_DTYPES),
+            dtype=DAILY_REVENUE_DTYPES,
+            chunksize=chunksize or DAILY_REVENUE_CHUNK_SIZE,
+        )
+        for chunk in reader:
+            yield clean_daily_revenue_dataset(chunk)
+
+
+def empty_sums():
+    """Returns the per date and per group running company revenue sums of
+    no nights, see `add_company_revenue`."""
+    per_group = pd.DataFrame(
+        {
+            "date": pd.Series(dtype="datetime64[ns]"),
+            "Categoria": pd.Series(dtype="Int8"),
+            "Quartos": pd.Series(dtype="Int8"),
+            "Localização": pd.Series(dtype=object),
+            "company_revenue": pd.Series(dtype=float),
+            "compensation": pd.Series(dtype=float),
+        }
+    )
+
+    return per_group[["date", "company_revenue", "compensation"]], per_group
+
+
+def merge_sums(tables):
+    """Adds up per date and per group sums of parts of the nights.
+
+    Parameters
+    ----------
+    tables : Iterable
+        Pairs of per date and per group running sums.
+
+    Returns
+    -------
+    tuple
+        Returns the per date and the per group sums of all the parts, with
+        the columns of `sum_company_revenue`. The sums of a single part are
+        returned as they are.
+    """
+    tables = [
+        tuple(table.drop(columns="compensation") for table in pair) for pair in tables
+    ] or [tuple(table.drop(columns="compensation") for table in empty_sums())]
+
+    if len(tables) == 1:
+        return tables[0]
+
+    return tuple(
+        sum_company_revenue(
+            pd.concat([table[i] for table in tables], ignore_index=True), by
+        )
+        for i, by in enumerate([(), COMPANY_REVENUE_GROUPS])
+    )
+
+
+class DailyAggregates:
+    """Company revenue sums of the daily revenue files, per date and per
+    (date, Categoria, Quartos, Localização), kept up to date by ingesting
+    only the rows appended to each file since the last run.
+
+    Each source file has a watermark, the offset after the last row
+    ingested with a hash of both ends of the bytes before it (see
+    `source_fingerprint`) and the size and modification time of the file,
+    and its own running sums (see `add_company_revenue`). A file whose size
+    and modification time are unchanged is skipped. The rows after the
+    watermark of a file that grew with the same ingested ends, such as a new
+    day of all listings, are added to the running sums; any other change of
+    the file, or of the listings, makes it ingested again from the start and
+    its sums replaced. With a single source, the sums are thus bit for bit
+    the ones of a full load of the file.
+
+    Parameters
+    ----------
+    key : str
+        Key of the listings and code, see `aggregates_key`.
+    sources : dict, optional
+        Watermark of each source path, by default none.
+    tables : dict, optional
+        Per date and per group sums of each source path, by default none.
+    """
+
+    def __init__(self, key: str, sources: dict = None, tables: dict = None):
+        self.key = key
+        self.sources = dict(sources or {})
+        self.tables = dict(tables or {})
+        self._sum_sources()
+
+    def _sum_sources(self):
+        """Sums the per date and per group running sums of every source."""
+        self.per_date, self.per_group = merge_sums(self.tables.values())
+
+    def ingest(
+        self,
+        source: str,
+        listings: ListingDictionary,
+        chunksize: int = DAILY_REVENUE_CHUNK_SIZE,
+    ):
+        """Adds the rows of a source file after its watermark to the sums.
+
+        Parameters
+        ----------
+        source : str
+            Path to a daily revenue csv file.
+        listings : ListingDictionary
+            Dictionary of the listings.
+        chunksize : int, optional
+            Number of rows parsed at a time, by default
+            DAILY_REVENUE_CHUNK_SIZE.
+
+        Returns
+        -------
+        int
+            Returns the number of rows ingested, after cleaning.
+        """
+        watermark = self.sources.get(source)
+        stat = source_stat(source)
+        if watermark is not None and all(
+            watermark.get(name) == value for name, value in stat.items()
+        ):
+            return 0
+
+        # A file of the same size with a new modification time was rewritten
+        # in place, which the fingerprint of its ends may not show.
+        start, per_date, per_group = 0, None, None
+        if (
+            watermark is not None
+            and stat["size"] > watermark["offset"]
+            and source_fingerprint(source, watermark["offset"])
+            == watermark["fingerprint"]
+        ):
+            start = watermark["offset"]
+            per_date, per_group = self.tables[source]
+
+        end = complete_lines_end(source)
+        rows = 0
+        for chunk in read_daily_revenue_range(source, start, end, chunksize):
+            nights = company_revenue_nights(listings, chunk)
+            per_date = add_company_revenue(per_date, nights)
+            per_group = add_company_revenue(per_group, nights, COMPANY_REVENUE_GROUPS)
+            rows += len(chunk)
+
+        if per_date is None:
+            per_date, per_group = empty_sums()
+
+        self.tables[source] = (per_date, per_group)
+        self.sources[source] = dict(
+            stat, offset=end, fingerprint=source_fingerprint(source, end)
+        )
+        self._sum_sources()
+
+        return rows
+
+    def save(self, path: str = PATH_DATA_AGGREGATES):
+        """Writes the watermarks and the sums of each source to a directory.
+
+        The files are written to a temporary directory next to it, which
+        then replaces it, so an interrupted save leaves the previous
+        aggregates, or none, never watermarks without their sums.
+
+        Parameters
+        ----------
+        path : str, optional
+            Path of the directory, created if needed, by default
+            PATH_DATA_AGGREGATES.
+        """
+        path = os.path.normpath(path)
+        parent = os.path.dirname(os.path.abspath(path))
+        os.makedirs(parent, exist_ok=True)
+        staging = tempfile.mkdtemp(prefix=os.path.basename(path) + ".", dir=parent)
+
+        try:
+            files = {}
+            for source, (per_date, per_group) in self.tables.items():
+                name = hashlib.sha256(source.encode("utf-8")).hexdigest()[:16]
+                files[source] = name
+                dump_dataframe_npz(
+                    per_date, os.path.join(staging, "date-" + name + ".npz")
+                )
+                dump_dataframe_npz(
+                    per_group, os.path.join(staging, "group-" + name + ".npz")
+                )
+
+            with open(os.path.join(staging, "state.json"), "w", encoding="utf-8") as f:
+                json.dump(
+                    {
+                        "key": self.key,
+                        "sources": {
+                            source: dict(watermark, file=files[source])
+                            for source, watermark in self.sources.items()
+                        },
+                    },
+                    f,
+                    indent=2,
+                )
+
+            if os.path.exists(path):
+                retired = staging + ".old"
+                os.rename(path, retired)
+                os.rename(staging, path)
+                shutil.rmtree(retired)
+            else:
+                os.rename(staging, path)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+    @classmethod
+    def load(cls, path: str = PATH_DATA_AGGREGATES):
+        """Reads the aggregates written by `save`.
+
+        Parameters
+        ----------
+        path : str, optional
+            Path of the directory, by default PATH_DATA_AGGREGATES.
+
+        Returns
+        -------
+        DailyAggregates
+            Returns the aggregates, empty if none were saved.
+        """
+        if not os.path.exists(os.path.join(path, "state.json")):
+            return cls(None)
+
+        with open(os.path.join(path, "state.json"), "r", encoding="utf-8") as f:
+            state = json.load(f)
+
+        sources, tables = {}, {}
+        for source, watermark in state["sources"].items():
+            name = watermark.pop("file")
+            sources[source] = watermark
+            tables[source] = (
+                load_dataframe_npz(os.path.join(path, "date-" + name + ".npz")),
+                load_dataframe_npz(os.path.join(path, "group-" + name + ".npz")),
+            )
+
+        return cls(state["key"], sources, tables)
+
+
+@traced
+def update_daily_aggregates(
+    paths: list = None,
+    path: str = PATH_DATA_AGGREGATES,
+    chunksize: int = DAILY_REVENUE_CHUNK_SIZE,
+    reset: bool = False,
+):
+    """Ingests the rows appended to daily revenue files since the last run
+    into the persisted company revenue sums.
+
+    Parameters
+    ----------
+    paths : list, optional
+        Paths of the daily revenue csv files, by default [PATH_DAILY_REVENUE].
+        Sources ingested by earlier runs keep their sums.
+    path : str, optional
+        Directory of the persisted aggregates, by default
+        PATH_DATA_AGGREGATES.
+    chunksize : int, optional
+        Number of rows parsed at a time, by default DAILY_REVENUE_CHUNK_SIZE.
+    reset : bool, optional
+        Whether to discard the persisted aggregates and ingest the files
+        from the start, by default False.
+
+    Returns
+    -------
+    tuple
+        Returns the updated aggregates, also written to path if they
+        changed, and the number of rows ingested from each path.
+    """
+    paths = [PATH_DAILY_REVENUE] if paths is None else list(paths)
+
+    aggregates = DailyAggregates.load(path)
+    saved_key, saved_sources = aggregates.key, dict(aggregates.sources)
+    key = aggregates_key()
+
+    if reset or aggregates.key != key:
+        # The listings changed: the sources still on disk are ingested again.
+        paths += [source for source in aggregates.sources if os.path.exists(source)]
+        aggregates = DailyAggregates(key)
+
+    listings = ListingDictionary(build_listings_features(read_listings_dataset()))
+
+    ingested = {
+        source: aggregates.ingest(source, listings, chunksize)
+        for source in dict.fromkeys(paths)
+    }
+
+    # Left untouched when nothing changed, so the stages reading the
+    # aggregates are not rerun.
+    if aggregates.key != saved_key or aggregates.sources != saved_sources:
+        aggregates.save(path)
+
+    return aggregates, ingested
+
+
+def main():
+    """Command line entry point of the incremental ingestion."""
+    parser = argparse.ArgumentParser(description="Incremental daily ingestion")
+    parser.add_argument("paths", nargs="*", default=[PATH_DAILY_REVENUE])
+    parser.add_argument("--output", default=PATH_DATA_AGGREGATES)
+    parser.add_argument("--chunksize", type=int, default=DAILY_REVENUE_CHUNK_SIZE)
+    parser.add_argument("--reset", action="store_true")
+    args = parser.parse_args()
+
+    aggregates, ingested = update_daily_aggregates(
+        args.paths, args.output, args.chunksize, args.reset
+    )
+
+    for source, rows in ingested.items():
+        print("Ingested {:d} rows of {}".format(rows, source))
+    print(
+        "Company revenue of {:d} dates and {:d} (date, group) pairs in {}".format(
+            len(aggregates.per_date), len(aggregates.per_group), args.output
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import numpy as np
+import pandas as pd
+
+# Value of the uint8 and int16 cells without data: nights absent from the
+# daily revenue dataset, or missing and negative lead times. Float cells
+# without data are NaN.
+CALENDAR_MISSING_FLAG = 255
+CALENDAR_MISSING_LEAD_TIME = -1
+
+CALENDAR_ARRAYS = {
+    "occupancy": np.uint8,
+    "blocked": np.uint8,
+    "revenue": np.float32,
+    "price": np.float32,
+    "lead_time": np.int16,
+}
+
+CALENDAR_FILL_VALUES = {
+    "occupancy": CALENDAR_MISSING_FLAG,
+    "blocked": CALENDAR_MISSING_FLAG,
+    "revenue": np.nan,
+    "price": np.nan,
+    "lead_time": CALENDAR_MISSING_LEAD_TIME,
+}
+
+
+class ListingCalendar:
+    """Dense listing x day representation of the daily revenue dataset.
+
+    Every night is a cell of 2D arrays indexed by the listing id, its row,
+    and the day ordinal, its column, so slicing by listing, by date or by
+    both is plain array indexing instead of a scan of the long table. The
+    arrays are 'occupancy' and 'blocked' (uint8), 'revenue' and 'price'
+    (float32, the last offered price) and 'lead_time' (int16, the
+    reservation advance in days).
+
+    Parameters
+    ----------
+    listings : np.ndarray
+        Listing code of each row.
+    dates : np.ndarray
+        Date of each column, as datetime64[D].
+    arrays : dict
+        The 2D arrays, of shape (len(listings), len(dates)), by name.
+    """
+
+    def __init__(self, listings: np.ndarray, dates: np.ndarray, arrays: dict):
+        self.listings = np.asarray(listings)
+        self.dates = np.asarray(dates, dtype="datetime64[D]")
+        self.arrays = arrays
+
+        for name in CALENDAR_ARRAYS:
+            setattr(self, name, arrays[name])
+
+    @property
+    def shape(self):
+        return len(self.listings), len(self.dates)
+
+    @classmethod
+    def from_daily_revenue(cls, df_daily_revenue: pd.DataFrame):
+        """Builds the calendar of a daily revenue dataset, from the first to
+        the last date, with one row per listing category or code.
+
+        Parameters
+        ----------
+        df_daily_revenue : pd.DataFrame
+            Pandas dataframe with information about daily revenue, with the
+            'reservation_advance_days' feature.
+
+        Returns
+        -------
+        ListingCalendar
+            Returns the calendar. When a night appears more than once, the
+            last row is kept. Rows without a listing or a date are left out.
+
+        Raises
+        ------
+        ValueError
+            If a lead time does not fit the int16 cells.
+        """
+        listings = pd.Categorical(df_daily_revenue["listing"])
+        days = df_daily_revenue["date"].to_numpy().astype("datetime64[D]")
+
+        known = (listings.codes >= 0) & ~np.isnat(days)
+        rows = listings.codes[known].astype(np.intp)
+        days = days[known]
+
+        first = days.min() if len(days) else np.datetime64("NaT", "D")
+        columns = (days - first).astype(np.intp)
+        n_days = int(columns.max()) + 1 if len(columns) else 0
+
+        values = {
+            "occupancy": df_daily_revenue["occupancy"],
+            "blocked": df_daily_revenue["blocked"],
+            "revenue": df_daily_revenue["revenue"],
+            "price": df_daily_revenue["last_offered_price"],
+            "lead_time": df_daily_revenue["reservation_advance_days"],
+        }
+
+        arrays = {}
+        for name, dtype in CALENDAR_ARRAYS.items():
+            fill = CALENDAR_FILL_VALUES[name]
+            cells = values[name].to_numpy(dtype=np.float64, na_value=np.nan)[known]
+            if name == "lead_time":
+                cells[cells < 0] = np.nan
+            if np.issubdtype(dtype, np.integer):
+                limits = np.iinfo(dtype)
+                if np.any((cells < limits.min) | (cells > limits.max)):
+                    raise ValueError(
+                        "{} out of the range of {}".format(name, np.dtype(dtype))
+                    )
+            arrays[name] = np.full((len(listings.categories), n_days), fill, dtype)
+            arrays[name][rows, columns] = np.where(np.isnan(cells), fill, cells)
+
+        return cls(
+            np.asarray(listings.categories.astype(str)),
+            first + np.arange(n_days),
+            arrays,
+        )
+
+    def save(self, path: str):
+        """Writes the calendar to a directory, one .npy file per array, so
+        it can be memory-mapped by `load`.
+
+        Parameters
+        ----------
+        path : str
+            Path of the directory, created if needed.
+        """
+        os.makedirs(path, exist_ok=True)
+
+        for name in CALENDAR_ARRAYS:
+            np.save(
+                os.path.join(path, name + ".npy"),
+                np.ascontiguousarray(self.arrays[name]),
+            )
+        np.save(os.path.join(path, "listings.npy"), self.listings.astype(str))
+
+        with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "start": str(self.dates[0]) if len(self.dates) else None,
+                    "n_days": len(self.dates),
+                },
+                f,
+            )
+
+    @classmethod
+    def load(cls, path: str, mmap_mode: str = "r"):
+        """Reads a calendar written by `save`.
+
+        Parameters
+        ----------
+        path : str
+            Path of the directory.
+        mmap_mode : str, optional
+            Memory-map mode of np.load, by default "r", so only the slices
+            accessed are read from disk. None reads the arrays in memory.
+
+        Returns
+        -------
+        ListingCalendar
+            Returns the calendar.
+        """
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+
+        arrays = {
+            name: np.load(os.path.join(path, name + ".npy"), mmap_mode=mmap_mode)
+            for name in CALENDAR_ARRAYS
+        }
+        dates = (
+            np.datetime64(meta["start"], "D") + np.arange(meta["n_days"])
+            if meta["start"]
+            else np.array([], dtype="datetime64[D]")
+        )
+
+        return cls(np.load(os.path.join(path, "listings.npy")), dates, arrays)
+
+    def listing_positions(self, listings):
+        """Returns the rows of listing codes, -1 for unknown codes."""
+        return pd.Index(self.listings).get_indexer(np.atleast_1d(listings))
+
+    def day_positions(self, dates):
+        """Returns the columns of dates, -1 for dates out of the calendar."""
+        dates = np.atleast_1d(np.asarray(dates, dtype="datetime64[D]"))
+        if not len(self.dates):
+            return np.full(len(dates), -1, dtype=np.intp)
+
+        positions = (dates - self.dates[0]).astype(np.intp)
+        outside = (positions < 0) | (positions >= len(self.dates))
+
+        return np.where(outside, -1, positions)
+
+    def day_of_year_positions(self, month: int, day: int):
+        """Returns the columns of a day of the year, such as every 31st of
+        December, in the calendar."""
+        dates = pd.DatetimeIndex(self.dates)
+
+        return np.flatnonzero((dates.month == month) & (dates.day == day))
+
+    def select(self, listings=None, start: str = None, end: str = None, dates=None):
+        """Selects rows and columns of the calendar.
+
+        A range of dates, from start to end inclusive, gives views of the
+        arrays, which stay memory-mapped; a list of listings or dates gives
+        copies of the rows or columns selected.
+
+        Parameters
+        ----------
+        listings : list, optional
+            Listing codes, by default None (all listings).
+        start : str, optional
+            First date, by default None (the first date of the calendar).
+        end : str, optional
+            Last date, included, by default None (the last date).
+        dates : list, optional
+            Dates to select instead of a range, by default None.
+
+        Returns
+        -------
+        ListingCalendar
+            Returns the selected calendar.
+        """
+        if dates is not None:
+            columns = self.day_positions(dates)
+            columns = columns[columns >= 0]
+        else:
+            first, last = 0, len(self.dates)
+            if start is not None:
+                first = np.searchsorted(self.dates, np.datetime64(start, "D"))
+            if end is not None:
+                last = np.searchsorted(self.dates, np.datetime64(end, "D"), "right")
+            columns = slice(first, last)
+
+        rows = slice(None)
+        if listings is not None:
+            rows = self.listing_positions(listings)
+            rows = rows[rows >= 0]
+
+        if isinstance(rows, slice) or isinstance(columns, slice):
+            arrays = {
+                name: array[rows][:, columns] for name, array in self.arrays.items()
+            }
+        else:
+            arrays = {
+                name: array[np.ix_(rows, columns)]
+                for name, array in self.arrays.items()
+            }
+
+        return ListingCalendar(self.listings[rows], self.dates[columns], arrays)
+
+    def reserved(self):
+        """Returns the mask of the nights occupied and not blocked."""
+        return (self.occupancy == 1) & (self.blocked == 0)
+
+    def to_frame(self):
+        """Returns the nights of the calendar with a known occupancy as a
+        long table.
+
+        Returns
+        -------
+        pd.DataFrame
+            Returns a dataframe with the columns 'listing', 'date',
+            'occupancy', 'blocked', 'revenue', 'last_offered_price' and
+            'reservation_advance_days'.
+        """
+        rows, columns = np.nonzero(np.asarray(self.occupancy) != CALENDAR_MISSING_FLAG)
+        lead_time = self.lead_time[rows, columns].astype(np.float64)
+        lead_time[lead_time == CALENDAR_MISSING_LEAD_TIME] = np.nan
+
+        return pd.DataFrame(
+            {
+                "listing": self.listings[rows],
+                "date": self.dates[columns].astype("datetime64[ns]"),
+                "occupancy": self.occupancy[rows, columns],
+                "blocked": self.blocked[rows, columns],
+                "revenue": self.revenue[rows, columns],
+                "last_offered_price": self.price[rows, columns],
+                "reservation_advance_days": lead_time,
+            }
+        )
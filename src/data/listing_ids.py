@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+
+LISTING_ATTRIBUTES = ["Comissão", "Categoria", "Quartos", "Localização"]
+
+# Id of the listing codes absent from the listings dataset.
+LISTING_MISSING_ID = -1
+
+
+class ListingDictionary:
+    """Dictionary of listing codes to dense int32 ids, with the listing
+    attributes held in arrays indexed by id.
+
+    The nights are joined to their listing without hashing codes per row:
+    the categories of the daily revenue 'listing' column are looked up once,
+    which maps every category code to an id, and the attributes of each
+    night are a `take` of the attribute arrays at the ids.
+
+    Parameters
+    ----------
+    df_listings : pd.DataFrame
+        Pandas dataframe with information about listings.
+    attributes : list, optional
+        Columns of the listings held by id, by default LISTING_ATTRIBUTES.
+    """
+
+    def __init__(self, df_listings: pd.DataFrame, attributes: list = None):
+        listings = df_listings.drop_duplicates("Código")
+
+        self.codes = pd.Index(listings["Código"].astype(str), name="Código")
+        self.ids = np.arange(len(self.codes), dtype=np.int32)
+        self.attributes = {
+            name: listings[name].array
+            for name in (LISTING_ATTRIBUTES if attributes is None else attributes)
+        }
+
+    def __len__(self):
+        return len(self.codes)
+
+    def lookup(self, codes):
+        """Returns the ids of listing codes, LISTING_MISSING_ID for unknown
+        codes.
+
+        Parameters
+        ----------
+        codes : array-like
+            Listing codes.
+
+        Returns
+        -------
+        np.ndarray
+            Returns the int32 id of each code.
+        """
+        codes = pd.Index(np.atleast_1d(np.asarray(codes)).astype(str))
+
+        return self.codes.get_indexer(codes).astype(np.int32)
+
+    def listing_ids(self, listings):
+        """Returns the id of the listing of each night.
+
+        Parameters
+        ----------
+        listings : pd.Series or pd.Categorical
+            Listing code of each night, such as the 'listing' column of the
+            daily revenue dataset. Categorical codes are looked up once per
+            category.
+
+        Returns
+        -------
+        np.ndarray
+            Returns the int32 id of each night, LISTING_MISSING_ID for the
+            listings absent from the dictionary.
+        """
+        listings = pd.Categorical(listings)
+        ids = np.append(self.lookup(listings.categories), LISTING_MISSING_ID)
+
+        # Missing listings have the category code -1, the last id appended.
+        return ids[listings.codes]
+
+    def take(self, ids: np.ndarray, name: str):
+        """Returns an attribute of listing ids.
+
+        Parameters
+        ----------
+        ids : np.ndarray
+            Listing ids.
+        name : str
+            Name of the attribute.
+
+        Returns
+        -------
+        pd.api.extensions.ExtensionArray
+            Returns the attribute of each id, with the dtype of the listings
+            column, and missing for LISTING_MISSING_ID.
+        """
+        return self.attributes[name].take(ids, allow_fill=True)
+
+    def enrich(self, dataframe: pd.DataFrame, listing_column: str = "listing"):
+        """Adds the listing attributes to a table of nights, as a left join
+        of the listings on the listing code would.
+
+        Parameters
+        ----------
+        dataframe : pd.DataFrame
+            Table with a listing code column.
+        listing_column : str, optional
+            Name of the listing code column, by default "listing".
+
+        Returns
+        -------
+        pd.DataFrame
+            Returns a new dataframe with the columns of the attributes added.
+        """
+        ids = self.listing_ids(dataframe[listing_column])
+
+        return dataframe.assign(
+            **{
+                name: pd.Series(self.take(ids, name), index=dataframe.index)
+                for name in self.attributes
+            }
+        )
@@ -1,36 +1,200 @@
 # -*- coding: utf-8 -*-
 
+import glob
+import hashlib
+import os
+import shutil
 import pandas as pd
 import numpy as np
+import src
 from src import (
+    DAILY_REVENUE_CHUNK_SIZE,
+    DAILY_REVENUE_DTYPES,
+    LISTINGS_DTYPES,
+    LISTINGS_INT8_COLUMNS,
+    LISTINGS_MIXED_DECIMAL_COLUMNS,
+    LISTINGS_NA_VALUES,
     FEATURES_PRICE_MODEL_Q1,
     FEATURES_REVENUE_MODEL_Q1,
     PATH_DAILY_REVENUE,
+    PATH_DATA_CACHE,
     PATH_LISTINGS,
+    PATH_RAW_DIGESTS,
     REFERENCE_DATE,
 )
+from src import commons
+from src.commons import (
+    dump_dataframe_npz,
+    file_digest,
+    hash_files,
+    load_dataframe_npz,
+)
+from src.data import listing_calendar
+from src.data.listing_calendar import ListingCalendar
+from src.instrumentation import traced
+from src.features import build_features
 from src.features.build_features import (
     build_daily_features,
     build_date_features,
     build_listings_features,
 )
+from src.models.preprocessing import DesignMatrixEncoder
 
 
-def load_data():
+@traced
+def load_data(use_cache: bool = True, chunksize: int = DAILY_REVENUE_CHUNK_SIZE):
     """Loads the datasets to be used on analysis.
 
+    The cleaned and featured datasets are cached on disk as columnar numpy
+    archives. The cache is keyed by a hash of the raw files and of the
+    cleaning code, so it is rebuilt whenever any of them changes.
+
+    Parameters
+    ----------
+    use_cache : bool, optional
+        Whether to read and write the on-disk cache, by default True.
+    chunksize : int, optional
+        Number of rows of the daily revenue file parsed at a time, by default
+        DAILY_REVENUE_CHUNK_SIZE. If None, the file is read in a single pass.
+
     Returns
     -------
     tuple
         Returns respectively the listings and the daily revenue datasets.
     """
-    # Importing Datasets
-    df_listings = pd.read_csv(PATH_LISTINGS)
-    df_daily_revenue = pd.read_csv(PATH_DAILY_REVENUE)
+    if use_cache:
+        key = dataset_cache_key()
+        path_listings, path_daily_revenue = dataset_cache_paths(key)
+
+        if os.path.exists(path_listings) and os.path.exists(path_daily_revenue):
+            return (
+                load_dataframe_npz(path_listings),
+                load_dataframe_npz(path_daily_revenue),
+            )
+
+    df_listings, df_daily_revenue = process_data(chunksize)
+
+    if use_cache:
+        # Each archive replaces its path once complete, and the stale ones
+        # are only removed then, so an interrupted run leaves a usable cache.
+        dump_dataframe_npz(df_listings, path_listings)
+        dump_dataframe_npz(df_daily_revenue, path_daily_revenue)
+        for path in glob.glob(os.path.join(PATH_DATA_CACHE, "*.npz")):
+            if path not in (path_listings, path_daily_revenue):
+                os.remove(path)
+
+    return df_listings, df_daily_revenue
+
+
+@traced
+def load_listing_calendar(
+    df_daily_revenue: pd.DataFrame = None, use_cache: bool = True
+):
+    """Loads the dense listing x day calendar of the daily revenue dataset.
+
+    The calendar of the datasets of `load_data` is cached next to them,
+    under the same key, and is memory-mapped when read from the cache. The
+    calendar of a given dataframe is always built, as the cache key does not
+    identify it.
+
+    Parameters
+    ----------
+    df_daily_revenue : pd.DataFrame, optional
+        Pandas dataframe with information about daily revenue, by default
+        None (loaded with `load_data` if the calendar is not cached).
+    use_cache : bool, optional
+        Whether to read and write the on-disk cache when df_daily_revenue is
+        None, by default True.
+
+    Returns
+    -------
+    ListingCalendar
+        Returns the calendar.
+    """
+    if df_daily_revenue is not None:
+        return ListingCalendar.from_daily_revenue(df_daily_revenue)
+
+    if use_cache:
+        key = dataset_cache_key()[:16] + hash_files([listing_calendar.__file__])[:8]
+        path = os.path.join(PATH_DATA_CACHE, "calendar-{}".format(key))
+        if os.path.exists(os.path.join(path, "meta.json")):
+            return ListingCalendar.load(path)
+
+    _, df_daily_revenue = load_data(use_cache)
+    calendar = ListingCalendar.from_daily_revenue(df_daily_revenue)
+
+    if use_cache:
+        for stale in glob.glob(os.path.join(PATH_DATA_CACHE, "calendar-*")):
+            shutil.rmtree(stale)
+        calendar.save(path)
+
+    return calendar
+
+
+def dataset_cache_key():
+    """Computes the key of the datasets cache from the raw files and
+    the source code of the cleaning and feature building steps.
+
+    The raw files are only hashed again when their size or modification
+    time changed, see `file_digest`.
+
+    Returns
+    -------
+    str
+        Hexadecimal digest identifying the current inputs.
+    """
+    digest = hashlib.sha256()
 
-    # Data Cleaning
-    df_listings = clean_listings_dataset(df_listings)
-    df_daily_revenue = clean_daily_revenue_dataset(df_daily_revenue)
+    for path in [PATH_LISTINGS, PATH_DAILY_REVENUE]:
+        digest.update(file_digest(path, PATH_RAW_DIGESTS).encode("utf-8"))
+
+    digest.update(
+        hash_files(
+            [src.__file__, commons.__file__, __file__, build_features.__file__]
+        ).encode("utf-8")
+    )
+
+    return digest.hexdigest()
+
+
+def dataset_cache_paths(key: str):
+    """Returns the cache file paths of the listings and daily revenue
+    datasets for a given cache key.
+
+    Parameters
+    ----------
+    key : str
+        Cache key as returned by `dataset_cache_key`.
+
+    Returns
+    -------
+    tuple
+        Returns respectively the listings and the daily revenue cache paths.
+    """
+    return (
+        os.path.join(PATH_DATA_CACHE, "listings-{}.npz".format(key[:16])),
+        os.path.join(PATH_DATA_CACHE, "daily_revenue-{}.npz".format(key[:16])),
+    )
+
+
+@traced
+def process_data(chunksize: int = DAILY_REVENUE_CHUNK_SIZE):
+    """Reads, cleans and builds the features of the raw datasets.
+
+    Parameters
+    ----------
+    chunksize : int, optional
+        Number of rows of the daily revenue file parsed at a time, by default
+        DAILY_REVENUE_CHUNK_SIZE. If None, the file is read in a single pass.
+
+    Returns
+    -------
+    tuple
+        Returns respectively the listings and the daily revenue datasets.
+    """
+    # Importing and Cleaning Datasets
+    df_listings = read_listings_dataset(PATH_LISTINGS)
+    df_daily_revenue = read_daily_revenue_dataset(PATH_DAILY_REVENUE, chunksize)
 
     # Building Features
     df_listings = build_listings_features(df_listings)
@@ -39,108 +203,233 @@ def load_data():
     return df_listings, df_daily_revenue
 
 
-def clean_listings_dataset(df_listings: pd.DataFrame):
-    """Data cleaning and casting process for listings dataset.
+def count_csv_rows(path: str, chunk_size: int = 1 << 20):
+    """Counts the rows of a csv file after its header, without parsing it.
 
     Parameters
     ----------
-    df_listings : pd.DataFrame
-        Pandas dataframe with information about listings.
+    path : str
+        Path to the csv file.
+    chunk_size : int, optional
+        Number of bytes read at a time, by default 1 MiB.
 
     Returns
     -------
-    pd.DataFrame
-        Returns the listing dataframe with the casting and missing
-        treatment made.
+    int
+        Returns the number of lines after the first one.
     """
+    lines, last = 0, b"\n"
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            lines += block.count(b"\n")
+            last = block[-1:]
+
+    return max(lines + (last != b"\n") - 1, 0)
+
+
+class _ColumnsBuffer:
+    """Typed arrays of a given number of rows filled chunk by chunk, for
+    numpy, datetime, nullable integer and categorical columns. The
+    categories are merged in order of appearance and sorted at the end, as
+    a single pass of read_csv sorts them, so the codes do not depend on
+    the chunk size."""
+
+    def __init__(self, chunk: pd.DataFrame, capacity: int):
+        self.size = 0
+        self.arrays = {}
+        self.categories = {}
+
+        for column in chunk.columns:
+            dtype = chunk[column].dtype
+            if isinstance(dtype, pd.CategoricalDtype):
+                self.categories[column] = pd.Index([], dtype=dtype.categories.dtype)
+                self.arrays[column] = np.empty(capacity, dtype=np.int32)
+            elif isinstance(dtype, pd.api.extensions.ExtensionDtype):
+                self.arrays[column] = (
+                    np.empty(capacity, dtype=dtype.numpy_dtype),
+                    np.empty(capacity, dtype=bool),
+                )
+            else:
+                self.arrays[column] = np.empty(capacity, dtype=dtype)
+
+    def append(self, chunk: pd.DataFrame):
+        """Copies the rows of a chunk after the rows already filled."""
+        rows = slice(self.size, self.size + len(chunk))
+
+        for column, array in self.arrays.items():
+            values = chunk[column].array
+            if column in self.categories:
+                known = self.categories[column]
+                known = known.append(values.categories.difference(known, sort=False))
+                self.categories[column] = known
+                positions = np.append(known.get_indexer(values.categories), -1)
+                array[rows] = positions[values.codes]
+            elif isinstance(array, tuple):
+                array[0][rows] = values.to_numpy(
+                    dtype=array[0].dtype, na_value=0, copy=False
+                )
+                array[1][rows] = values.isna()
+            else:
+                values = values.to_numpy()
+                if array.dtype < values.dtype:
+                    # A wider dtype than the previous chunks, such as dates
+                    # parsed with a finer unit, as pd.concat would promote.
+                    array = self.arrays[column] = array.astype(values.dtype)
+                array[rows] = values
+
+        self.size += len(chunk)
+
+    def to_frame(self):
+        """Returns the rows filled as a dataframe sharing the arrays."""
+        rows = slice(0, self.size)
+        columns = {}
+
+        for column, array in self.arrays.items():
+            if column in self.categories:
+                categories = self.categories[column]
+                order = categories.argsort()
+                ranks = np.empty(len(order) + 1, dtype=np.int32)
+                ranks[order] = np.arange(len(order), dtype=np.int32)
+                ranks[-1] = -1
+                array[rows] = ranks[array[rows]]
+                columns[column] = pd.Categorical.from_codes(
+                    array[rows], categories=categories[order]
+                )
+            elif isinstance(array, tuple):
+                columns[column] = pd.arrays.IntegerArray(array[0][rows], array[1][rows])
+            else:
+                columns[column] = array[rows]
+
+        return pd.DataFrame(columns, copy=False)
+
+
+@traced
+def read_daily_revenue_dataset(
+    path: str = PATH_DAILY_REVENUE, chunksize: int = DAILY_REVENUE_CHUNK_SIZE
+):
+    """Reads and cleans the daily revenue dataset in chunks of bounded size.
+
+    Each chunk is parsed with the compact dtypes of DAILY_REVENUE_DTYPES and
+    cleaned (casting, clipping and reference date filtering) before the next
+    one is read, so the raw file is never held in memory as a whole. The
+    cleaned rows are copied into typed arrays allocated once for all the
+    rows of the file, which the returned dataframe shares, so the peak
+    memory is these arrays plus one chunk instead of twice the dataframe.
 
-    df_listings["Comissão"] = (
-        df_listings["Comissão"].str.replace(",", ".").astype(float)
-    )
+    Parameters
+    ----------
+    path : str, optional
+        Path to the daily revenue csv file, by default PATH_DAILY_REVENUE.
+    chunksize : int, optional
+        Number of rows parsed at a time, by default DAILY_REVENUE_CHUNK_SIZE.
+        If None, the file is read in a single pass.
 
-    df_listings["Cama Casal"] = (
-        df_listings["Cama Casal"]
-        .replace("Quantidade de Camas Casal", np.nan)
-        .str.replace(",", ".")
-        .astype(float)
-        .clip(-128, 127)
-        .astype("Int8")
+    Returns
+    -------
+    pd.DataFrame
+        Returns the cleaned daily revenue dataframe.
+    """
+    reader = pd.read_csv(
+        path,
+        usecols=list(DAILY_REVENUE_DTYPES),
+        dtype=DAILY_REVENUE_DTYPES,
+        chunksize=chunksize,
     )
 
-    df_listings["Cama Solteiro"] = (
-        df_listings["Cama Solteiro"]
-        .replace("Quantidade de Camas Solteiro", np.nan)
-        .str.replace(",", ".")
-        .astype(float)
-        .clip(-128, 127)
-        .astype("Int8")
-    )
+    if chunksize is None:
+        return clean_daily_revenue_dataset(reader).reset_index(drop=True)
 
-    df_listings["Cama Queen"] = (
-        df_listings["Cama Queen"]
-        .replace("Quantidade de Camas Queen", np.nan)
-        .str.replace(",", ".")
-        .astype(float)
-        .clip(-128, 127)
-        .astype("Int8")
-    )
+    buffer = None
+    for chunk in reader:
+        chunk = clean_daily_revenue_dataset(chunk)
+        if buffer is None:
+            buffer = _ColumnsBuffer(chunk, count_csv_rows(path))
+        buffer.append(chunk)
 
-    df_listings["Cama King"] = (
-        df_listings["Cama King"]
-        .replace("Quantidade de Camas King", np.nan)
-        .str.replace(",", ".")
-        .astype(float)
-        .clip(-128, 127)
-        .astype("Int8")
-    )
+    if buffer is None:
+        return clean_daily_revenue_dataset(
+            pd.read_csv(
+                path,
+                usecols=list(DAILY_REVENUE_DTYPES),
+                dtype=DAILY_REVENUE_DTYPES,
+                nrows=0,
+            )
+        )
 
-    df_listings["Sofá Cama Solteiro"] = (
-        df_listings["Sofá Cama Solteiro"]
-        .replace("Quantidade de Sofás Cama Solteiro", np.nan)
-        .str.replace(",", ".")
-        .astype(float)
-        .clip(-128, 127)
-        .astype("Int8")
-    )
+    return buffer.to_frame()
 
-    df_listings["Travesseiros"] = (
-        df_listings["Travesseiros"]
-        .str.replace(",", ".")
-        .astype(float)
-        .clip(-128, 127)
-        .astype("Int8")
-    )
 
-    df_listings["Banheiros"] = (
-        df_listings["Banheiros"]
-        .replace("Banheiros", np.nan)
-        .str.replace(",", ".")
-        .astype(float)
-        .round(0)
-        .clip(-128, 127)
-        .astype("Int8")
-    )
+def parse_decimal(text: str):
+    """Parses a number written with a comma or a dot as decimal separator,
+    returning NaN for empty cells and header sentinels."""
+    text = text.strip()
 
-    df_listings["Taxa de Limpeza"] = (
-        df_listings["Taxa de Limpeza"].str.replace(",", ".").astype(float)
-    )
+    try:
+        return float(text.replace(",", "."))
+    except ValueError:
+        return np.nan
 
-    df_listings["Capacidade"] = (
-        df_listings["Capacidade"]
-        .replace("Capacidade", np.nan)
-        .str.replace(",", ".")
-        .astype(float)
-        .clip(-128, 127)
-        .astype("Int8")
-    )
 
-    df_listings["Data Inicial do contrato"] = pd.to_datetime(
-        df_listings["Data Inicial do contrato"], dayfirst=True
+@traced
+def read_listings_dataset(path: str = PATH_LISTINGS):
+    """Reads and cleans the listings dataset.
+
+    The numeric columns are parsed by the csv reader itself, with the
+    declared dtypes of LISTINGS_DTYPES, comma decimals and the repeated
+    header rows of LISTINGS_NA_VALUES read as missing values, and the
+    contract dates are parsed day first.
+
+    Parameters
+    ----------
+    path : str, optional
+        Path to the listings csv file, by default PATH_LISTINGS.
+
+    Returns
+    -------
+    pd.DataFrame
+        Returns the cleaned listings dataframe.
+    """
+    df_listings = pd.read_csv(
+        path,
+        decimal=",",
+        dtype=LISTINGS_DTYPES,
+        na_values=LISTINGS_NA_VALUES,
+        converters={column: parse_decimal for column in LISTINGS_MIXED_DECIMAL_COLUMNS},
+        parse_dates=["Data Inicial do contrato"],
+        dayfirst=True,
     )
 
+    return clean_listings_dataset(df_listings)
+
+
+@traced
+def clean_listings_dataset(df_listings: pd.DataFrame):
+    """Data cleaning and casting process for listings dataset.
+
+    Parameters
+    ----------
+    df_listings : pd.DataFrame
+        Pandas dataframe with information about listings, as parsed by
+        `read_listings_dataset`.
+
+    Returns
+    -------
+    pd.DataFrame
+        Returns the listing dataframe with the counts of beds, pillows,
+        bathrooms and guests rounded to Int8.
+    """
+
+    counts = df_listings[LISTINGS_INT8_COLUMNS].to_numpy(dtype=np.float32)
+
+    counts = np.clip(np.round(counts), -128, 127)
+
+    for j, column in enumerate(LISTINGS_INT8_COLUMNS):
+        df_listings[column] = pd.array(counts[:, j], dtype="Int8")
+
     return df_listings
 
 
+@traced
 def clean_daily_revenue_dataset(df_daily_revenue: pd.DataFrame):
     """Data cleaning and casting process for daily revenue dataset.
 
@@ -175,61 +464,60 @@ def clean_daily_revenue_dataset(df_daily_revenue: pd.DataFrame):
     return df_daily_revenue
 
 
-def make_predict_dataset_price_q1():
-    """Creates the dataset to apply the price model
-    to answer question 1.
+@traced
+def make_predict_dataset(
+    features: list,
+    dates: list,
+    categoria,
+    quartos,
+    localizacao,
+):
+    """Creates the dataset to apply a listing level model (price or
+    revenue) to a set of dates and listing attributes.
+
+    Parameters
+    ----------
+    features : list
+        Ordered feature names of the model.
+    dates : list
+        Dates to be predicted.
+    categoria : int or list
+        Numeric category of the listing, for all dates or one per date.
+    quartos : int or list
+        Number of rooms of the listing, for all dates or one per date.
+    localizacao : str or list
+        Location code of the listing, for all dates or one per date.
 
     Returns
     -------
     pd.DataFrame
-        A pandas series with the dataframe ready to be inputed
-        on the preprocessing pipeline and model predict method.
+        A pandas dataframe ready to be inputed on the preprocessing
+        pipeline and model predict method.
     """
 
-    data_pred = pd.DataFrame({})
+    data_pred = pd.DataFrame({"date": pd.to_datetime(pd.Series(dates))})
 
-    data_pred["date"] = (
-        pd.date_range(
-            start=pd.to_datetime("2020-03-01"), end=pd.to_datetime("2020-03-31")
-        ).to_list()
-        + pd.date_range(
-            start=pd.to_datetime("2021-03-01"), end=pd.to_datetime("2021-03-31")
-        ).to_list()
-        + pd.date_range(
-            start=pd.to_datetime("2022-03-01"), end=pd.to_datetime("2022-03-31")
-        ).to_list()
-    )
-    data_pred["Categoria"] = 5
+    data_pred["Categoria"] = categoria
 
-    data_pred["Quartos"] = 2
+    data_pred["Quartos"] = quartos
 
-    data_pred["Localização_JUR"] = 1
+    data_pred["Localização"] = localizacao
 
     data_pred = build_date_features(data_pred, "date")
 
-    for col in FEATURES_PRICE_MODEL_Q1:
-        if col not in data_pred.columns:
-            data_pred[col] = 0
+    return DesignMatrixEncoder(features).transform(data_pred)
 
-    data_pred = data_pred[FEATURES_PRICE_MODEL_Q1]
 
-    return data_pred
-
-
-def make_predict_dataset_revenue_q1():
-    """Creates the dataset to apply the revenue model
-    to answer question 1.
+def q1_prediction_dates():
+    """Returns the dates of March of 2020, 2021 and 2022, used to
+    answer question 1.
 
     Returns
     -------
-    pd.DataFrame
-        A pandas series with the dataframe ready to be inputed
-        on the preprocessing pipeline and model predict method.
+    list
+        List of the dates.
     """
-
-    data_pred = pd.DataFrame({})
-
-    data_pred["date"] = (
+    return (
         pd.date_range(
             start=pd.to_datetime("2020-03-01"), end=pd.to_datetime("2020-03-31")
         ).to_list()
@@ -241,18 +529,32 @@ def make_predict_dataset_revenue_q1():
         ).to_list()
     )
 
-    data_pred["Categoria"] = 5
 
-    data_pred["Quartos"] = 2
-
-    data_pred["Localização_JUR"] = 1
+def make_predict_dataset_price_q1():
+    """Creates the dataset to apply the price model
+    to answer question 1.
 
-    data_pred = build_date_features(data_pred, "date")
+    Returns
+    -------
+    pd.DataFrame
+        A pandas series with the dataframe ready to be inputed
+        on the preprocessing pipeline and model predict method.
+    """
+    return make_predict_dataset(
+        FEATURES_PRICE_MODEL_Q1, q1_prediction_dates(), 5, 2, "JUR"
+    )
 
-    for col in FEATURES_REVENUE_MODEL_Q1:
-        if col not in data_pred.columns:
-            data_pred[col] = 0
 
-    data_pred = data_pred[FEATURES_REVENUE_MODEL_Q1]
+def make_predict_dataset_revenue_q1():
+    """Creates the dataset to apply the revenue model
+    to answer question 1.
 
-    return data_pred
+    Returns
+    -------
+    pd.DataFrame
+        A pandas series with the dataframe ready to be inputed
+        on the preprocessing pipeline and model predict method.
+    """
+    return make_predict_dataset(
+        FEATURES_REVENUE_MODEL_Q1, q1_prediction_dates(), 5, 2, "JUR"
+    )
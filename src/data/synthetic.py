@@ -0,0 +1,529 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import math
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from src import (
+    DAILY_REVENUE_CHUNK_SIZE,
+    DAILY_REVENUE_DTYPES,
+    PATH_DAILY_REVENUE,
+    PATH_LISTINGS,
+)
+from src.commons import calendar_positions
+from src.features.build_features import CATEGORY_TIERS
+
+SYNTHETIC_START_DATE = "2019-08-01"
+
+SYNTHETIC_DAYS = 1065
+
+# Mean nightly price of each category tier, from SIM (1) to MASTER (5).
+SYNTHETIC_TIER_PRICES = np.array([0.0, 180.0, 230.0, 300.0, 380.0, 520.0])
+
+# Dates with depressed demand due to covid-19, as in the covid impact model.
+SYNTHETIC_COVID_PERIOD = ("2020-03-15", "2021-08-31")
+
+SYNTHETIC_MAX_LEAD_DAYS = 365
+
+
+def synthetic_shape(n_rows: int, n_days: int = SYNTHETIC_DAYS):
+    """Returns the number of listings and days of a synthetic daily
+    revenue dataset with (at least) a given number of rows.
+
+    Parameters
+    ----------
+    n_rows : int
+        Number of rows of the dataset.
+    n_days : int, optional
+        Maximum number of days per listing, by default SYNTHETIC_DAYS.
+
+    Returns
+    -------
+    tuple
+        Returns respectively the number of listings and of days.
+    """
+    n_days = max(1, min(n_days, n_rows))
+    return math.ceil(n_rows / n_days), n_days
+
+
+def synthetic_listings(n_listings: int, path: str = PATH_LISTINGS):
+    """Builds the listings of a synthetic dataset from the real listings.
+
+    The real listings are used in file order. When more listings than the
+    real ones are requested, the real rows are repeated with the suffix
+    '-<k>' appended to their codes.
+
+    Parameters
+    ----------
+    n_listings : int
+        Number of listings. If None, all the real listings are used.
+    path : str, optional
+        Path to the listings csv file, by default PATH_LISTINGS.
+
+    Returns
+    -------
+    pd.DataFrame
+        Returns the listings rows, as raw strings, with unique codes.
+    """
+    df_listings = pd.read_csv(path, dtype=str, keep_default_na=False)
+
+    if n_listings is None:
+        return df_listings
+
+    copies = np.arange(n_listings) // len(df_listings)
+    df_listings = df_listings.iloc[np.arange(n_listings) % len(df_listings)]
+    df_listings = df_listings.reset_index(drop=True)
+
+    df_listings["Código"] = np.where(
+        copies == 0,
+        df_listings["Código"],
+        df_listings["Código"] + "-" + copies.astype(str),
+    )
+
+    return df_listings
+
+
+def synthetic_parameters(
+    n_listings: int = None,
+    n_days: int = SYNTHETIC_DAYS,
+    start_date: str = SYNTHETIC_START_DATE,
+    seed: int = 0,
+    path_listings: str = PATH_LISTINGS,
+):
+    """Draws the listing and day level parameters of a synthetic dataset.
+
+    Each listing gets a base occupancy and a base price from its category.
+    Demand follows a yearly cycle peaking in January, with extra demand on
+    weekends and holidays and less demand during the covid-19 period.
+
+    Parameters
+    ----------
+    n_listings : int, optional
+        Number of listings, by default None (all the real listings).
+    n_days : int, optional
+        Number of days of each listing, by default SYNTHETIC_DAYS.
+    start_date : str, optional
+        First date of the dataset, by default SYNTHETIC_START_DATE.
+    seed : int, optional
+        Seed of the random generator, by default 0.
+    path_listings : str, optional
+        Path to the listings csv file, by default PATH_LISTINGS.
+
+    Returns
+    -------
+    dict
+        Returns the listing codes, base prices and base occupancies, the
+        demand of each day and the date strings, which start
+        SYNTHETIC_MAX_LEAD_DAYS + 1 days before the first date, the very
+        first being empty.
+    """
+    df_listings = synthetic_listings(n_listings, path_listings)
+    n_listings = len(df_listings)
+
+    rng = np.random.default_rng(seed)
+
+    tiers = (
+        df_listings["Categoria"]
+        .str.extract("(" + "|".join(CATEGORY_TIERS) + ")", expand=False)
+        .map(CATEGORY_TIERS)
+        .fillna(2)
+        .to_numpy(dtype="int64")
+    )
+
+    dates = pd.date_range(start=start_date, periods=n_days)
+    calendar, positions, _ = calendar_positions(pd.Series(dates))
+    demand = (
+        1
+        + 0.35 * np.cos(2 * np.pi * (dates.dayofyear.to_numpy() - 15) / 365.25)
+        + 0.12 * np.isin(dates.dayofweek, [4, 5])
+        + 0.25 * calendar["holiday"].to_numpy()[positions]
+        + 0.3 * ((dates.month == 12) & (dates.day >= 24))
+    )
+    demand[
+        (dates >= SYNTHETIC_COVID_PERIOD[0]) & (dates <= SYNTHETIC_COVID_PERIOD[1])
+    ] *= 0.45
+
+    date_strings = np.datetime_as_string(
+        np.arange(-SYNTHETIC_MAX_LEAD_DAYS - 1, n_days) + np.datetime64(start_date, "D")
+    ).astype(object)
+    date_strings[0] = ""
+
+    return {
+        "codes": df_listings["Código"].to_numpy(dtype=object),
+        "base_price": SYNTHETIC_TIER_PRICES[tiers] * rng.lognormal(0, 0.2, n_listings),
+        "base_occupancy": rng.beta(6, 5, n_listings),
+        "demand": demand,
+        "date_strings": date_strings,
+    }
+
+
+def synthetic_chunk(
+    codes: np.ndarray,
+    base_price: np.ndarray,
+    base_occupancy: np.ndarray,
+    demand: np.ndarray,
+    date_strings: np.ndarray,
+    seed: int,
+    n_rows: int = None,
+):
+    """Generates the daily revenue rows of a block of listings.
+
+    Consecutive occupied nights form reservations sharing a creation date,
+    booked with a gamma distributed lead time that grows with demand.
+    Blocked nights are occupied, without revenue nor creation date.
+
+    Parameters
+    ----------
+    codes, base_price, base_occupancy : np.ndarray
+        Codes and parameters of the listings of the block.
+    demand, date_strings : np.ndarray
+        Day level parameters, see `synthetic_parameters`.
+    seed : int or list
+        Seed of the random generator of the block.
+    n_rows : int, optional
+        Number of rows kept, by default None (all the rows of the block).
+
+    Returns
+    -------
+    pd.DataFrame
+        Returns the rows in the format of the daily revenue csv file.
+    """
+    rng = np.random.default_rng(seed)
+    offset = SYNTHETIC_MAX_LEAD_DAYS + 1
+    n_days = len(demand)
+    shape = (len(codes), n_days)
+    days = np.arange(n_days)
+
+    blocked = rng.random(shape) < 0.03
+    occupancy = blocked | (
+        rng.random(shape) < np.clip(base_occupancy[:, None] * demand, 0, 0.97)
+    )
+    booked = occupancy & ~blocked
+
+    # A booked night starts a new reservation unless it continues the one
+    # of the previous night, for a mean stay of about three nights.
+    previous = np.zeros(shape, dtype=bool)
+    previous[:, 1:] = booked[:, :-1]
+    check_in = booked & (~previous | (rng.random(shape) < 0.35))
+    check_in_day = np.maximum.accumulate(np.where(check_in, days, 0), axis=1)
+
+    lead = np.minimum(
+        rng.gamma(1.3, 22 * demand**1.5, shape), SYNTHETIC_MAX_LEAD_DAYS - 1
+    ).astype("int64")
+    creation_day = np.where(
+        booked,
+        check_in_day - np.take_along_axis(lead, check_in_day, axis=1) + offset,
+        0,
+    )
+
+    price = np.round(
+        base_price[:, None] * (0.7 + 0.3 * demand) * rng.lognormal(0, 0.08, shape), 2
+    )
+    revenue = np.where(booked, np.round(price * rng.uniform(0.85, 1, shape), 2), 0)
+
+    size = shape[0] * n_days if n_rows is None else n_rows
+
+    return pd.DataFrame(
+        {
+            "listing": np.repeat(codes, n_days)[:size],
+            "date": np.tile(date_strings[days + offset], shape[0])[:size],
+            "occupancy": occupancy.ravel()[:size].astype("int8"),
+            "blocked": blocked.ravel()[:size].astype("int8"),
+            "revenue": revenue.ravel()[:size],
+            "last_offered_price": price.ravel()[:size],
+            "creation_date": date_strings[creation_day.ravel()[:size]],
+        }
+    )
+
+
+def synthetic_chunk_tasks(
+    n_listings: int = None,
+    n_days: int = SYNTHETIC_DAYS,
+    start_date: str = SYNTHETIC_START_DATE,
+    seed: int = 0,
+    n_rows: int = None,
+    chunksize: int = DAILY_REVENUE_CHUNK_SIZE,
+    path_listings: str = PATH_LISTINGS,
+):
+    """Splits a synthetic dataset into independent blocks of listings.
+
+    Every block has its own random generator, seeded from the dataset seed
+    and the position of its first listing, so the blocks can be generated
+    in any order or in parallel.
+
+    Parameters
+    ----------
+    See `iter_daily_revenue_chunks`.
+
+    Returns
+    -------
+    list
+        Returns the arguments of `synthetic_chunk` for each block.
+    """
+    parameters = synthetic_parameters(
+        n_listings, n_days, start_date, seed, path_listings
+    )
+    n_listings = len(parameters["codes"])
+    n_rows = n_listings * n_days if n_rows is None else min(n_rows, n_listings * n_days)
+    listings_per_chunk = max(1, chunksize // n_days)
+
+    tasks = []
+    for first in range(0, -(-n_rows // n_days), listings_per_chunk):
+        block = slice(first, min(first + listings_per_chunk, n_listings))
+        tasks.append(
+            (
+                parameters["codes"][block],
+                parameters["base_price"][block],
+                parameters["base_occupancy"][block],
+                parameters["demand"],
+                parameters["date_strings"],
+                [seed, first],
+                min((block.stop - first) * n_days, n_rows - first * n_days),
+            )
+        )
+
+    return tasks
+
+
+def iter_daily_revenue_chunks(
+    n_listings: int = None,
+    n_days: int = SYNTHETIC_DAYS,
+    start_date: str = SYNTHETIC_START_DATE,
+    seed: int = 0,
+    n_rows: int = None,
+    chunksize: int = DAILY_REVENUE_CHUNK_SIZE,
+    path_listings: str = PATH_LISTINGS,
+):
+    """Generates a synthetic daily revenue dataset in chunks.
+
+    Parameters
+    ----------
+    n_listings : int, optional
+        Number of listings, by default None (all the real listings).
+    n_days : int, optional
+        Number of days of each listing, by default SYNTHETIC_DAYS.
+    start_date : str, optional
+        First date of the dataset, by default SYNTHETIC_START_DATE.
+    seed : int, optional
+        Seed of the random generator, by default 0. The same seed and
+        chunksize always generate the same dataset.
+    n_rows : int, optional
+        Total number of rows. If given, the dataset is truncated to this
+        number of rows, by default None (n_listings * n_days rows).
+    chunksize : int, optional
+        Approximate number of rows of each chunk, by default
+        DAILY_REVENUE_CHUNK_SIZE. Chunks always hold whole listings.
+    path_listings : str, optional
+        Path to the listings csv file, by default PATH_LISTINGS.
+
+    Yields
+    ------
+    pd.DataFrame
+        Chunks with the columns of the daily revenue csv file, with dates
+        formatted as YYYY-MM-DD and empty creation dates for the nights
+        that were not booked.
+    """
+    for task in synthetic_chunk_tasks(
+        n_listings, n_days, start_date, seed, n_rows, chunksize, path_listings
+    ):
+        yield synthetic_chunk(*task)
+
+
+def synthetic_chunk_csv(task: tuple):
+    """Generates a block of listings and formats it as csv rows, without
+    header. Used as the entry point of the generator worker processes.
+
+    Parameters
+    ----------
+    task : tuple
+        Arguments of `synthetic_chunk`.
+
+    Returns
+    -------
+    tuple
+        Returns the number of rows and the csv text.
+    """
+    chunk = synthetic_chunk(*task)
+    return len(chunk), chunk.to_csv(header=False, index=False)
+
+
+def make_daily_revenue(n_rows: int, seed: int = 0, **kwargs):
+    """Generates an in-memory synthetic daily revenue dataset, in the
+    format of the raw csv file.
+
+    Parameters
+    ----------
+    n_rows : int
+        Number of rows of the dataset.
+    seed : int, optional
+        Seed of the random generator, by default 0.
+    **kwargs
+        Other parameters of `iter_daily_revenue_chunks`.
+
+    Returns
+    -------
+    pd.DataFrame
+        Returns the synthetic daily revenue dataframe.
+    """
+    n_listings, n_days = synthetic_shape(n_rows, kwargs.pop("n_days", SYNTHETIC_DAYS))
+
+    return pd.concat(
+        iter_daily_revenue_chunks(
+            n_listings, n_days, seed=seed, n_rows=n_rows, **kwargs
+        ),
+        ignore_index=True,
+    )
+
+
+def write_synthetic_dataset(
+    path_daily_revenue: str = PATH_DAILY_REVENUE,
+    n_listings: int = None,
+    n_days: int = SYNTHETIC_DAYS,
+    path_listings: str = None,
+    n_rows: int = None,
+    seed: int = 0,
+    chunksize: int = DAILY_REVENUE_CHUNK_SIZE,
+    n_workers: int = 1,
+    source_listings: str = PATH_LISTINGS,
+    overwrite: bool = False,
+):
+    """Writes a synthetic daily revenue csv file, chunk by chunk.
+
+    With more than one worker the chunks are generated and formatted in a
+    process pool and written in order, so the file does not depend on the
+    number of workers.
+
+    Parameters
+    ----------
+    path_daily_revenue : str, optional
+        Path of the daily revenue csv file, by default PATH_DAILY_REVENUE.
+    n_listings : int, optional
+        Number of listings, by default None (all the real listings, or as
+        many as needed for n_rows).
+    n_days : int, optional
+        Number of days of each listing, by default SYNTHETIC_DAYS.
+    path_listings : str, optional
+        If given, a listings csv file matching the synthetic listings is
+        written to this path, by default None. It is needed when there are
+        more listings than the real ones, whose codes get a suffix. It holds
+        at least all the real listings, as the cleaning of the listings
+        dataset expects the rows of the real file.
+    n_rows : int, optional
+        Total number of rows, by default None (n_listings * n_days rows).
+    seed : int, optional
+        Seed of the random generator, by default 0.
+    chunksize : int, optional
+        Approximate number of rows generated and written at a time, by
+        default DAILY_REVENUE_CHUNK_SIZE.
+    n_workers : int, optional
+        Number of worker processes, by default 1.
+    source_listings : str, optional
+        Path to the real listings csv file, by default PATH_LISTINGS.
+    overwrite : bool, optional
+        Whether existing output files may be replaced, by default False.
+
+    Returns
+    -------
+    int
+        Number of rows written.
+
+    Raises
+    ------
+    FileExistsError
+        If an output file exists and overwrite is False, before anything is
+        written.
+    """
+    outputs = [path for path in [path_daily_revenue, path_listings] if path]
+    if not overwrite:
+        for path in outputs:
+            if os.path.exists(path):
+                raise FileExistsError(
+                    "{} already exists, pass overwrite=True (--force) to "
+                    "replace it".format(path)
+                )
+    for path in outputs:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    if n_listings is None and n_rows is not None:
+        n_listings, n_days = synthetic_shape(n_rows, n_days)
+
+    tasks = synthetic_chunk_tasks(
+        n_listings,
+        n_days,
+        seed=seed,
+        n_rows=n_rows,
+        chunksize=chunksize,
+        path_listings=source_listings,
+    )
+    rows = 0
+
+    with open(path_daily_revenue, "w", encoding="utf-8", newline="") as f:
+        f.write(",".join(DAILY_REVENUE_DTYPES) + "\n")
+
+        if n_workers > 1:
+            with ProcessPoolExecutor(n_workers) as executor:
+                chunks = executor.map(synthetic_chunk_csv, tasks)
+                for size, text in chunks:
+                    f.write(text)
+                    rows += size
+        else:
+            for size, text in map(synthetic_chunk_csv, tasks):
+                f.write(text)
+                rows += size
+
+    if path_listings is not None:
+        df_listings = synthetic_listings(None, source_listings)
+        if -(-rows // n_days) > len(df_listings):
+            df_listings = synthetic_listings(-(-rows // n_days), source_listings)
+        df_listings.to_csv(path_listings, index=False)
+
+    return rows
+
+
+def main():
+    """Command line entry point of the synthetic dataset generator."""
+    parser = argparse.ArgumentParser(description="Synthetic daily revenue dataset")
+    parser.add_argument(
+        "--output",
+        required=True,
+        help="path of the daily revenue csv file, such as "
+        "data/interim/daily_revenue.csv",
+    )
+    parser.add_argument(
+        "--listings-output",
+        default=None,
+        help="also write the matching listings csv file to this path",
+    )
+    parser.add_argument("--listings", type=int, default=None)
+    parser.add_argument("--days", type=int, default=SYNTHETIC_DAYS)
+    parser.add_argument("--rows", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--chunksize", type=int, default=DAILY_REVENUE_CHUNK_SIZE)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument(
+        "--force", action="store_true", help="replace existing output files"
+    )
+    args = parser.parse_args()
+
+    try:
+        rows = write_synthetic_dataset(
+            args.output,
+            args.listings,
+            args.days,
+            args.listings_output,
+            args.rows,
+            args.seed,
+            args.chunksize,
+            args.workers,
+            overwrite=args.force,
+        )
+    except FileExistsError as err:
+        parser.error(str(err))
+
+    print("Wrote {:d} rows to {}".format(rows, args.output))
+
+
+if __name__ == "__main__":
+    main()
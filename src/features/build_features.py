@@ -1,19 +1,50 @@
 # -*- coding: utf-8 -*-
 
-from datetime import timedelta
+import re
 import pandas as pd
 import numpy as np
 from src import FEATURES_PRICE_MODEL_Q1, FEATURES_REVENUE_MODEL_Q1
 
-from src.models.preprocessing import one_hot_encode_column
-from src.commons import add_day_of_week, decompose_date_ymd, is_holiday
-from statsmodels.tsa.seasonal import seasonal_decompose
-
-
+from src.models.preprocessing import DesignMatrixEncoder
+from src.commons import calendar_positions
+from src.instrumentation import traced
+from src.features.decomposition import decompose_series
+from src.features.company_revenue import (
+    COMPANY_REVENUE_GROUPS,
+    get_company_revenue_nights,
+    get_company_revenue_per_date,
+    sum_company_revenue,
+)
+from src.features.pickup import PickupCurves
+from src.features.reservations import count_reservations_per_creation_date
+
+CATEGORY_TIERS = {
+    "SIM": 1,
+    "JR": 2,
+    "SUP": 3,
+    "TOP": 4,
+    "MASTER": 5,
+}
+
+# Listing categories such as 'JR', 'SUP2Q', 'TOPM' or 'HOUMASTER3Q': an
+# optional house prefix, the tier and an optional number of rooms. 'TOPM' is
+# the only tier with an 'M' suffix, and is a TOP listing.
+CATEGORY_PATTERN = re.compile(
+    r"^\s*(?P<house>HOU)?(?P<tier>{})(?:(?<=TOP)M)?(?:(?P<rooms>\d+)Q)?\s*$".format(
+        "|".join(sorted(CATEGORY_TIERS, key=len, reverse=True))
+    ),
+    re.IGNORECASE,
+)
+
+
+@traced
 def build_date_features(dataframe: pd.DataFrame, date_column: str):
     """Decomposes date in year, month and day. Adds a one hot
     encoding structure for 'day of week'. Adds a flag for holiday.
 
+    The features are looked up in a precomputed calendar table, with a
+    single positional join from each date to its calendar row.
+
     Parameters
     ----------
     dataframe : pd.DataFrame
@@ -29,15 +60,20 @@ def build_date_features(dataframe: pd.DataFrame, date_column: str):
         structure for 'day of week'.
     """
 
-    dataframe = decompose_date_ymd(dataframe, date_column)
-    dataframe = add_day_of_week(dataframe, date_column)
-    dataframe["holiday"] = dataframe[date_column].apply(is_holiday)
-    dataframe = one_hot_encode_column(dataframe, "day_of_week")
+    calendar, positions, missing = calendar_positions(dataframe[date_column])
+
     dataframe = dataframe.drop(columns=date_column)
 
+    for column in calendar.columns:
+        values = calendar[column].to_numpy()[positions]
+        if missing.any():
+            values = np.where(missing, np.nan, values)
+        dataframe[column] = values
+
     return dataframe
 
 
+@traced
 def build_daily_features(df_daily_revenue: pd.DataFrame):
     """Constructs the features related to daily revenue
     dataset.
@@ -64,6 +100,59 @@ def build_daily_features(df_daily_revenue: pd.DataFrame):
     return df_daily_revenue
 
 
+def parse_categories(categories: pd.Series):
+    """Parses listing categories into their tier, number of rooms and
+    whether the listing is a house.
+
+    The compiled CATEGORY_PATTERN is matched once per distinct category
+    and the results are spread to the rows through the categorical codes,
+    so the column is read in a single pass.
+
+    Parameters
+    ----------
+    categories : pd.Series
+        Listing categories, such as 'JR', 'SUP2Q' or 'HOUMASTER3Q'.
+
+    Returns
+    -------
+    tuple
+        Returns a dataframe with the index of categories and the columns
+        'tier' (ordered categorical of the CATEGORY_TIERS names), 'rooms'
+        (Int8) and 'is_house' (boolean), missing for the categories which
+        do not parse, and the list of these rejected categories.
+    """
+    categorical = pd.Categorical(categories)
+    distinct = pd.Series(categorical.categories.astype(str))
+
+    parts = distinct.str.extract(CATEGORY_PATTERN)
+    parsed = parts["tier"].notna()
+
+    tiers = pd.Categorical(
+        parts["tier"].str.upper(), categories=list(CATEGORY_TIERS), ordered=True
+    )
+    rooms = pd.array(parts["rooms"].astype(float), dtype="Int8")
+    is_house = pd.array(parts["house"].notna(), dtype="boolean")
+    is_house[~parsed.to_numpy()] = pd.NA
+
+    codes = categorical.codes
+    known = codes >= 0
+    positions = np.where(known, codes, 0)
+
+    parsed_categories = pd.DataFrame(
+        {
+            "tier": pd.Categorical.from_codes(
+                np.where(known, tiers.codes[positions], -1), dtype=tiers.dtype
+            ),
+            "rooms": rooms.take(np.where(known, positions, -1), allow_fill=True),
+            "is_house": is_house.take(np.where(known, positions, -1), allow_fill=True),
+        },
+        index=categories.index,
+    )
+
+    return parsed_categories, distinct[~parsed].tolist()
+
+
+@traced
 def build_listings_features(df_listings: pd.DataFrame):
     """Constructs the features related to listings properties.
 
@@ -75,41 +164,25 @@ def build_listings_features(df_listings: pd.DataFrame):
     Returns
     -------
     pd.DataFrame
-        Returns the input dataframe with the columns
-        'Quartos' added and the feature 'Categoria'
-        numerically encoded.
+        Returns the input dataframe with the columns 'Quartos' and
+        'is_house' added and the feature 'Categoria' numerically encoded
+        by its tier through CATEGORY_TIERS. Categories which do not parse
+        are left missing and listed in `attrs["rejected_categories"]`.
     """
 
-    de_para_categoria = {
-        "SIM": 1,
-        "JR": 2,
-        "SUP": 3,
-        "TOP": 4,
-        "MASTER": 5,
-    }
-
-    df_listings["Quartos"] = df_listings["Categoria"].str[-2]
-
-    df_listings["Quartos"] = (
-        df_listings["Quartos"]
-        .where(~df_listings["Quartos"].str.isalpha(), np.nan)
-        .astype(float)
-        .astype("Int8")
-    )
+    parsed_categories, rejected = parse_categories(df_listings["Categoria"])
+
+    df_listings["Quartos"] = parsed_categories["rooms"]
+    df_listings["is_house"] = parsed_categories["is_house"]
     df_listings["Categoria"] = (
-        df_listings["Categoria"].str.replace("HOU", "").str.replace("TOPM", "TOP")
+        parsed_categories["tier"].astype(object).map(CATEGORY_TIERS).astype("Int8")
     )
-
-    for i in range(1, 10):
-        df_listings["Categoria"] = df_listings["Categoria"].str.replace(
-            str(i) + "Q", ""
-        )
-
-    df_listings["Categoria"] = df_listings["Categoria"].replace(de_para_categoria)
+    df_listings.attrs["rejected_categories"] = rejected
 
     return df_listings
 
 
+@traced
 def build_features_price_model_q1(
     df_listings: pd.DataFrame, df_daily_revenue: pd.DataFrame
 ):
@@ -129,44 +202,27 @@ def build_features_price_model_q1(
          Returns the input pandas dataframe with the new features added.
     """
 
-    data = pd.merge(
-        df_daily_revenue,
-        df_listings[["Código", "Comissão", "Categoria", "Quartos", "Localização"]],
-        left_on="listing",
-        right_on="Código",
-        how="left",
-    )
+    data = get_company_revenue_nights(df_listings, df_daily_revenue)
 
-    data_revenue = data.drop(
-        columns=[
-            "listing",
-            "revenue",
-            "occupancy",
-            "blocked",
-            "creation_date",
-            "Código",
-            "Comissão",
-            "reservation_advance_days",
-        ]
-    )
+    data_revenue = data.loc[
+        data["last_offered_price"] > 0,
+        ["date", "last_offered_price", "Categoria", "Quartos", "Localização"],
+    ]
 
     data_revenue = build_date_features(data_revenue, "date")
 
-    data_revenue = one_hot_encode_column(data_revenue, "Localização")
-
-    data_revenue = data_revenue.loc[data_revenue["last_offered_price"] > 0]
-
-    X = data_revenue.drop(columns="last_offered_price")[FEATURES_PRICE_MODEL_Q1].astype(
-        float
-    )
+    X = DesignMatrixEncoder(FEATURES_PRICE_MODEL_Q1).transform(data_revenue)
 
     y = data_revenue["last_offered_price"]
 
     return X, y
 
 
+@traced
 def build_features_revenue_model_q1(
-    df_listings: pd.DataFrame, df_daily_revenue: pd.DataFrame
+    df_listings: pd.DataFrame,
+    df_daily_revenue: pd.DataFrame,
+    aggregates=None,
 ):
     """Builds the features to be used on the revenue modelling for
     answer question 1.
@@ -177,6 +233,10 @@ def build_features_revenue_model_q1(
         Pandas dataframe with information about listings.
     df_daily_revenue : pd.DataFrame
         Pandas dataframe with information about daily revenue.
+    aggregates : DailyAggregates or ShardedAggregates, optional
+        Company revenue sums of `src.data.incremental` or
+        `src.features.sharded`, by default None. If given, the features are
+        built from them instead of the datasets.
 
     Returns
     -------
@@ -184,53 +244,26 @@ def build_features_revenue_model_q1(
          Returns the input pandas dataframe with the new features added.
     """
 
-    data = pd.merge(
-        df_daily_revenue,
-        df_listings[["Código", "Comissão", "Categoria", "Quartos", "Localização"]],
-        left_on="listing",
-        right_on="Código",
-        how="left",
-    )
-
-    data["company_revenue"] = data["Comissão"] * data["revenue"]
-
-    data_revenue = data.drop(
-        columns=[
-            "listing",
-            "last_offered_price",
-            "occupancy",
-            "blocked",
-            "creation_date",
-            "Código",
-            "Comissão",
-            "reservation_advance_days",
-            "revenue",
-        ]
-    )
-
-    data_revenue = (
-        data_revenue.groupby(["date", "Categoria", "Quartos", "Localização"])[
-            ["company_revenue"]
-        ]
-        .sum()
-        .reset_index()
-    )
+    if aggregates is not None:
+        data_revenue = aggregates.per_group.copy()
+    else:
+        data = get_company_revenue_nights(df_listings, df_daily_revenue)
+        data_revenue = sum_company_revenue(data, COMPANY_REVENUE_GROUPS)
 
     data_revenue = build_date_features(data_revenue, "date")
 
-    data_revenue = one_hot_encode_column(data_revenue, "Localização")
-
-    X = data_revenue.drop(columns="company_revenue")[FEATURES_REVENUE_MODEL_Q1].astype(
-        float
-    )
+    X = DesignMatrixEncoder(FEATURES_REVENUE_MODEL_Q1).transform(data_revenue)
 
     y = data_revenue["company_revenue"]
 
     return X, y
 
 
+@traced
 def build_features_revenue_model_q2(
-    df_listings: pd.DataFrame, df_daily_revenue: pd.DataFrame
+    df_listings: pd.DataFrame,
+    df_daily_revenue: pd.DataFrame,
+    aggregates=None,
 ):
     """Builds the features to be used on the revenue modelling for
     answer question 2.
@@ -241,27 +274,20 @@ def build_features_revenue_model_q2(
         Pandas dataframe with information about listings.
     df_daily_revenue : pd.DataFrame
         Pandas dataframe with information about daily revenue.
+    aggregates : DailyAggregates or ShardedAggregates, optional
+        Company revenue sums of `src.data.incremental` or
+        `src.features.sharded`, by default None. If given, the features are
+        built from them instead of the datasets.
 
     Returns
     -------
     pd.DataFrame
          Returns the input pandas dataframe with the new features added.
     """
-    data = pd.merge(
-        df_daily_revenue,
-        df_listings[["Código", "Comissão"]],
-        left_on="listing",
-        right_on="Código",
-        how="left",
-    )
-
-    data["company_revenue"] = data["Comissão"] * data["revenue"]
-
-    data_revenue = (
-        data.groupby("date")
-        .agg(company_revenue=("company_revenue", "sum"))
-        .reset_index()
-    )
+    if aggregates is not None:
+        data_revenue = aggregates.per_date.copy()
+    else:
+        data_revenue = get_company_revenue_per_date(df_listings, df_daily_revenue)
 
     data_revenue = build_date_features(data_revenue, "date")
 
@@ -274,7 +300,10 @@ def build_features_revenue_model_q2(
     return X, y
 
 
-def build_features_reservations_model_q3(df_daily_revenue: pd.DataFrame):
+@traced
+def build_features_reservations_model_q3(
+    df_daily_revenue: pd.DataFrame, aggregates=None
+):
     """Builds the features to be used on the reservations modelling for
     answer question 2.
 
@@ -282,6 +311,10 @@ def build_features_reservations_model_q3(df_daily_revenue: pd.DataFrame):
     ----------
     df_daily_revenue : pd.DataFrame
         Pandas dataframe with information about daily revenue.
+    aggregates : ShardedAggregates, optional
+        Aggregates of `src.features.sharded`, by default None. If given, the
+        reservations per creation date are read from them instead of the
+        dataset.
 
     Returns
     -------
@@ -289,38 +322,28 @@ def build_features_reservations_model_q3(df_daily_revenue: pd.DataFrame):
          Returns the input pandas dataframe with the new features added.
     """
 
-    df_q3 = df_daily_revenue[
-        (df_daily_revenue["occupancy"] == 1) & (df_daily_revenue["blocked"] == 0)
-    ]
-
-    data_q3 = df_q3.groupby(["creation_date"]).count().iloc[:, 0:1].reset_index()
-    data_q3.columns = ["creation_date", "qt_reservations"]
+    if aggregates is not None:
+        data_q3 = aggregates.reservations
+    else:
+        data_q3 = count_reservations_per_creation_date(df_daily_revenue)
 
-    data_q3 = build_date_features(data_q3, "creation_date")
+    components = decompose_series(data_q3.set_index("creation_date")["qt_reservations"])
 
-    try:
-        tsmodel = seasonal_decompose(
-            data_q3["qt_reservations"],
-            model="additive",
-            extrapolate_trend="freq",
-            freq=365,
-        )
-    except Exception as err:
-        tsmodel = seasonal_decompose(
-            data_q3["qt_reservations"],
-            model="additive",
-            extrapolate_trend="freq",
-            period=365,
-        )
+    X = build_date_features(
+        pd.DataFrame({"creation_date": components.index}), "creation_date"
+    ).astype(float)
 
-    X = data_q3.drop(columns="qt_reservations").astype(float)
-
-    y = tsmodel.trend + tsmodel.seasonal
+    y = pd.Series(
+        (components["trend"] + components["seasonal"]).to_numpy(), index=X.index
+    )
 
     return X, y
 
 
-def return_date_of_quantile_sold_q4(df_daily_revenue: pd.DataFrame, percent: float):
+@traced
+def return_date_of_quantile_sold_q4(
+    df_daily_revenue: pd.DataFrame, percent: float, curves: PickupCurves = None
+):
     """Returns the date in which a specified percent of the bookings
     is made for all rent rooms.
 
@@ -331,27 +354,29 @@ def return_date_of_quantile_sold_q4(df_daily_revenue: pd.DataFrame, percent: flo
     percent : float
         A real value between 0 and 1 related to the percent of bookings
         to be analysed.
+    curves : PickupCurves, optional
+        Pickup curves of the dataset pooled by day of year, by default None
+        (built from df_daily_revenue). Passing them avoids rebuilding them
+        for each percent.
 
     Returns
     -------
-    pd.Series
-        A pandas series with the data of n-th percentile (given by percent)
-        of the distribution of booking date distributions for each rented room.
+    pd.Timestamp
+        The date by which the n-th percent (given by percent) of the new
+        year's nights is expected to be sold, from the distribution of the
+        booking advance of the new year's nights of every year.
     """
-    df_q4 = df_daily_revenue[
-        (df_daily_revenue["date"].dt.month == 12)
-        & (df_daily_revenue["date"].dt.day == 31)
-        & (df_daily_revenue["occupancy"] == 1)
-        & (df_daily_revenue["blocked"] == 0)
-    ]
-
-    day = df_q4["reservation_advance_days"].quantile(1 - percent)
+    if curves is None:
+        curves = PickupCurves(df_daily_revenue, by_day_of_year=True)
 
-    return pd.to_datetime("2022-12-31") - timedelta(day)
+    return curves.sold_by("2022-12-31", percent)[0]
 
 
+@traced
 def build_features_covid_impact_model(
-    df_listings: pd.DataFrame, df_daily_revenue: pd.DataFrame
+    df_listings: pd.DataFrame,
+    df_daily_revenue: pd.DataFrame,
+    aggregates=None,
 ):
     """Builds the features to be used on the revenue modelling to
     evaluate the impact of covid-19 on company revenue.
@@ -362,29 +387,21 @@ def build_features_covid_impact_model(
         Pandas dataframe with information about listings.
     df_daily_revenue : pd.DataFrame
         Pandas dataframe with information about daily revenue.
+    aggregates : DailyAggregates or ShardedAggregates, optional
+        Company revenue sums of `src.data.incremental` or
+        `src.features.sharded`, by default None. If given, the features are
+        built from them instead of the datasets.
 
     Returns
     -------
     pd.DataFrame
          Returns the input pandas dataframe with the new features added.
     """
-    data = pd.merge(
-        df_daily_revenue,
-        df_listings[["Código", "Comissão"]],
-        left_on="listing",
-        right_on="Código",
-        how="left",
-    )
-
-    data["company_revenue"] = data["Comissão"] * data["revenue"]
-
-    data = (
-        data.groupby("date")
-        .agg(company_revenue=("company_revenue", "sum"))
-        .reset_index()
-    )
+    if aggregates is not None:
+        df = aggregates.per_date.copy()
+    else:
+        df = get_company_revenue_per_date(df_listings, df_daily_revenue)
 
-    df = data.copy()
     df = df[
         (df["date"] <= pd.to_datetime("2020-02-29"))
         | (df["date"] > pd.to_datetime("2021-08-31"))
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+from src.data.listing_ids import ListingDictionary
+from src.instrumentation import traced
+
+# Listing attributes of the per group sums of the company revenue, as the
+# revenue model of question 1 uses them.
+COMPANY_REVENUE_GROUPS = ["Categoria", "Quartos", "Localização"]
+
+_FACT_TABLE_CACHE = {}
+
+
+@traced
+def get_company_revenue_nights(
+    df_listings: pd.DataFrame, df_daily_revenue: pd.DataFrame
+):
+    """Returns the daily revenue dataset enriched with the listing
+    attributes and the company revenue of each night.
+
+    The join between nights and listings is computed once per pair of
+    datasets and reused by every later call with the same dataframes, so
+    the inputs must not be modified in place after the first call.
+
+    Parameters
+    ----------
+    df_listings : pd.DataFrame
+        Pandas dataframe with information about listings.
+    df_daily_revenue : pd.DataFrame
+        Pandas dataframe with information about daily revenue.
+
+    Returns
+    -------
+    pd.DataFrame
+        Returns the daily revenue dataframe with the columns 'Comissão',
+        'Categoria', 'Quartos', 'Localização' and 'company_revenue' added.
+        The dataframe is shared between callers and must not be modified.
+    """
+    return _get_fact_table(df_listings, df_daily_revenue)["nights"]
+
+
+@traced
+def get_company_revenue_per_date(
+    df_listings: pd.DataFrame, df_daily_revenue: pd.DataFrame
+):
+    """Returns the total company revenue of each date.
+
+    Parameters
+    ----------
+    df_listings : pd.DataFrame
+        Pandas dataframe with information about listings.
+    df_daily_revenue : pd.DataFrame
+        Pandas dataframe with information about daily revenue.
+
+    Returns
+    -------
+    pd.DataFrame
+        Returns a new dataframe with the columns 'date' and 'company_revenue'.
+    """
+    return _get_fact_table(df_listings, df_daily_revenue)["per_date"].copy()
+
+
+def company_revenue_nights(listings: ListingDictionary, df_daily_revenue: pd.DataFrame):
+    """Enriches nights with their listing attributes and company revenue,
+    the commission of the listing times the revenue of the night.
+
+    Parameters
+    ----------
+    listings : ListingDictionary
+        Dictionary of the listings.
+    df_daily_revenue : pd.DataFrame
+        Pandas dataframe with information about daily revenue.
+
+    Returns
+    -------
+    pd.DataFrame
+        Returns a new dataframe with the columns 'Comissão', 'Categoria',
+        'Quartos', 'Localização' and 'company_revenue' added.
+    """
+    nights = listings.enrich(df_daily_revenue)
+    nights["company_revenue"] = nights["Comissão"] * nights["revenue"]
+
+    return nights
+
+
+def sum_company_revenue(nights: pd.DataFrame, by: list = ()):
+    """Sums the company revenue per date, and optionally per group.
+
+    The sums are additive: the sums of the sums of parts of the nights,
+    such as the chunks of a file, are the sums of all the nights.
+
+    Parameters
+    ----------
+    nights : pd.DataFrame
+        Table with the columns 'date', 'company_revenue' and the by columns,
+        such as the nights or partial sums.
+    by : list, optional
+        Columns grouped with the date, such as COMPANY_REVENUE_GROUPS, by
+        default none.
+
+    Returns
+    -------
+    pd.DataFrame
+        Returns a new dataframe with the columns 'date', the by columns and
+        'company_revenue', sorted by them. Rows with a missing group are
+        left out.
+    """
+    return nights.groupby(["date"] + list(by))[["company_revenue"]].sum().reset_index()
+
+
+def add_company_revenue(sums: pd.DataFrame, nights: pd.DataFrame, by: list = ()):
+    """Adds nights to running company revenue sums per date, and optionally
+    per group.
+
+    The running sums carry the compensation of the Kahan summation of the
+    groupby sum of pandas, which adds the values of each group in row
+    order. Adding the nights of a file chunk by chunk, or the rows appended
+    to it since the last call, thus gives the sums of `sum_company_revenue`
+    over all the nights in one call, bit for bit.
+
+    Parameters
+    ----------
+    sums : pd.DataFrame
+        Running sums with the columns 'date', the by columns,
+        'company_revenue' and 'compensation', as returned by this function,
+        or None for the sums of no nights.
+    nights : pd.DataFrame
+        Table with the columns 'date', 'company_revenue' and the by columns,
+        following the nights of the running sums.
+    by : list, optional
+        Columns grouped with the date, such as COMPANY_REVENUE_GROUPS, by
+        default none.
+
+    Returns
+    -------
+    pd.DataFrame
+        Returns the new running sums, sorted by date and the by columns.
+        Rows with a missing group are left out.
+    """
+    keys = ["date"] + list(by)
+    parts = [nights[keys + ["company_revenue"]]]
+    if sums is not None:
+        parts.insert(0, sums[keys + ["company_revenue"]])
+
+    groups = pd.concat(parts, ignore_index=True).groupby(keys)
+    # Rows with a missing group, left out by the groupby, get the id -1.
+    ids = groups.ngroup().fillna(-1).to_numpy(dtype=np.intp)
+
+    total = np.zeros(groups.ngroups)
+    compensation = np.zeros(groups.ngroups)
+    start = 0
+    if sums is not None:
+        start = len(sums)
+        total[ids[:start]] = sums["company_revenue"].to_numpy()
+        compensation[ids[:start]] = sums["compensation"].to_numpy()
+
+    _kahan_sums(
+        ids[start:],
+        nights["company_revenue"].to_numpy(dtype=np.float64),
+        total,
+        compensation,
+    )
+
+    # The frame of `sum_company_revenue`, with the sums continued from the
+    # running ones instead of starting from zero.
+    result = groups[["company_revenue"]].sum().reset_index()
+    result["company_revenue"] = total
+    result["compensation"] = compensation
+
+    return result
+
+
+def _kahan_sums(ids, values, total, compensation):
+    """Adds values to the total of their group, in order, with the Kahan
+    summation of the groupby sum of pandas, updating total and
+    compensation in place. Values with the id -1 or NaN are skipped.
+
+    The values are added in rounds, the first value of every group, then the
+    second one and so on, so each round is a single vectorized step.
+    """
+    known = (ids >= 0) & ~np.isnan(values)
+    ids, values = ids[known], values[known]
+    if not len(ids):
+        return
+
+    order = np.argsort(ids, kind="stable")
+    ids, values = ids[order], values[order]
+
+    starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+    counts = np.diff(np.r_[starts, len(ids)])
+    ranks = np.arange(len(ids)) - np.repeat(starts, counts)
+
+    by_rank = np.argsort(ranks, kind="stable")
+    bounds = np.searchsorted(ranks[by_rank], np.arange(counts.max() + 1))
+
+    for first, last in zip(bounds[:-1], bounds[1:]):
+        rows = by_rank[first:last]
+        group = ids[rows]
+        y = values[rows] - compensation[group]
+        t = total[group] + y
+        error = (t - total[group]) - y
+        compensation[group] = np.where(np.isnan(error), 0.0, error)
+        total[group] = t
+
+
+def clear_company_revenue_cache():
+    """Drops the memoized company revenue tables."""
+    _FACT_TABLE_CACHE.clear()
+
+
+def _get_fact_table(df_listings: pd.DataFrame, df_daily_revenue: pd.DataFrame):
+    """Builds or returns the memoized company revenue tables for a pair
+    of datasets.
+
+    Parameters
+    ----------
+    df_listings : pd.DataFrame
+        Pandas dataframe with information about listings.
+    df_daily_revenue : pd.DataFrame
+        Pandas dataframe with information about daily revenue.
+
+    Returns
+    -------
+    dict
+        Returns a dict with the listing dictionary ('listings'), and the
+        per night ('nights') and the per date ('per_date') company revenue
+        tables.
+    """
+    if (
+        _FACT_TABLE_CACHE.get("df_listings") is df_listings
+        and _FACT_TABLE_CACHE.get("df_daily_revenue") is df_daily_revenue
+    ):
+        return _FACT_TABLE_CACHE
+
+    listings = ListingDictionary(df_listings)
+    nights = company_revenue_nights(listings, df_daily_revenue)
+    per_date = sum_company_revenue(nights)
+
+    _FACT_TABLE_CACHE.clear()
+    _FACT_TABLE_CACHE.update(
+        df_listings=df_listings,
+        df_daily_revenue=df_daily_revenue,
+        listings=listings,
+        nights=nights,
+        per_date=per_date,
+    )
+
+    return _FACT_TABLE_CACHE
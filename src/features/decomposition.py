@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from src import DECOMPOSITION_CACHE_SIZE, SEASONAL_PERIOD
+from src.instrumentation import traced
+
+COMPONENTS = ["observed", "trend", "seasonal", "resid"]
+
+_DECOMPOSITION_CACHE = OrderedDict()
+
+
+def daily_frame(series, fill_value: float = 0.0):
+    """Reindexes daily series onto a dense calendar, from the first to the
+    last date of any of them, so each position is one day.
+
+    Parameters
+    ----------
+    series : pd.Series or pd.DataFrame
+        Series indexed by date, or a dataframe with one series per column.
+    fill_value : float, optional
+        Value of the missing dates, by default 0.0, as when counting
+        reservations or summing revenue.
+
+    Returns
+    -------
+    pd.DataFrame
+        Returns a float dataframe with one column per series and one row per
+        day.
+    """
+    frame = series.to_frame() if isinstance(series, pd.Series) else series
+    frame = frame.set_axis(pd.DatetimeIndex(frame.index).normalize(), axis=0)
+
+    dates = pd.date_range(frame.index.min(), frame.index.max(), name=frame.index.name)
+
+    return frame.reindex(dates, fill_value=fill_value).astype(float).fillna(fill_value)
+
+
+def moving_average(values: np.ndarray, period: int):
+    """Centered moving average of each row, with the filter of
+    statsmodels' seasonal_decompose, computed from cumulative sums.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        2D array with one series per row.
+    period : int
+        Number of days of the seasonal cycle.
+
+    Returns
+    -------
+    np.ndarray
+        Returns the moving averages, NaN on the half windows of each end.
+    """
+    n = values.shape[1]
+    half = period // 2
+    sums = np.zeros((values.shape[0], n + 1))
+    np.cumsum(values, axis=1, out=sums[:, 1:])
+
+    trend = np.full(values.shape, np.nan)
+    if n <= 2 * half:
+        return trend
+
+    window = sums[:, 2 * half + 1 :] - sums[:, : n - 2 * half]
+    if period % 2 == 0:
+        # Even periods weigh the two ends of the window by one half.
+        window -= 0.5 * (values[:, : n - 2 * half] + values[:, 2 * half :])
+    trend[:, half : n - half] = window / period
+
+    return trend
+
+
+def extrapolate_trend(trend: np.ndarray, npoints: int):
+    """Replaces the NaN ends of the trend of each row with the least
+    squares lines through its npoints closest defined values, as
+    statsmodels does with extrapolate_trend.
+
+    Parameters
+    ----------
+    trend : np.ndarray
+        2D array with one trend per row, all with the same NaN ends.
+    npoints : int
+        Number of values of each line fit.
+
+    Returns
+    -------
+    np.ndarray
+        Returns the trend, modified in place.
+    """
+    defined = np.flatnonzero(~np.isnan(trend).any(axis=0))
+    if not len(defined):
+        return trend
+    front, back = defined[0], defined[-1]
+
+    for first, last, positions in [
+        (front, min(front + npoints, back), np.arange(0, front)),
+        (max(front, back - npoints), back, np.arange(back + 1, trend.shape[1])),
+    ]:
+        design = np.c_[np.arange(first, last), np.ones(last - first)]
+        slope, intercept = np.linalg.lstsq(design, trend[:, first:last].T, rcond=-1)[0]
+        trend[:, positions] = positions * slope[:, None] + intercept[:, None]
+
+    return trend
+
+
+def decompose_values(values: np.ndarray, period: int = SEASONAL_PERIOD):
+    """Additive decomposition of each row into trend, seasonal and residual
+    components, equal to statsmodels' seasonal_decompose with
+    extrapolate_trend="freq", for all the rows at once.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        2D array with one daily series per row, without missing values.
+    period : int, optional
+        Number of days of the seasonal cycle, by default SEASONAL_PERIOD.
+
+    Returns
+    -------
+    dict
+        Returns the 2D arrays of each component of COMPONENTS.
+
+    Raises
+    ------
+    ValueError
+        If the series have less than two complete cycles, as in statsmodels.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n = values.shape[1]
+
+    if n < 2 * period:
+        raise ValueError(
+            "x must have 2 complete cycles requires {:d} observations. x only "
+            "has {:d} observation(s)".format(2 * period, n)
+        )
+
+    trend = extrapolate_trend(moving_average(values, period), period)
+    detrended = values - trend
+
+    # Day of period means: the rows are padded to whole cycles with NaN and
+    # averaged over the cycles.
+    cycles = -(-n // period)
+    padded = np.full((values.shape[0], cycles * period), np.nan)
+    padded[:, :n] = detrended
+    averages = np.nanmean(padded.reshape(values.shape[0], cycles, period), axis=1)
+    averages -= averages.mean(axis=1, keepdims=True)
+
+    seasonal = np.tile(averages, cycles)[:, :n]
+
+    return {
+        "observed": values,
+        "trend": trend,
+        "seasonal": seasonal,
+        "resid": detrended - seasonal,
+    }
+
+
+def _cache_key(frame: pd.DataFrame, period: int, fill_value: float):
+    """Returns the hash of the values, dates and names of series and of the
+    decomposition parameters."""
+    digest = hashlib.sha256()
+    digest.update(np.ascontiguousarray(frame.to_numpy(dtype=np.float64)).tobytes())
+    digest.update(frame.index.to_numpy(dtype="datetime64[ns]").tobytes())
+    digest.update(repr((list(frame.columns), period, fill_value)).encode("utf-8"))
+
+    return digest.hexdigest()
+
+
+@traced
+def decompose_frame(
+    frame: pd.DataFrame,
+    period: int = SEASONAL_PERIOD,
+    fill_value: float = 0.0,
+):
+    """Decomposes many daily series, such as one per location, in a single
+    batched computation. Results are memoized by a hash of the series.
+
+    Parameters
+    ----------
+    frame : pd.DataFrame
+        Dataframe indexed by date with one series per column.
+    period : int, optional
+        Number of days of the seasonal cycle, by default SEASONAL_PERIOD.
+    fill_value : float, optional
+        Value of the dates missing from the calendar, by default 0.0.
+
+    Returns
+    -------
+    pd.DataFrame
+        Returns a dataframe indexed by the dense daily calendar, with the
+        columns (series, component) for each component of COMPONENTS.
+    """
+    key = _cache_key(frame, period, fill_value)
+    if key in _DECOMPOSITION_CACHE:
+        _DECOMPOSITION_CACHE.move_to_end(key)
+        return _DECOMPOSITION_CACHE[key].copy()
+
+    dense = daily_frame(frame, fill_value)
+    components = decompose_values(dense.to_numpy().T, period)
+
+    result = pd.concat(
+        {
+            name: pd.DataFrame(
+                components[name].T, index=dense.index, columns=dense.columns
+            )
+            for name in COMPONENTS
+        },
+        axis=1,
+    ).swaplevel(axis=1)
+    result = result[pd.MultiIndex.from_product([dense.columns, COMPONENTS])]
+
+    _DECOMPOSITION_CACHE[key] = result
+    while len(_DECOMPOSITION_CACHE) > DECOMPOSITION_CACHE_SIZE:
+        _DECOMPOSITION_CACHE.popitem(last=False)
+
+    return result.copy()
+
+
+def decompose_series(
+    series: pd.Series, period: int = SEASONAL_PERIOD, fill_value: float = 0.0
+):
+    """Decomposes a daily series into trend, seasonal and residual
+    components.
+
+    Parameters
+    ----------
+    series : pd.Series
+        Series indexed by date.
+    period : int, optional
+        Number of days of the seasonal cycle, by default SEASONAL_PERIOD.
+    fill_value : float, optional
+        Value of the dates missing from the calendar, by default 0.0.
+
+    Returns
+    -------
+    pd.DataFrame
+        Returns a dataframe indexed by the dense daily calendar with the
+        columns of COMPONENTS.
+    """
+    name = series.name if series.name is not None else 0
+
+    return decompose_frame(series.rename(name).to_frame(), period, fill_value)[name]
+
+
+def decompose_by(
+    dataframe: pd.DataFrame,
+    date_column: str,
+    value_column: str,
+    by: str,
+    period: int = SEASONAL_PERIOD,
+):
+    """Sums a value per date and group, such as the revenue per date and
+    location, and decomposes the series of every group at once.
+
+    Parameters
+    ----------
+    dataframe : pd.DataFrame
+        Long table with the date, value and group columns.
+    date_column : str
+        Name of the date column.
+    value_column : str
+        Name of the value column.
+    by : str
+        Name of the group column.
+    period : int, optional
+        Number of days of the seasonal cycle, by default SEASONAL_PERIOD.
+
+    Returns
+    -------
+    pd.DataFrame
+        Returns the decomposition of each group, see `decompose_frame`.
+    """
+    frame = dataframe.pivot_table(
+        index=date_column,
+        columns=by,
+        values=value_column,
+        aggfunc="sum",
+        fill_value=0.0,
+        observed=True,
+    )
+
+    return decompose_frame(frame, period)
+
+
+def clear_decomposition_cache():
+    """Drops the memoized decompositions."""
+    _DECOMPOSITION_CACHE.clear()
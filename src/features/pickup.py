@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+from src.data.listing_ids import ListingDictionary
+from src.instrumentation import traced
+
+
+def day_of_year_keys(dates: np.ndarray):
+    """Returns a key identifying the month and day of dates, the same for
+    every year, 31 * (month - 1) + (day - 1)."""
+    dates = pd.DatetimeIndex(np.asarray(dates, dtype="datetime64[ns]"))
+
+    return (31 * (dates.month - 1) + dates.day - 1).to_numpy(dtype=np.int64)
+
+
+class PickupCurves:
+    """Distributions of the reservation advance of the nights sold for each
+    stay date, optionally per group of listings, to answer when a given
+    percent of the nights of any stay date is expected to be sold.
+
+    The advances of the occupied and unblocked nights are sorted once per
+    (group, stay date) into a single array, with the offsets of each
+    segment, so a percentile is read from its segment in O(1) after an
+    O(log n) lookup of the segment, and so are the booked fractions, with a
+    binary search in the segment. Every query is vectorized over stay
+    dates.
+
+    Parameters
+    ----------
+    df_daily_revenue : pd.DataFrame
+        Pandas dataframe with information about daily revenue, with the
+        'reservation_advance_days' feature.
+    df_listings : pd.DataFrame, optional
+        Pandas dataframe with information about listings, needed if by is
+        given, by default None.
+    by : list, optional
+        Columns of the listings, such as 'Localização' or 'Categoria', whose
+        values define the groups, by default None (a single group).
+    by_day_of_year : bool, optional
+        Whether the nights of the same month and day of every year are
+        pooled together, as question 4 does for new year's eve, by default
+        False.
+    """
+
+    @traced
+    def __init__(
+        self,
+        df_daily_revenue: pd.DataFrame,
+        df_listings: pd.DataFrame = None,
+        by: list = None,
+        by_day_of_year: bool = False,
+    ):
+        self.by = [by] if isinstance(by, str) else list(by or [])
+        self.by_day_of_year = by_day_of_year
+
+        advance = df_daily_revenue["reservation_advance_days"].to_numpy(
+            dtype=np.float64, na_value=np.nan
+        )
+        sold = (
+            (df_daily_revenue["occupancy"] == 1) & (df_daily_revenue["blocked"] == 0)
+        ).to_numpy(dtype=bool, na_value=False) & ~np.isnan(advance)
+
+        dates = df_daily_revenue["date"].to_numpy()[sold]
+        advance = advance[sold]
+
+        if self.by:
+            listings = ListingDictionary(df_listings, self.by)
+            listing_groups, labels = pd.MultiIndex.from_frame(
+                pd.DataFrame(listings.attributes)
+            ).factorize()
+            # Nights of listings absent from the dictionary have no group.
+            groups = np.append(listing_groups, -1)[
+                listings.listing_ids(df_daily_revenue["listing"])[sold]
+            ]
+            self.groups = list(labels)
+        else:
+            groups = np.zeros(len(dates), dtype=np.int64)
+            self.groups = [()]
+
+        days = self._days(dates)
+        self._span = (int(days.min()), int(days.max()) + 1) if len(days) else (0, 1)
+        keys = self._keys(days, groups)
+
+        order = np.lexsort((advance, keys))
+        self.keys, starts = np.unique(keys[order], return_index=True)
+        self.advance = advance[order]
+
+        # The arrays end with an empty segment, the one of the unknown stay
+        # dates and groups, and with an advance read, and ignored, for it.
+        self._starts = np.append(starts, len(order)).astype(np.int64)
+        self._ends = np.append(self._starts[1:], len(order))
+        self._advance = np.append(self.advance, np.nan)
+
+        # Advances shifted by their segment, sorted, so an advance is binary
+        # searched within its segment in a single call for every query.
+        self._scale = float(np.nanmax(self._advance, initial=0) + 2)
+        self._shifted = (
+            np.repeat(np.arange(len(self.keys)), np.diff(self._starts)) * self._scale
+            + self.advance
+        )
+
+    def _days(self, dates: np.ndarray):
+        """Returns the day keys of stay dates, their ordinal or their month
+        and day if the nights are pooled by day of year."""
+        if self.by_day_of_year:
+            return day_of_year_keys(dates)
+
+        return np.asarray(dates, dtype="datetime64[D]").astype(np.int64)
+
+    def _keys(self, days: np.ndarray, groups: np.ndarray):
+        """Returns the segment keys of day keys and group codes, -1 for the
+        days out of the span of the data."""
+        low, high = self._span
+        inside = (days >= low) & (days < high) & (np.asarray(groups) >= 0)
+
+        return np.where(
+            inside, np.asarray(groups, dtype=np.int64) * (high - low) + days - low, -1
+        )
+
+    def _segments(self, stay_dates, group=None):
+        """Returns the segment of each stay date of a group, the empty last
+        segment for unknown stay dates or groups."""
+        stay_dates = np.atleast_1d(np.asarray(stay_dates, dtype="datetime64[D]"))
+
+        code = 0
+        if self.by:
+            group = group if isinstance(group, tuple) else (group,)
+            code = self.groups.index(group) if group in self.groups else -1
+
+        keys = self._keys(self._days(stay_dates), np.full(len(stay_dates), code))
+        segments = np.searchsorted(self.keys, keys)
+        found = (keys >= 0) & (np.append(self.keys, -1)[segments] == keys)
+
+        return np.where(found, segments, len(self.keys))
+
+    def nights_sold(self, stay_dates, group=None):
+        """Returns the number of nights sold of stay dates.
+
+        Parameters
+        ----------
+        stay_dates : array-like
+            Stay dates.
+        group : Any, optional
+            Value, or tuple of values, of the `by` columns, by default None.
+
+        Returns
+        -------
+        np.ndarray
+            Returns the number of nights sold of each stay date.
+        """
+        segments = self._segments(stay_dates, group)
+
+        return self._ends[segments] - self._starts[segments]
+
+    def advance_quantiles(self, stay_dates, quantile: float, group=None):
+        """Returns a quantile of the reservation advance of the nights sold
+        of stay dates, interpolated linearly as pd.Series.quantile does.
+
+        Parameters
+        ----------
+        stay_dates : array-like
+            Stay dates.
+        quantile : float
+            Quantile, between 0 and 1.
+        group : Any, optional
+            Value, or tuple of values, of the `by` columns, by default None.
+
+        Returns
+        -------
+        np.ndarray
+            Returns the quantile in days for each stay date, NaN for the
+            stay dates without nights sold.
+        """
+        segments = self._segments(stay_dates, group)
+        starts = self._starts[segments]
+        counts = self._ends[segments] - starts
+
+        position = np.maximum(counts - 1, 0) * quantile
+        lower = np.floor(position).astype(np.int64)
+        low = self._advance[starts + lower]
+        high = self._advance[starts + np.ceil(position).astype(np.int64)]
+
+        return np.where(counts == 0, np.nan, low + (high - low) * (position - lower))
+
+    def sold_by(self, stay_dates, percent: float, group=None):
+        """Returns the date by which a percent of the nights of stay dates
+        are expected to be sold, the stay date minus the 1 - percent
+        quantile of the reservation advance.
+
+        Parameters
+        ----------
+        stay_dates : array-like
+            Stay dates, of any year if the nights are pooled by day of year.
+        percent : float
+            Percent of the nights sold, between 0 and 1.
+        group : Any, optional
+            Value, or tuple of values, of the `by` columns, by default None.
+
+        Returns
+        -------
+        pd.DatetimeIndex
+            Returns the date for each stay date, NaT for the stay dates
+            without nights sold.
+        """
+        days = self.advance_quantiles(stay_dates, 1 - percent, group)
+        stay_dates = pd.DatetimeIndex(
+            np.atleast_1d(np.asarray(stay_dates, dtype="datetime64[ns]"))
+        )
+
+        return stay_dates - pd.to_timedelta(days, unit="D")
+
+    def booked_fraction(self, stay_dates, days_before, group=None):
+        """Returns the fraction of the nights sold of stay dates which were
+        already booked a number of days before the stay, the pickup curve.
+
+        Parameters
+        ----------
+        stay_dates : array-like
+            Stay dates.
+        days_before : array-like
+            Days before the stay, a scalar or one value per stay date.
+        group : Any, optional
+            Value, or tuple of values, of the `by` columns, by default None.
+
+        Returns
+        -------
+        np.ndarray
+            Returns the fraction for each stay date, NaN for the stay dates
+            without nights sold.
+        """
+        segments = self._segments(stay_dates, group)
+        starts, ends = self._starts[segments], self._ends[segments]
+
+        # The nights booked days_before or more days ahead are the ones after
+        # the binary search position of days_before in the segment.
+        targets = segments * self._scale + np.clip(days_before, 0, self._scale - 1)
+        booked = ends - np.clip(np.searchsorted(self._shifted, targets), starts, ends)
+        counts = ends - starts
+
+        return np.where(counts == 0, np.nan, booked / np.maximum(counts, 1))
+
+    @traced
+    def curves(self, stay_dates, percents: list, group=None):
+        """Returns, for each stay date, the dates by which each percent of
+        its nights is expected to be sold.
+
+        Parameters
+        ----------
+        stay_dates : array-like
+            Stay dates, such as a year of dates from pd.date_range.
+        percents : list
+            Percents of the nights sold, between 0 and 1.
+        group : Any, optional
+            Value, or tuple of values, of the `by` columns, by default None.
+
+        Returns
+        -------
+        pd.DataFrame
+            Returns a dataframe indexed by the stay dates, with the number of
+            nights sold ('nights') and one column of dates per percent.
+        """
+        index = pd.DatetimeIndex(
+            np.atleast_1d(np.asarray(stay_dates, dtype="datetime64[ns]")), name="date"
+        )
+        curves = pd.DataFrame(
+            {"nights": self.nights_sold(index.to_numpy(), group)}, index=index
+        )
+
+        for percent in percents:
+            curves[percent] = self.sold_by(index.to_numpy(), percent, group)
+
+        return curves
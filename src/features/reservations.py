@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+from src.instrumentation import traced
+
+
+@traced
+def build_reservations(df_daily_revenue: pd.DataFrame):
+    """Collapses the nights sold into reservations.
+
+    A reservation is a run of consecutive occupied and unblocked nights of
+    the same listing with the same creation date. The runs are found with a
+    run-length encoding of the nights sorted by listing and date, without
+    grouping the frame.
+
+    Parameters
+    ----------
+    df_daily_revenue : pd.DataFrame
+        Pandas dataframe with information about daily revenue.
+
+    Returns
+    -------
+    pd.DataFrame
+        Returns a dataframe with one row per reservation and the columns
+        'listing', 'creation_date', 'check_in', 'check_out' (the day after
+        the last night), 'nights', 'revenue' and 'lead_time' (the days
+        between the creation and the check-in, NaN if negative). Nights
+        without a creation date are left out.
+    """
+    sold = (
+        (df_daily_revenue["occupancy"] == 1)
+        & (df_daily_revenue["blocked"] == 0)
+        & df_daily_revenue["creation_date"].notna()
+    ).to_numpy(dtype=bool, na_value=False)
+
+    listings = pd.Categorical(df_daily_revenue["listing"])
+    codes = listings.codes[sold]
+    days = df_daily_revenue["date"].to_numpy()[sold].astype("datetime64[D]")
+    created = df_daily_revenue["creation_date"].to_numpy()[sold].astype("datetime64[D]")
+    revenue = df_daily_revenue["revenue"].to_numpy(dtype=np.float64, na_value=np.nan)[
+        sold
+    ]
+
+    order = np.lexsort((days, codes))
+    codes, days, created, revenue = (
+        codes[order],
+        days[order],
+        created[order],
+        revenue[order],
+    )
+
+    # A reservation starts at every night which does not continue the one
+    # before: another listing, a gap in the dates or another creation date.
+    starts = np.ones(len(codes), dtype=bool)
+    starts[1:] = (
+        (codes[1:] != codes[:-1])
+        | (days[1:] != days[:-1] + np.timedelta64(1, "D"))
+        | (created[1:] != created[:-1])
+    )
+    starts = np.flatnonzero(starts)
+
+    nights = np.diff(np.append(starts, len(codes)))
+    check_in = days[starts]
+    lead_time = (check_in - created[starts]).astype(np.float64)
+
+    return pd.DataFrame(
+        {
+            "listing": pd.Categorical.from_codes(
+                codes[starts], categories=listings.categories
+            ),
+            "creation_date": created[starts].astype("datetime64[ns]"),
+            "check_in": check_in.astype("datetime64[ns]"),
+            "check_out": (check_in + nights).astype("datetime64[ns]"),
+            "nights": nights.astype(np.int32),
+            "revenue": (
+                np.add.reduceat(np.nan_to_num(revenue), starts)
+                if len(starts)
+                else np.zeros(0)
+            ),
+            "lead_time": np.where(lead_time < 0, np.nan, lead_time),
+        }
+    )
+
+
+def count_reservations_per_creation_date(df_daily_revenue: pd.DataFrame):
+    """Returns the number of reservations created on each date.
+
+    Parameters
+    ----------
+    df_daily_revenue : pd.DataFrame
+        Pandas dataframe with information about daily revenue.
+
+    Returns
+    -------
+    pd.DataFrame
+        Returns a dataframe with the columns 'creation_date' and
+        'qt_reservations', sorted by date.
+    """
+    return (
+        build_reservations(df_daily_revenue)
+        .groupby("creation_date")
+        .size()
+        .rename("qt_reservations")
+        .reset_index()
+    )
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import numpy as np
+import pandas as pd
+from src.data.listing_ids import ListingDictionary
+from src.features.company_revenue import (
+    COMPANY_REVENUE_GROUPS,
+    company_revenue_nights,
+    sum_company_revenue,
+)
+from src.features.reservations import count_reservations_per_creation_date
+from src.instrumentation import traced
+
+
+def listing_shards(listings, n_shards: int):
+    """Assigns the nights to shards by a hash of their listing code.
+
+    The codes are hashed once per category, so every night of a listing,
+    and so every reservation, is in the same shard, whatever the dataset.
+
+    Parameters
+    ----------
+    listings : pd.Series or pd.Categorical
+        Listing code of each night.
+    n_shards : int
+        Number of shards.
+
+    Returns
+    -------
+    np.ndarray
+        Returns the shard of each night, 0 for missing listings.
+    """
+    listings = pd.Categorical(listings)
+    hashes = pd.util.hash_array(
+        np.asarray(listings.categories.astype(str), dtype=object)
+    )
+    shards = np.append((hashes % np.uint64(n_shards)).astype(np.intp), 0)
+
+    return shards[listings.codes]
+
+
+def shard_positions(df_daily_revenue: pd.DataFrame, n_shards: int):
+    """Partitions the rows of the daily revenue dataset into shards of
+    listings.
+
+    Parameters
+    ----------
+    df_daily_revenue : pd.DataFrame
+        Pandas dataframe with information about daily revenue.
+    n_shards : int
+        Number of shards.
+
+    Returns
+    -------
+    list
+        Returns the positions of the nights of each shard, in increasing
+        order, leaving out the empty shards.
+    """
+    shards = listing_shards(df_daily_revenue["listing"], n_shards)
+    order = np.argsort(shards, kind="stable")
+    bounds = np.searchsorted(shards[order], np.arange(n_shards + 1))
+
+    return [
+        order[start:end] for start, end in zip(bounds[:-1], bounds[1:]) if end > start
+    ]
+
+
+def split_shards(df_daily_revenue: pd.DataFrame, n_shards: int):
+    """Partitions the daily revenue dataset into shards of listings.
+
+    Parameters
+    ----------
+    df_daily_revenue : pd.DataFrame
+        Pandas dataframe with information about daily revenue.
+    n_shards : int
+        Number of shards.
+
+    Returns
+    -------
+    list
+        Returns the nights of each shard, in their original order, leaving
+        out the empty shards.
+    """
+    return [
+        df_daily_revenue.take(positions)
+        for positions in shard_positions(df_daily_revenue, n_shards)
+    ]
+
+
+def aggregate_shard(listings: ListingDictionary, df_daily_revenue: pd.DataFrame):
+    """Computes the partial aggregates of a shard, the map step.
+
+    Parameters
+    ----------
+    listings : ListingDictionary
+        Dictionary of the listings.
+    df_daily_revenue : pd.DataFrame
+        Nights of the shard.
+
+    Returns
+    -------
+    dict
+        Returns the date, the COMPANY_REVENUE_GROUPS and the company revenue
+        of each night ('nights'), in the order of the shard, and the number
+        of reservations per creation date ('reservations') of the shard.
+    """
+    nights = company_revenue_nights(listings, df_daily_revenue)
+
+    return {
+        "nights": nights[["date"] + COMPANY_REVENUE_GROUPS + ["company_revenue"]],
+        "reservations": count_reservations_per_creation_date(df_daily_revenue),
+    }
+
+
+def reduce_shards(partials: list, positions: list):
+    """Merges the partial aggregates of the shards, the reduce step.
+
+    The nights of the shards are put back in the order of the dataset and
+    summed in a single pass, as floating point sums depend on the order of
+    the values, so the sums are the single process ones, bit for bit.
+
+    Parameters
+    ----------
+    partials : list
+        Partial aggregates of each shard, see `aggregate_shard`.
+    positions : list
+        Positions of the nights of each shard in the dataset, see
+        `shard_positions`.
+
+    Returns
+    -------
+    dict
+        Returns the company revenue per date ('per_date') and per date and
+        COMPANY_REVENUE_GROUPS ('per_group') and the number of reservations
+        per creation date ('reservations') of all the shards.
+    """
+    tables = {name: [partial[name] for partial in partials] for name in partials[0]}
+
+    nights = pd.concat(tables["nights"], ignore_index=True)
+    nights = nights.take(np.argsort(np.concatenate(positions), kind="stable"))
+
+    return {
+        "per_date": sum_company_revenue(nights),
+        "per_group": sum_company_revenue(nights, COMPANY_REVENUE_GROUPS),
+        "reservations": pd.concat(tables["reservations"], ignore_index=True)
+        .groupby("creation_date")["qt_reservations"]
+        .sum()
+        .reset_index(),
+    }
+
+
+class ShardedAggregates:
+    """Aggregates of the daily revenue dataset computed shard by shard.
+
+    Parameters
+    ----------
+    tables : dict
+        Tables returned by `reduce_shards`, available as the attributes
+        'per_date', 'per_group' and 'reservations'.
+    """
+
+    def __init__(self, tables: dict):
+        self.per_date = tables["per_date"]
+        self.per_group = tables["per_group"]
+        self.reservations = tables["reservations"]
+
+
+@traced
+def sharded_aggregates(
+    df_listings: pd.DataFrame,
+    df_daily_revenue: pd.DataFrame,
+    n_shards: int = None,
+    n_workers: int = 1,
+):
+    """Computes the company revenue sums and the reservation counts as a
+    map-reduce over shards of listings.
+
+    The nights are partitioned by a hash of their listing, and a pool of
+    processes joins the nights of each shard with their listing and counts
+    their reservations. As no reservation spans two listings, the counts
+    are the ones of the whole dataset; the company revenue of the nights is
+    summed in the order of the dataset, so the sums are also the single
+    process ones, for any number of shards and workers.
+
+    Parameters
+    ----------
+    df_listings : pd.DataFrame
+        Pandas dataframe with information about listings.
+    df_daily_revenue : pd.DataFrame
+        Pandas dataframe with information about daily revenue.
+    n_shards : int, optional
+        Number of shards, by default None (one per worker).
+    n_workers : int, optional
+        Number of processes computing the shards, by default 1 (computed in
+        this process).
+
+    Returns
+    -------
+    ShardedAggregates
+        Returns the aggregates, which the revenue and reservations feature
+        builders accept as aggregates.
+    """
+    listings = ListingDictionary(df_listings)
+    positions = shard_positions(df_daily_revenue, n_shards or n_workers)
+    positions = positions or [np.arange(len(df_daily_revenue))]
+    shards = [df_daily_revenue.take(shard) for shard in positions]
+
+    if n_workers > 1 and len(shards) > 1:
+        with ProcessPoolExecutor(min(n_workers, len(shards))) as executor:
+            partials = list(executor.map(aggregate_shard, repeat(listings), shards))
+    else:
+        partials = list(map(aggregate_shard, repeat(listings), shards))
+
+    return ShardedAggregates(reduce_shards(partials, positions))
@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Tracing is off by default, so the traced functions only pay for a lookup
+# in this dict until `enable_tracing` is called.
+_TRACING = {"enabled": False, "memory": False, "profile": False}
+
+_TRACE = []
+
+_PROFILES = {}
+
+_LOCAL = threading.local()
+
+
+def enable_tracing(memory: bool = True, profile: bool = False):
+    """Starts recording the traced functions and clears the previous trace.
+
+    Parameters
+    ----------
+    memory : bool, optional
+        Whether to record the peak memory of each call with tracemalloc, by
+        default True. It slows down allocation heavy code.
+    profile : bool, optional
+        Whether to run each call under its own cProfile profiler, so the
+        hottest one can be dumped with `dump_hottest_profile`, by default
+        False.
+    """
+    reset_trace()
+    _TRACING.update(enabled=True, memory=memory, profile=profile)
+
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable_tracing():
+    """Stops recording the traced functions. The trace is kept."""
+    if _TRACING["memory"] and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+    _TRACING.update(enabled=False, memory=False, profile=False)
+
+
+def reset_trace():
+    """Drops the recorded trace and profiles."""
+    del _TRACE[:]
+    _PROFILES.clear()
+
+
+def get_trace():
+    """Returns the records of the traced calls, in the order they ended.
+
+    Returns
+    -------
+    list
+        Returns one dict per call with the keys 'name', 'depth', 'start_s',
+        'wall_s', 'self_s', 'cpu_s', 'peak_mb', 'rows_in' and 'rows_out'.
+    """
+    return list(_TRACE)
+
+
+def count_rows(value):
+    """Returns the number of rows of the dataframes, series and arrays in a
+    value, looking into tuples and lists.
+
+    Parameters
+    ----------
+    value : Any
+        Arguments or result of a traced call.
+
+    Returns
+    -------
+    list
+        Returns the number of rows of each table found.
+    """
+    if hasattr(value, "shape") and hasattr(value, "__len__"):
+        return [len(value)] if len(value.shape) else []
+
+    if isinstance(value, (tuple, list)):
+        return [rows for item in value for rows in count_rows(item)]
+
+    return []
+
+
+@contextmanager
+def trace_span(name: str, rows_in: list = None):
+    """Records the wall time, CPU time and peak memory of a block of code.
+
+    Parameters
+    ----------
+    name : str
+        Name of the span in the trace.
+    rows_in : list, optional
+        Number of rows of each input table, by default None.
+
+    Yields
+    ------
+    dict
+        The record of the span. Its 'rows_out' key can be set by the block.
+    """
+    if not _TRACING["enabled"]:
+        yield {}
+        return
+
+    stack = _LOCAL.__dict__.setdefault("stack", [])
+    parent = stack[-1] if stack else None
+
+    record = {
+        "name": name,
+        "depth": len(stack),
+        "start_s": time.time(),
+        "rows_in": rows_in or [],
+        "rows_out": [],
+    }
+    span = {"children_s": 0.0, "peak_carry": 0, "profile": None}
+
+    if _TRACING["memory"]:
+        span["memory_start"], parent_peak = tracemalloc.get_traced_memory()
+        if parent is not None:
+            parent["span"]["peak_carry"] = max(
+                parent["span"]["peak_carry"], parent_peak
+            )
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+
+    if _TRACING["profile"]:
+        import cProfile
+
+        if parent is not None and parent["span"]["profile"] is not None:
+            parent["span"]["profile"].disable()
+        span["profile"] = cProfile.Profile()
+        span["profile"].enable()
+
+    stack.append({"record": record, "span": span})
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+
+    try:
+        yield record
+    finally:
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+        stack.pop()
+
+        if span["profile"] is not None:
+            span["profile"].disable()
+            _PROFILES[len(_TRACE)] = span["profile"]
+            if parent is not None and parent["span"]["profile"] is not None:
+                parent["span"]["profile"].enable()
+
+        peak = 0
+        if _TRACING["memory"] and tracemalloc.is_tracing():
+            peak = max(tracemalloc.get_traced_memory()[1], span["peak_carry"])
+            if parent is not None:
+                parent["span"]["peak_carry"] = max(parent["span"]["peak_carry"], peak)
+            peak -= span["memory_start"]
+
+        if parent is not None:
+            parent["span"]["children_s"] += wall
+
+        record.update(
+            wall_s=wall,
+            self_s=wall - span["children_s"],
+            cpu_s=cpu,
+            peak_mb=max(peak, 0) / 2**20,
+        )
+        _TRACE.append(record)
+
+
+def traced(func):
+    """Decorator recording each call of a function with `trace_span`,
+    including the number of rows of its input and output tables."""
+    name = func.__module__.split(".")[-1] + "." + func.__qualname__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _TRACING["enabled"]:
+            return func(*args, **kwargs)
+
+        with trace_span(name, count_rows(list(args) + list(kwargs.values()))) as span:
+            result = func(*args, **kwargs)
+            span["rows_out"] = count_rows(result)
+
+        return result
+
+    return wrapper
+
+
+def summarize_trace(records: list = None):
+    """Aggregates the trace by function.
+
+    Parameters
+    ----------
+    records : list, optional
+        Records as returned by `get_trace`, by default the current trace.
+
+    Returns
+    -------
+    list
+        Returns one dict per function, from the slowest to the fastest by
+        self time, with the keys 'name', 'calls', 'wall_s', 'self_s',
+        'cpu_s', 'peak_mb', 'rows_in' and 'rows_out', the last ones being
+        the largest table seen.
+    """
+    summary = {}
+
+    for record in get_trace() if records is None else records:
+        entry = summary.setdefault(
+            record["name"],
+            {
+                "name": record["name"],
+                "calls": 0,
+                "wall_s": 0.0,
+                "self_s": 0.0,
+                "cpu_s": 0.0,
+                "peak_mb": 0.0,
+                "rows_in": 0,
+                "rows_out": 0,
+            },
+        )
+        entry["calls"] += 1
+        for key in ["wall_s", "self_s", "cpu_s"]:
+            entry[key] += record[key]
+        entry["peak_mb"] = max(entry["peak_mb"], record["peak_mb"])
+        entry["rows_in"] = max([entry["rows_in"]] + record["rows_in"])
+        entry["rows_out"] = max([entry["rows_out"]] + record["rows_out"])
+
+    return sorted(summary.values(), key=lambda entry: -entry["self_s"])
+
+
+def format_trace_summary(records: list = None):
+    """Formats the trace summary as a text table.
+
+    Parameters
+    ----------
+    records : list, optional
+        Records as returned by `get_trace`, by default the current trace.
+
+    Returns
+    -------
+    str
+        Returns the table, one line per function.
+    """
+    lines = [
+        "{:<52} {:>5} {:>9} {:>9} {:>9} {:>9} {:>12} {:>12}".format(
+            "function",
+            "calls",
+            "wall s",
+            "self s",
+            "cpu s",
+            "peak MB",
+            "rows in",
+            "rows out",
+        )
+    ]
+
+    for entry in summarize_trace(records):
+        lines.append(
+            "{name:<52} {calls:>5d} {wall_s:>9.3f} {self_s:>9.3f} {cpu_s:>9.3f} "
+            "{peak_mb:>9.1f} {rows_in:>12,d} {rows_out:>12,d}".format(**entry)
+        )
+
+    return "\n".join(lines)
+
+
+def dump_trace(path: str):
+    """Writes the trace and its summary to a JSON file.
+
+    Parameters
+    ----------
+    path : str
+        Complete path of the JSON file.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"trace": get_trace(), "summary": summarize_trace()}, f, indent=4)
+
+
+def dump_hottest_profile(path: str):
+    """Writes the cProfile statistics of the traced call with the largest
+    self time. Tracing must have been enabled with profile=True.
+
+    Parameters
+    ----------
+    path : str
+        Complete path of the profile, readable with pstats or snakeviz.
+
+    Returns
+    -------
+    str or None
+        Returns the name of the profiled call, or None if there is no
+        profile.
+    """
+    if not _PROFILES:
+        return None
+
+    position = max(_PROFILES, key=lambda position: _TRACE[position]["self_s"])
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    _PROFILES[position].dump_stats(path)
+
+    return _TRACE[position]["name"]
@@ -0,0 +1,394 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import asyncio
+import json
+import time
+import numpy as np
+import pandas as pd
+from collections import deque
+from src import (
+    FEATURES_PRICE_MODEL_Q1,
+    FEATURES_REVENUE_MODEL_Q1,
+    PATH_PREPROCESSOR_PRICE_MODEL_Q1,
+    PATH_PREPROCESSOR_REVENUE_MODEL_Q1,
+    PATH_REGRESSOR_PRICE_MODEL_Q1,
+    PATH_REGRESSOR_REVENUE_MODEL_Q1,
+)
+from src.commons import load_pickle, to_date
+from src.data.make_dataset import make_predict_dataset
+from src.features.build_features import CATEGORY_TIERS
+from src.models.preprocessing import preprocess_transform
+
+SERVICE_MODELS = {
+    "price": (
+        FEATURES_PRICE_MODEL_Q1,
+        PATH_PREPROCESSOR_PRICE_MODEL_Q1,
+        PATH_REGRESSOR_PRICE_MODEL_Q1,
+    ),
+    "revenue": (
+        FEATURES_REVENUE_MODEL_Q1,
+        PATH_PREPROCESSOR_REVENUE_MODEL_Q1,
+        PATH_REGRESSOR_REVENUE_MODEL_Q1,
+    ),
+}
+
+HTTP_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Error"}
+
+
+class MicroBatcher:
+    """Groups the design matrices of concurrent requests to a model into
+    a single preprocess and predict call.
+
+    Parameters
+    ----------
+    preprocessor : Any
+        Trained preprocessor of the model.
+    model : Any
+        Trained sklearn-like regressor.
+    max_delay : float, optional
+        Maximum time, in seconds, that a request waits for others to join
+        its batch, by default 0.002.
+    max_rows : int, optional
+        Maximum number of rows of a batch, by default 65536.
+    """
+
+    def __init__(self, preprocessor, model, max_delay=0.002, max_rows=65536):
+        self.preprocessor = preprocessor
+        self.model = model
+        self.max_delay = max_delay
+        self.max_rows = max_rows
+        self.queue = asyncio.Queue()
+        self.batch_sizes = deque(maxlen=10000)
+
+    async def predict(self, X: pd.DataFrame):
+        """Queues a design matrix and waits for its predictions.
+
+        Parameters
+        ----------
+        X : pd.DataFrame
+            Design matrix of the model.
+
+        Returns
+        -------
+        np.ndarray
+            Predictions of the model for each row of X.
+        """
+        if not isinstance(X, pd.DataFrame):
+            raise TypeError("X must be a DataFrame, not {}".format(type(X).__name__))
+
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((X, future))
+        return await future
+
+    async def run(self):
+        """Consumes the queue, predicting one batch at a time."""
+        loop = asyncio.get_running_loop()
+
+        while True:
+            items = [await self.queue.get()]
+            rows = len(items[0][0])
+            deadline = loop.time() + self.max_delay
+
+            while rows < self.max_rows:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                items.append(item)
+                rows += len(item[0])
+
+            self.batch_sizes.append(len(items))
+
+            try:
+                X = pd.concat([X for X, _ in items], ignore_index=True)
+                y = await loop.run_in_executor(None, self._predict, X)
+            except Exception as err:
+                if len(items) == 1:
+                    self._set_exception(items[0][1], err)
+                    continue
+                # A malformed request fails its batch: the requests are
+                # predicted one by one, so only the malformed ones fail.
+                for X_item, future in items:
+                    try:
+                        y_item = await loop.run_in_executor(None, self._predict, X_item)
+                    except Exception as item_err:
+                        self._set_exception(future, item_err)
+                    else:
+                        self._set_result(future, y_item)
+                continue
+
+            start = 0
+            for X_item, future in items:
+                self._set_result(future, y[start : start + len(X_item)])
+                start += len(X_item)
+
+    @staticmethod
+    def _set_result(future: asyncio.Future, result):
+        """Resolves the future of a request, unless it was cancelled."""
+        if not future.done():
+            future.set_result(result)
+
+    @staticmethod
+    def _set_exception(future: asyncio.Future, err: Exception):
+        """Fails the future of a request, unless it was cancelled."""
+        if not future.done():
+            future.set_exception(err)
+
+    def _predict(self, X: pd.DataFrame):
+        return self.model.predict(preprocess_transform(X, self.preprocessor))
+
+
+class PredictionService:
+    """Local HTTP service answering price and revenue queries with the
+    question 1 models, which are loaded once at start up.
+
+    Endpoints
+    ---------
+    POST /predict
+        Body {"model": "price" | "revenue", "queries": [{"Localização": "JUR",
+        "Categoria": "MASTER" or 5, "Quartos": 2, "start": "2022-03-01",
+        "end": "2022-03-31"}, ...]}. Returns, for each query, the dates, the
+        predictions of each date, their mean and their total.
+    GET /stats
+        Returns the number of requests served and the p50/p99 latencies.
+    """
+
+    def __init__(self, max_delay: float = 0.002):
+        self.max_delay = max_delay
+        self.models = {
+            name: (features, load_pickle(path_preprocessor), load_pickle(path_model))
+            for name, (
+                features,
+                path_preprocessor,
+                path_model,
+            ) in SERVICE_MODELS.items()
+        }
+        self.batchers = {}
+        self.tasks = []
+        self.latencies = deque(maxlen=100000)
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8765):
+        """Starts the batchers and the HTTP server.
+
+        Parameters
+        ----------
+        host : str, optional
+            Address to listen on, by default "127.0.0.1".
+        port : int, optional
+            Port to listen on, by default 8765.
+
+        Returns
+        -------
+        asyncio.AbstractServer
+            The running server.
+        """
+        for name, (_, preprocessor, model) in self.models.items():
+            self.batchers[name] = MicroBatcher(preprocessor, model, self.max_delay)
+            self.tasks.append(asyncio.ensure_future(self.batchers[name].run()))
+
+        return await asyncio.start_server(self.handle_connection, host, port)
+
+    async def handle_connection(self, reader, writer):
+        """Serves the HTTP/1.1 requests of a client connection."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, value = line.decode("latin-1").split(":", 1)
+                    headers[key.strip().lower()] = value.strip()
+
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                start = time.perf_counter()
+                status, response = await self.route(method, path, body)
+                if path == "/predict":
+                    self.latencies.append(time.perf_counter() - start)
+
+                payload = json.dumps(response).encode("utf-8")
+                writer.write(
+                    "HTTP/1.1 {:d} {}\r\nContent-Type: application/json\r\n"
+                    "Content-Length: {:d}\r\n\r\n".format(
+                        status, HTTP_REASONS[status], len(payload)
+                    ).encode("latin-1")
+                    + payload
+                )
+                await writer.drain()
+
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def route(self, method: str, path: str, body: bytes):
+        """Dispatches a request to its endpoint.
+
+        Returns
+        -------
+        tuple
+            Returns the HTTP status and the JSON serializable response.
+        """
+        if method == "GET" and path == "/stats":
+            return 200, self.stats()
+
+        if method != "POST" or path != "/predict":
+            return 404, {"error": "unknown endpoint {} {}".format(method, path)}
+
+        loop = asyncio.get_running_loop()
+
+        try:
+            request = json.loads(body)
+            if not isinstance(request, dict):
+                raise TypeError("the request body must be a JSON object")
+            name = request.get("model", "price")
+            if name not in self.models:
+                raise ValueError("unknown model " + str(name))
+            if not isinstance(request["queries"], list):
+                raise TypeError("queries must be a list")
+            # Building the design matrix is CPU bound, so it runs off the
+            # event loop like the predictions of the batchers.
+            X, spans, dates = await loop.run_in_executor(
+                None, self.make_design_matrix, name, request["queries"]
+            )
+        except (KeyError, TypeError, ValueError) as err:
+            return 400, {"error": str(err)}
+
+        try:
+            y = await self.batchers[name].predict(X)
+        except Exception as err:
+            return 500, {"error": str(err)}
+
+        results = []
+        for start, stop in spans:
+            predictions = y[start:stop]
+            results.append(
+                {
+                    "dates": [to_date(date) for date in dates[start:stop]],
+                    "predictions": predictions.tolist(),
+                    "mean": float(predictions.mean()) if stop > start else None,
+                    "total": float(predictions.sum()),
+                }
+            )
+
+        return 200, {"model": name, "results": results}
+
+    def make_design_matrix(self, name: str, queries: list):
+        """Builds a single design matrix for all the queries of a request.
+
+        Parameters
+        ----------
+        name : str
+            Name of the model.
+        queries : list
+            Query dicts with the keys 'Localização', 'Categoria', 'Quartos',
+            'start' and 'end'.
+
+        Returns
+        -------
+        tuple
+            Returns the design matrix, the (start, stop) rows of each query
+            and the date of each row.
+        """
+        dates, categorias, quartos, localizacoes, spans = [], [], [], [], []
+
+        for query in queries:
+            query_dates = pd.date_range(
+                start=pd.to_datetime(query["start"]), end=pd.to_datetime(query["end"])
+            )
+            categoria = query["Categoria"]
+            if isinstance(categoria, str):
+                categoria = CATEGORY_TIERS[categoria.upper()]
+
+            spans.append((len(dates), len(dates) + len(query_dates)))
+            dates.extend(query_dates)
+            categorias.extend([int(categoria)] * len(query_dates))
+            quartos.extend([int(query["Quartos"])] * len(query_dates))
+            localizacoes.extend([str(query["Localização"])] * len(query_dates))
+
+        if not dates:
+            raise ValueError("no dates to predict")
+
+        X = make_predict_dataset(
+            self.models[name][0], dates, categorias, quartos, localizacoes
+        )
+
+        return X, spans, dates
+
+    def stats(self):
+        """Returns the request count and the latency percentiles.
+
+        Returns
+        -------
+        dict
+            Returns the number of predict requests, their p50 and p99
+            latencies in milliseconds and the mean number of requests per
+            predict call.
+        """
+        latencies = np.array(self.latencies) * 1000
+        batch_sizes = [
+            size for batcher in self.batchers.values() for size in batcher.batch_sizes
+        ]
+
+        return {
+            "requests": len(latencies),
+            "p50_ms": float(np.percentile(latencies, 50)) if len(latencies) else None,
+            "p99_ms": float(np.percentile(latencies, 99)) if len(latencies) else None,
+            "requests_per_batch": float(np.mean(batch_sizes)) if batch_sizes else None,
+        }
+
+
+async def serve(host: str = "127.0.0.1", port: int = 8765, max_delay: float = 0.002):
+    """Runs the prediction service until it is interrupted.
+
+    Parameters
+    ----------
+    host : str, optional
+        Address to listen on, by default "127.0.0.1".
+    port : int, optional
+        Port to listen on, by default 8765.
+    max_delay : float, optional
+        Maximum batching delay in seconds, by default 0.002.
+    """
+    service = PredictionService(max_delay)
+    server = await service.start(host, port)
+
+    print("Serving predictions on http://{}:{:d}".format(host, port))
+
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    """Command line entry point of the prediction service."""
+    parser = argparse.ArgumentParser(description="Local price and revenue predictions")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument(
+        "--max-delay",
+        type=float,
+        default=0.002,
+        help="maximum time in seconds a request waits to be batched",
+    )
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args.host, args.port, args.max_delay))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -2,86 +2,157 @@
 
 import pandas as pd
 import numpy as np
-from sklearn.impute import SimpleImputer
-from sklearn.preprocessing import MinMaxScaler
-from src.commons import transform_dataframe
 
 
-def one_hot_encode_column(dataframe: pd.DataFrame, column_name: str):
-    """Applies the one-hot enconding method to a specified categorical
-    column of a given dataframe.
+class DesignMatrixEncoder:
+    """Encodes dataframes into a design matrix with a fixed column layout.
+
+    The categories of each categorical column are taken from the feature
+    names ('<column>_<category>'), so the same columns are produced at
+    training and at prediction time regardless of the categories present
+    in the data. Categories out of the vocabulary are encoded as all zeros.
 
     Parameters
     ----------
-    dataframe : pd.DataFrame
-        Dataframe with the objective column.
-    column_name : str
-        Column name to be encoded
-
-    Returns
-    -------
-    pd.DataFrame
-        Returns the input dataframe with the one-hot encoded columns added.
+    features : list
+        Ordered names of the columns of the design matrix.
+    categorical_columns : tuple, optional
+        Columns to be one-hot encoded, by default ("Localização", "day_of_week").
+    dtype : str, optional
+        Data type of the design matrix, by default "float32".
     """
-    return pd.concat(
-        [
-            dataframe,
-            pd.get_dummies(dataframe[column_name], prefix=column_name, drop_first=True),
-        ],
-        axis=1,
-    ).drop(columns=column_name)
 
-
-def preprocess_transform(X: pd.DataFrame, preprocess: list):
-    """Applies a sequence of transformations in a given dataframe.
+    def __init__(
+        self,
+        features: list,
+        categorical_columns: tuple = ("Localização", "day_of_week"),
+        dtype: str = "float32",
+    ):
+        self.features = list(features)
+        self.dtype = np.dtype(dtype)
+        self.vocabularies = {}
+
+        for column in categorical_columns:
+            prefix = column + "_"
+            positions = [
+                j for j, name in enumerate(self.features) if name.startswith(prefix)
+            ]
+            self.vocabularies[column] = (
+                [self.features[j][len(prefix) :] for j in positions],
+                np.array(positions, dtype=np.intp),
+            )
+
+    def transform(self, dataframe: pd.DataFrame):
+        """Fills a preallocated design matrix with the features of a dataframe.
+
+        Columns named as a feature are copied as they are, categorical
+        columns are one-hot encoded into their vocabulary positions and the
+        remaining features are left as zeros.
+
+        Parameters
+        ----------
+        dataframe : pd.DataFrame
+            Dataframe with the feature and categorical columns.
+
+        Returns
+        -------
+        pd.DataFrame
+            Returns a dataframe backed by the design matrix, with the columns
+            in the order given by `features`.
+        """
+        matrix = np.zeros((len(dataframe), len(self.features)), dtype=self.dtype)
+
+        for j, name in enumerate(self.features):
+            if name in dataframe.columns:
+                matrix[:, j] = dataframe[name].to_numpy(
+                    dtype=self.dtype, na_value=np.nan
+                )
+
+        for column, (vocabulary, positions) in self.vocabularies.items():
+            if column in dataframe.columns and len(vocabulary) > 0:
+                codes = pd.Categorical(dataframe[column], categories=vocabulary).codes
+                rows = np.flatnonzero(codes >= 0)
+                matrix[rows, positions[codes[rows]]] = 1
+
+        return pd.DataFrame(matrix, columns=self.features, index=dataframe.index)
+
+
+class ImputeScalePreprocessor:
+    """Mean imputation followed by min-max scaling, fused into a single
+    affine transformation of the design matrix.
+
+    Missing values are replaced by the column means seen in training and
+    the matrix is mapped to the [0, 1] range of the training data with
+    `where(isnan(x), mean, x) * scale + offset`. The fitted state is three
+    arrays, which is also what gets pickled.
 
     Parameters
     ----------
-    X : pd.DataFrame
-        Dataframe to be transformed.
-    preprocess : list
-        List of sklearn type transformations to be applied on dataframe
-
-    Returns
-    -------
-    pd.DataFrame
-        Returns the transformed dataframe.
+    columns : list
+        Names of the columns seen in training.
+    mean : np.ndarray
+        Training mean of each column.
+    scale : np.ndarray
+        Multiplicative factor of each column.
+    offset : np.ndarray
+        Additive term of each column.
     """
 
-    for p in preprocess:
-        X = transform_dataframe(p, X)
+    def __init__(
+        self, columns: list, mean: np.ndarray, scale: np.ndarray, offset: np.ndarray
+    ):
+        self.columns = list(columns)
+        self.parameters = np.vstack([mean, scale, offset]).astype(np.float64)
 
-    return X
+    @property
+    def mean(self):
+        return self.parameters[0]
 
+    @property
+    def scale(self):
+        return self.parameters[1]
 
-def fit_preprocess_price_model_q1(X_train: pd.DataFrame):
-    """Trains the preprocess pipeline stages of the model for question 1
-    with a given dataframe
+    @property
+    def offset(self):
+        return self.parameters[2]
 
-    Parameters
-    ----------
-    X_train : pd.DataFrame
-        Dataframe to train the preprocess pipeline
+    def transform(self, X: pd.DataFrame):
+        """Imputes and scales a dataframe.
 
-    Returns
-    -------
-    tuple
-        Returns a tuple with all stages of the pipeline trained.
-    """
-    imputer = SimpleImputer(strategy="mean")
-    imputer.fit(X_train)
-    X_train = imputer.transform(X_train)
+        Parameters
+        ----------
+        X : pd.DataFrame
+            Dataframe to be transformed, with the training columns.
+
+        Returns
+        -------
+        pd.DataFrame
+            Returns the transformed dataframe.
+        """
+        if X.shape[1] != len(self.columns):
+            raise ValueError(
+                "X has {:d} features, but the preprocessor expects {:d}.".format(
+                    X.shape[1], len(self.columns)
+                )
+            )
+
+        values = np.array(X, dtype=np.float64)
+        np.copyto(values, self.mean, where=np.isnan(values))
+        values *= self.scale
+        values += self.offset
+
+        return pd.DataFrame(values, columns=X.columns, index=X.index)
 
-    scaler = MinMaxScaler()
-    scaler.fit(X_train)
-    X_train = scaler.transform(X_train)
+    def __getstate__(self):
+        return {"columns": self.columns, "parameters": self.parameters}
 
-    return imputer, scaler
+    def __setstate__(self, state):
+        self.columns = state["columns"]
+        self.parameters = state["parameters"]
 
 
-def fit_preprocess_revenue_model_q2(X_train: pd.DataFrame):
-    """Trains the preprocess pipeline stages of the model for question 2
-    with a given dataframe.
+def fit_preprocess(X_train: pd.DataFrame):
+    """Trains the preprocess pipeline of a model with a given dataframe.
 
     Parameters
     ----------
@@ -90,65 +161,65 @@ def fit_preprocess_revenue_model_q2(X_train: pd.DataFrame):
 
     Returns
     -------
-    tuple
-        Returns a tuple with all stages of the pipeline trained.
+    ImputeScalePreprocessor
+        Returns the trained preprocessor.
     """
-    imputer = SimpleImputer(strategy="mean")
-    imputer.fit(X_train)
-    X_train = imputer.transform(X_train)
+    values = np.array(X_train, dtype=np.float64)
+    missing = np.isnan(values)
 
-    scaler = MinMaxScaler()
-    scaler.fit(X_train)
-    X_train = scaler.transform(X_train)
+    mean = np.where(missing, 0, values).sum(axis=0) / np.maximum(
+        (~missing).sum(axis=0), 1
+    )
+    np.copyto(values, mean, where=missing)
 
-    return imputer, scaler
+    data_min = values.min(axis=0)
+    data_range = values.max(axis=0) - data_min
+    data_range[data_range == 0] = 1
 
+    scale = 1 / data_range
+    offset = -data_min * scale
 
-def fit_preprocess_reservations_model_q3(X_train: pd.DataFrame):
-    """Trains the preprocess pipeline stages of the model for question 3
-    with a given dataframe.
+    return ImputeScalePreprocessor(X_train.columns, mean, scale, offset)
+
+
+def compile_preprocessor(preprocess: tuple, columns: list):
+    """Converts a trained (SimpleImputer, MinMaxScaler) tuple into the
+    equivalent fused preprocessor.
 
     Parameters
     ----------
-    X_train : pd.DataFrame
-        Dataframe to train the preprocess pipeline
+    preprocess : tuple
+        Trained imputer and scaler, in this order.
+    columns : list
+        Names of the columns seen in training.
 
     Returns
     -------
-    tuple
-        Returns a tuple with all stages of the pipeline trained.
+    ImputeScalePreprocessor
+        Returns the fused preprocessor.
     """
-    imputer = SimpleImputer(strategy="mean")
-    imputer.fit(X_train)
-    X_train = imputer.transform(X_train)
+    imputer, scaler = preprocess
+    return ImputeScalePreprocessor(
+        columns, imputer.statistics_, scaler.scale_, scaler.min_
+    )
 
-    scaler = MinMaxScaler()
-    scaler.fit(X_train)
-    X_train = scaler.transform(X_train)
 
-    return imputer, scaler
-
-
-def fit_preprocess_covid_impact_model(X_train: pd.DataFrame):
-    """Trains the preprocess pipeline stages of the model with a given
-    dataframe.
+def preprocess_transform(X: pd.DataFrame, preprocess):
+    """Applies the preprocess pipeline of a model in a given dataframe.
 
     Parameters
     ----------
-    X_train : pd.DataFrame
-        Dataframe to train the preprocess pipeline
+    X : pd.DataFrame
+        Dataframe to be transformed.
+    preprocess : ImputeScalePreprocessor or tuple
+        Trained preprocessor, or a legacy (SimpleImputer, MinMaxScaler) tuple.
 
     Returns
     -------
-    tuple
-        Returns a tuple with all stages of the pipeline trained.
+    pd.DataFrame
+        Returns the transformed dataframe.
     """
-    imputer = SimpleImputer(strategy="mean")
-    imputer.fit(X_train)
-    X_train = imputer.transform(X_train)
-
-    scaler = MinMaxScaler()
-    scaler.fit(X_train)
-    X_train = scaler.transform(X_train)
+    if isinstance(preprocess, (tuple, list)):
+        preprocess = compile_preprocessor(preprocess, X.columns)
 
-    return imputer, scaler
+    return preprocess.transform(X)
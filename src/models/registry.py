@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import os
+import pandas as pd
+from src import PATH_MODEL_REGISTRY
+from src.commons import hash_files
+
+THREAD_PARAMETERS = {"n_jobs", "nthread", "verbose", "verbosity"}
+
+
+def fingerprint_training(X: pd.DataFrame, y: pd.Series, model, random_state: int = 42):
+    """Computes a fingerprint of a training run from its data, estimator
+    class, hyperparameters and random seed.
+
+    Parameters that only change how many threads are used are left out, so
+    the same model trained with a different thread budget is not retrained.
+
+    Parameters
+    ----------
+    X : pd.DataFrame
+        Features of the model.
+    y : pd.Series
+        Target of the model.
+    model : Any
+        A sklearn-like regressor instance.
+    random_state : int, optional
+        Seed of the train/test split, by default 42.
+
+    Returns
+    -------
+    str
+        Hexadecimal digest of the training run.
+    """
+    params = {
+        key: value
+        for key, value in model.get_params().items()
+        if key not in THREAD_PARAMETERS
+    }
+
+    digest = hashlib.sha256()
+    digest.update(
+        json.dumps(
+            {
+                "columns": [str(column) for column in X.columns],
+                "dtypes": [str(dtype) for dtype in X.dtypes],
+                "estimator": type(model).__module__ + "." + type(model).__name__,
+                "params": params,
+                "random_state": random_state,
+            },
+            sort_keys=True,
+            default=repr,
+        ).encode("utf-8")
+    )
+    digest.update(pd.util.hash_pandas_object(X, index=False).values.tobytes())
+    digest.update(pd.util.hash_pandas_object(y, index=False).values.tobytes())
+
+    return digest.hexdigest()
+
+
+def lookup_model(name: str, fingerprint: str):
+    """Returns the registry entry of a model if it was last trained with
+    the given fingerprint and its artifacts are unchanged on disk.
+
+    Parameters
+    ----------
+    name : str
+        Name of the model.
+    fingerprint : str
+        Fingerprint of the training run, see `fingerprint_training`.
+
+    Returns
+    -------
+    dict or None
+        Returns the registry entry, with the keys 'fingerprint', 'mae',
+        'preprocessor', 'regressor' and 'artifacts', or None if the model
+        has to be trained.
+    """
+    path = _registry_path(name)
+
+    if not os.path.exists(path):
+        return None
+
+    with open(path, "r", encoding="utf-8") as f:
+        entry = json.load(f)
+
+    paths = [entry["preprocessor"], entry["regressor"]]
+
+    if entry["fingerprint"] != fingerprint or not all(map(os.path.exists, paths)):
+        return None
+
+    if hash_files(paths) != entry["artifacts"]:
+        return None
+
+    return entry
+
+
+def register_model(
+    name: str,
+    fingerprint: str,
+    score: float,
+    path_preprocessor: str,
+    path_regressor: str,
+):
+    """Records the fingerprint, score and artifacts of a trained model.
+
+    Parameters
+    ----------
+    name : str
+        Name of the model.
+    fingerprint : str
+        Fingerprint of the training run, see `fingerprint_training`.
+    score : float
+        Mean absolute error of the model on the test split.
+    path_preprocessor : str
+        Complete file path to the dumped preprocessor.
+    path_regressor : str
+        Complete file path to the dumped regressor.
+    """
+    entry = {
+        "fingerprint": fingerprint,
+        "mae": float(score),
+        "preprocessor": path_preprocessor,
+        "regressor": path_regressor,
+        "artifacts": hash_files([path_preprocessor, path_regressor]),
+    }
+
+    path = _registry_path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(entry, f, indent=4)
+    os.replace(path + ".tmp", path)
+
+
+def _registry_path(name: str):
+    """Returns the path of the registry entry of a model.
+
+    Parameters
+    ----------
+    name : str
+        Name of the model.
+
+    Returns
+    -------
+    str
+        Complete path to the registry entry.
+    """
+    return os.path.join(PATH_MODEL_REGISTRY, name + ".json")
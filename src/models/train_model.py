@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
 
+import json
+import os
 import pandas as pd
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.model_selection import train_test_split
 from sklearn.neural_network import MLPRegressor
+from threadpoolctl import threadpool_limits
 from xgboost import XGBRegressor
 from sklearn.metrics import mean_absolute_error as mae
 from src import (
@@ -17,6 +20,7 @@ from src import (
     PATH_REGRESSOR_RESERVATIONS_MODEL_Q3,
     PATH_REGRESSOR_REVENUE_MODEL_Q1,
     PATH_REGRESSOR_REVENUE_MODEL_Q2,
+    PATH_TRAINING_RESULTS,
 )
 from src.features.build_features import (
     build_features_covid_impact_model,
@@ -25,59 +29,94 @@ from src.features.build_features import (
     build_features_revenue_model_q2,
     build_features_price_model_q1,
 )
-from src.models.preprocessing import (
-    fit_preprocess_covid_impact_model,
-    fit_preprocess_price_model_q1,
-    fit_preprocess_reservations_model_q3,
-    fit_preprocess_revenue_model_q2,
-    preprocess_transform,
-)
+from src.models.preprocessing import fit_preprocess, preprocess_transform
+from src.models.registry import fingerprint_training, lookup_model, register_model
 from src.commons import dump_pickle
+from src.instrumentation import trace_span, traced
 
+RANDOM_STATE = 42
 
-def train_price_model_q1(df_listings: pd.DataFrame, df_daily_revenue: pd.DataFrame):
-    """Trains the price estimator to be used on question 1.
+
+@traced
+def fit_and_dump_model(
+    name: str,
+    X: pd.DataFrame,
+    y: pd.Series,
+    model,
+    path_preprocessor: str,
+    path_regressor: str,
+    n_jobs: int = None,
+):
+    """Splits the data, trains the preprocessor and the regressor, evaluates
+    the regressor on the test split and dumps both to disk.
+
+    Training is skipped when the model registry shows that the artifacts on
+    disk were trained with the same data, estimator and hyperparameters; the
+    stored score is returned instead.
 
     Parameters
     ----------
-    df_listings : pd.DataFrame
-        Pandas dataframe with information about listings.
-    df_daily_revenue : pd.DataFrame
-        Pandas dataframe with information about daily revenue.
+    name : str
+        Name of the model in the registry.
+    X : pd.DataFrame
+        Features of the model.
+    y : pd.Series
+        Target of the model.
+    model : Any
+        A sklearn-like regressor instance, not yet fitted.
+    path_preprocessor : str
+        Complete file path to the dumped preprocessor.
+    path_regressor : str
+        Complete file path to the dumped regressor.
+    n_jobs : int, optional
+        Maximum number of threads used by native libraries, by default None
+        (no limit).
 
     Returns
     -------
-    pd.DataFrame
-         Returns a sklearn-like regressor instance.
+    float
+        Returns the mean absolute error on the test split.
     """
+    fingerprint = fingerprint_training(X, y, model, random_state=RANDOM_STATE)
 
-    print("Training price model - Q1")
+    entry = lookup_model(name, fingerprint)
 
-    X, y = build_features_price_model_q1(df_listings, df_daily_revenue)
+    if entry is not None:
+        print("Model unchanged, reusing " + entry["regressor"])
+        print("MAE(teste) = {:.2f}".format(entry["mae"]))
+        return entry["mae"]
 
     X_train, X_test, y_train, y_test = train_test_split(
-        X, y, test_size=0.3, random_state=42
+        X, y, test_size=0.3, random_state=RANDOM_STATE
     )
 
-    preprocessor = fit_preprocess_price_model_q1(X_train)
+    preprocessor = fit_preprocess(X_train)
 
     X_train = preprocess_transform(X_train, preprocessor)
 
     X_test = preprocess_transform(X_test, preprocessor)
 
-    model = XGBRegressor(max_depth=6, n_estimators=300).fit(X_train, y_train)
+    with threadpool_limits(limits=n_jobs):
+        with trace_span(type(model).__name__ + ".fit", [len(X_train)]):
+            model = model.fit(X_train, y_train)
+        score = mae(y_test, model.predict(X_test))
 
-    score = mae(y_test, model.predict(X_test))
+    dump_pickle(preprocessor, path_preprocessor)
 
-    dump_pickle(preprocessor, PATH_PREPROCESSOR_PRICE_MODEL_Q1)
+    dump_pickle(model, path_regressor)
 
-    dump_pickle(model, PATH_REGRESSOR_PRICE_MODEL_Q1)
+    register_model(name, fingerprint, score, path_preprocessor, path_regressor)
 
     print("MAE(teste) = {:.2f}".format(score))
 
+    return score
 
-def train_revenue_model_q1(df_listings: pd.DataFrame, df_daily_revenue: pd.DataFrame):
-    """Trains the revenue estimator to be used on question 1.
+
+@traced
+def train_price_model_q1(
+    df_listings: pd.DataFrame, df_daily_revenue: pd.DataFrame, n_jobs: int = None
+):
+    """Trains the price estimator to be used on question 1.
 
     Parameters
     ----------
@@ -85,39 +124,83 @@ def train_revenue_model_q1(df_listings: pd.DataFrame, df_daily_revenue: pd.DataF
         Pandas dataframe with information about listings.
     df_daily_revenue : pd.DataFrame
         Pandas dataframe with information about daily revenue.
+    n_jobs : int, optional
+        Number of threads used in training, by default None (all cores).
 
     Returns
     -------
-    pd.DataFrame
-         Returns a sklearn-like regressor instance.
+    float
+         Returns the mean absolute error of the model on the test split.
     """
 
-    print("Training revenue model - Q1")
+    print("Training price model - Q1")
 
-    X, y = build_features_revenue_model_q1(df_listings, df_daily_revenue)
+    X, y = build_features_price_model_q1(df_listings, df_daily_revenue)
 
-    X_train, X_test, y_train, y_test = train_test_split(
-        X, y, test_size=0.3, random_state=42
+    model = XGBRegressor(max_depth=6, n_estimators=300, n_jobs=n_jobs)
+
+    return fit_and_dump_model(
+        "price_model_q1",
+        X,
+        y,
+        model,
+        PATH_PREPROCESSOR_PRICE_MODEL_Q1,
+        PATH_REGRESSOR_PRICE_MODEL_Q1,
+        n_jobs,
     )
 
-    preprocessor = fit_preprocess_revenue_model_q2(X_train)
 
-    X_train = preprocess_transform(X_train, preprocessor)
+@traced
+def train_revenue_model_q1(
+    df_listings: pd.DataFrame,
+    df_daily_revenue: pd.DataFrame,
+    n_jobs: int = None,
+    aggregates=None,
+):
+    """Trains the revenue estimator to be used on question 1.
 
-    X_test = preprocess_transform(X_test, preprocessor)
+    Parameters
+    ----------
+    df_listings : pd.DataFrame
+        Pandas dataframe with information about listings.
+    df_daily_revenue : pd.DataFrame
+        Pandas dataframe with information about daily revenue.
+    n_jobs : int, optional
+        Number of threads used in training, by default None (all cores).
+    aggregates : DailyAggregates or ShardedAggregates, optional
+        Company revenue sums the features are built from instead of the
+        datasets, by default None.
 
-    model = XGBRegressor(max_depth=6, n_estimators=300).fit(X_train, y_train)
+    Returns
+    -------
+    float
+         Returns the mean absolute error of the model on the test split.
+    """
 
-    score = mae(y_test, model.predict(X_test))
+    print("Training revenue model - Q1")
 
-    dump_pickle(preprocessor, PATH_PREPROCESSOR_REVENUE_MODEL_Q1)
+    X, y = build_features_revenue_model_q1(df_listings, df_daily_revenue, aggregates)
 
-    dump_pickle(model, PATH_REGRESSOR_REVENUE_MODEL_Q1)
+    model = XGBRegressor(max_depth=6, n_estimators=300, n_jobs=n_jobs)
 
-    print("MAE(teste) = {:.2f}".format(score))
+    return fit_and_dump_model(
+        "revenue_model_q1",
+        X,
+        y,
+        model,
+        PATH_PREPROCESSOR_REVENUE_MODEL_Q1,
+        PATH_REGRESSOR_REVENUE_MODEL_Q1,
+        n_jobs,
+    )
 
 
-def train_revenue_model_q2(df_listings: pd.DataFrame, df_daily_revenue: pd.DataFrame):
+@traced
+def train_revenue_model_q2(
+    df_listings: pd.DataFrame,
+    df_daily_revenue: pd.DataFrame,
+    n_jobs: int = None,
+    aggregates=None,
+):
     """Trains the revenue estimator to be used on question 2.
 
     Parameters
@@ -126,26 +209,21 @@ def train_revenue_model_q2(df_listings: pd.DataFrame, df_daily_revenue: pd.DataF
         Pandas dataframe with information about listings.
     df_daily_revenue : pd.DataFrame
         Pandas dataframe with information about daily revenue.
+    n_jobs : int, optional
+        Number of threads used in training, by default None (all cores).
+    aggregates : DailyAggregates or ShardedAggregates, optional
+        Company revenue sums the features are built from instead of the
+        datasets, by default None.
 
     Returns
     -------
-    pd.DataFrame
-         Returns a sklearn-like regressor instance.
+    float
+         Returns the mean absolute error of the model on the test split.
     """
 
     print("Training revenue model - Q2")
 
-    X, y = build_features_revenue_model_q2(df_listings, df_daily_revenue)
-
-    X_train, X_test, y_train, y_test = train_test_split(
-        X, y, test_size=0.3, random_state=42
-    )
-
-    preprocessor = fit_preprocess_revenue_model_q2(X_train)
-
-    X_train = preprocess_transform(X_train, preprocessor)
-
-    X_test = preprocess_transform(X_test, preprocessor)
+    X, y = build_features_revenue_model_q2(df_listings, df_daily_revenue, aggregates)
 
     model = MLPRegressor(
         hidden_layer_sizes=(5, 10, 10, 5, 5),
@@ -153,60 +231,66 @@ def train_revenue_model_q2(df_listings: pd.DataFrame, df_daily_revenue: pd.DataF
         learning_rate="adaptive",
         learning_rate_init=0.03,
         max_iter=10000,
-        random_state=42,
-    ).fit(X_train, y_train)
-
-    score = mae(y_test, model.predict(X_test))
-
-    dump_pickle(preprocessor, PATH_PREPROCESSOR_REVENUE_MODEL_Q2)
-
-    dump_pickle(model, PATH_REGRESSOR_REVENUE_MODEL_Q2)
+        random_state=RANDOM_STATE,
+    )
 
-    print("MAE(teste) = {:.2f}".format(score))
+    return fit_and_dump_model(
+        "revenue_model_q2",
+        X,
+        y,
+        model,
+        PATH_PREPROCESSOR_REVENUE_MODEL_Q2,
+        PATH_REGRESSOR_REVENUE_MODEL_Q2,
+        n_jobs,
+    )
 
 
-def train_reservations_model_q3(df_daily_revenue: pd.DataFrame):
+@traced
+def train_reservations_model_q3(
+    df_daily_revenue: pd.DataFrame, n_jobs: int = None, aggregates=None
+):
     """Trains the revenue estimator to be used on question 3.
 
     Parameters
     ----------
     df_daily_revenue : pd.DataFrame
         Pandas dataframe with information about daily revenue.
+    n_jobs : int, optional
+        Number of threads used in training, by default None (all cores).
+    aggregates : ShardedAggregates, optional
+        Aggregates the reservations per creation date are read from instead
+        of the dataset, by default None.
 
     Returns
     -------
-    pd.DataFrame
-         Returns a sklearn-like regressor instance.
+    float
+         Returns the mean absolute error of the model on the test split.
     """
 
     print("Training reservations model - Q3")
 
-    X, y = build_features_reservations_model_q3(df_daily_revenue)
-
-    X_train, X_test, y_train, y_test = train_test_split(
-        X, y, test_size=0.3, random_state=42
-    )
-
-    preprocessor = fit_preprocess_reservations_model_q3(X_train)
+    X, y = build_features_reservations_model_q3(df_daily_revenue, aggregates)
 
-    X_train = preprocess_transform(X_train, preprocessor)
+    model = XGBRegressor(max_depth=6, n_estimators=100, reg_alpha=0.5, n_jobs=n_jobs)
 
-    X_test = preprocess_transform(X_test, preprocessor)
-
-    model = XGBRegressor(max_depth=6, n_estimators=100, reg_alpha=0.5).fit(
-        X_train, y_train
+    return fit_and_dump_model(
+        "reservations_model_q3",
+        X,
+        y,
+        model,
+        PATH_PREPROCESSOR_RESERVATIONS_MODEL_Q3,
+        PATH_REGRESSOR_RESERVATIONS_MODEL_Q3,
+        n_jobs,
     )
 
-    score = mae(y_test, model.predict(X_test))
-
-    dump_pickle(preprocessor, PATH_PREPROCESSOR_RESERVATIONS_MODEL_Q3)
 
-    dump_pickle(model, PATH_REGRESSOR_RESERVATIONS_MODEL_Q3)
-
-    print("MAE(teste) = {:.2f}".format(score))
-
-
-def train_covid_impact_model(df_listings: pd.DataFrame, df_daily_revenue: pd.DataFrame):
+@traced
+def train_covid_impact_model(
+    df_listings: pd.DataFrame,
+    df_daily_revenue: pd.DataFrame,
+    n_jobs: int = None,
+    aggregates=None,
+):
     """Trains the revenue estimator to be used to estimate covid-19 impact.
 
     Parameters
@@ -215,35 +299,118 @@ def train_covid_impact_model(df_listings: pd.DataFrame, df_daily_revenue: pd.Dat
         Pandas dataframe with information about listings.
     df_daily_revenue : pd.DataFrame
         Pandas dataframe with information about daily revenue.
+    n_jobs : int, optional
+        Number of threads used in training, by default None (all cores).
+    aggregates : DailyAggregates or ShardedAggregates, optional
+        Company revenue sums the features are built from instead of the
+        datasets, by default None.
 
     Returns
     -------
-    pd.DataFrame
-         Returns a sklearn-like regressor instance.
+    float
+         Returns the mean absolute error of the model on the test split.
     """
 
     print("Training model for covid-19 impact on revenue")
 
-    X, y = build_features_covid_impact_model(df_listings, df_daily_revenue)
+    X, y = build_features_covid_impact_model(df_listings, df_daily_revenue, aggregates)
 
-    X_train, X_test, y_train, y_test = train_test_split(
-        X, y, test_size=0.3, random_state=42
+    model = RandomForestRegressor(
+        n_estimators=100, random_state=RANDOM_STATE, n_jobs=n_jobs
     )
 
-    preprocessor = fit_preprocess_covid_impact_model(X_train)
+    return fit_and_dump_model(
+        "covid_impact_model",
+        X,
+        y,
+        model,
+        PATH_PREPROCESSOR_COVID_IMPACT,
+        PATH_REGRESSOR_COVID_IMPACT,
+        n_jobs,
+    )
 
-    X_train = preprocess_transform(X_train, preprocessor)
 
-    X_test = preprocess_transform(X_test, preprocessor)
+TRAINING_JOBS = {
+    "price_model_q1": (
+        train_price_model_q1,
+        True,
+        PATH_REGRESSOR_PRICE_MODEL_Q1,
+    ),
+    "revenue_model_q1": (
+        train_revenue_model_q1,
+        True,
+        PATH_REGRESSOR_REVENUE_MODEL_Q1,
+    ),
+    "revenue_model_q2": (
+        train_revenue_model_q2,
+        True,
+        PATH_REGRESSOR_REVENUE_MODEL_Q2,
+    ),
+    "reservations_model_q3": (
+        train_reservations_model_q3,
+        False,
+        PATH_REGRESSOR_RESERVATIONS_MODEL_Q3,
+    ),
+    "covid_impact_model": (
+        train_covid_impact_model,
+        True,
+        PATH_REGRESSOR_COVID_IMPACT,
+    ),
+}
+
+
+def run_training_job(name: str, *datasets, **kwargs):
+    """Runs one of the TRAINING_JOBS. Used by the training stages of the
+    pipeline.
 
-    model = RandomForestRegressor(n_estimators=100, random_state=42).fit(
-        X_train, y_train
-    )
+    Parameters
+    ----------
+    name : str
+        Name of the job in TRAINING_JOBS.
+    *datasets : pd.DataFrame
+        The datasets expected by the training function.
+    **kwargs
+        Keyword arguments of the training function, like n_jobs and
+        aggregates.
 
-    score = mae(y_test, model.predict(X_test))
+    Returns
+    -------
+    tuple
+        Returns the mean absolute error of the model on the test split and
+        the path to the dumped regressor.
+    """
+    train, _, path_regressor = TRAINING_JOBS[name]
+    return train(*datasets, **kwargs), path_regressor
 
-    dump_pickle(preprocessor, PATH_PREPROCESSOR_COVID_IMPACT)
 
-    dump_pickle(model, PATH_REGRESSOR_COVID_IMPACT)
+def save_training_results(results: dict, path: str = PATH_TRAINING_RESULTS):
+    """Stores the results of training jobs, keeping the stored results of
+    the jobs that did not run.
 
-    print("MAE(teste) = {:.2f}".format(score))
+    Parameters
+    ----------
+    results : dict
+        Mean absolute error and path to the regressor of each job, as
+        returned by run_training_job.
+    path : str, optional
+        Complete file path to the JSON file, by default
+        PATH_TRAINING_RESULTS.
+
+    Returns
+    -------
+    dict
+        Returns all the stored results, by job name.
+    """
+    stored = {}
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            stored = json.load(f)
+
+    for name, (score, path_regressor) in results.items():
+        stored[name] = {"mae": float(score), "regressor": path_regressor}
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(stored, f, indent=2, sort_keys=True)
+
+    return stored
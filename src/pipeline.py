@@ -0,0 +1,672 @@
+# -*- coding: utf-8 -*-
+
+import contextlib
+import glob
+import io
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from src import (
+    PATH_ANSWERS,
+    PATH_COVID_IMPACT_GRAPH,
+    PATH_DAILY_REVENUE,
+    PATH_DATA_AGGREGATES,
+    PATH_HISTOGRAM_BOOKINGS,
+    PATH_LISTINGS,
+    PATH_PLOT_REVENUE_PER_DATE,
+    PATH_PREPROCESSOR_COVID_IMPACT,
+    PATH_PREPROCESSOR_PRICE_MODEL_Q1,
+    PATH_PREPROCESSOR_RESERVATIONS_MODEL_Q3,
+    PATH_PREPROCESSOR_REVENUE_MODEL_Q1,
+    PATH_PREPROCESSOR_REVENUE_MODEL_Q2,
+    PATH_REGRESSOR_COVID_IMPACT,
+    PATH_REGRESSOR_PRICE_MODEL_Q1,
+    PATH_REGRESSOR_RESERVATIONS_MODEL_Q3,
+    PATH_REGRESSOR_REVENUE_MODEL_Q1,
+    PATH_REGRESSOR_REVENUE_MODEL_Q2,
+    PATH_REVENUE_COMPARISON,
+    PATH_SEASONAL_DECOMPOSE_RESERVATIONS,
+    PATH_SEASONAL_DECOMPOSE_REVENUE,
+)
+from src.instrumentation import trace_span
+
+DATA_FILES = [PATH_LISTINGS, PATH_DAILY_REVENUE]
+
+# Persisted aggregates of `src.data.incremental` and their tables. They are
+# an input of the stages accepting these tables when the run appends to them,
+# as they are read instead of the datasets.
+AGGREGATES_FILES = [PATH_DATA_AGGREGATES]
+AGGREGATES_TABLES = ["per_date", "per_group"]
+
+# The source files are found from the location of the package, so they are
+# tracked whatever the working directory of the run.
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _sources(*paths):
+    return [os.path.join(PROJECT_ROOT, path) for path in paths]
+
+
+# Source files of the code run by each kind of stage, so a stage is rerun
+# when its code changes.
+SOURCES_FEATURES = _sources(
+    "src/__init__.py",
+    "src/commons.py",
+    "src/data/listing_ids.py",
+    "src/data/make_dataset.py",
+    "src/features/build_features.py",
+    "src/features/company_revenue.py",
+    "src/features/decomposition.py",
+    "src/features/pickup.py",
+    "src/features/reservations.py",
+    "src/models/preprocessing.py",
+)
+
+SOURCES_TRAINING = SOURCES_FEATURES + _sources(
+    "src/models/registry.py",
+    "src/models/train_model.py",
+)
+
+SOURCES_REPORTS = SOURCES_FEATURES + _sources("src/reports/reports.py")
+
+# Every plotting module, so a new one is tracked without listing it here.
+SOURCES_PLOTS = SOURCES_FEATURES + sorted(
+    glob.glob(os.path.join(PROJECT_ROOT, "src", "visualization", "*.py"))
+)
+
+# Datasets shared by the stages run in a process, and the company revenue
+# aggregates if any, set by `run_pipeline` or by the worker initializer.
+_DATASETS = {}
+
+
+class Stage:
+    """A step of the pipeline with its declared inputs and outputs.
+
+    Parameters
+    ----------
+    name : str
+        Unique name of the stage.
+    function : Callable
+        Module level function running the stage. It receives the datasets,
+        in the declared order, and the keyword argument n_jobs if
+        `threaded` is True.
+    datasets : list, optional
+        Names of the datasets used, among 'listings' and 'daily_revenue',
+        by default none.
+    inputs : list, optional
+        Paths of the files read by the stage, including the outputs of
+        other stages and its source code, by default none.
+    outputs : list, optional
+        Paths of the files written by the stage, by default none. The text
+        printed by the stage is always kept in PATH_ANSWERS/<name>.txt,
+        which is an output too, and the parameters of the run producing the
+        outputs in the stamp PATH_ANSWERS/<name>.json.
+    threaded : bool, optional
+        Whether the function accepts the number of threads as n_jobs, by
+        default False.
+    aggregates : list, optional
+        Tables of company revenue aggregates, among 'per_date', 'per_group'
+        and 'reservations', from which the function can build its features
+        instead of the datasets, by default none. When the aggregates of the
+        run have them, they are passed as the keyword argument aggregates
+        and the datasets are not loaded for the stage.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        function,
+        datasets: list = (),
+        inputs: list = (),
+        outputs: list = (),
+        threaded: bool = False,
+        aggregates: list = (),
+    ):
+        self.name = name
+        self.function = function
+        self.datasets = list(datasets)
+        self.inputs = list(inputs)
+        self.text_output = os.path.join(PATH_ANSWERS, name + ".txt")
+        self.outputs = list(outputs) + [self.text_output]
+        self.stamp = os.path.join(PATH_ANSWERS, name + ".json")
+        self.threaded = threaded
+        self.aggregates = list(aggregates)
+
+    def __repr__(self):
+        return "Stage({!r})".format(self.name)
+
+    def is_training(self):
+        """Returns True if the stage trains a model."""
+        return self.name.startswith("train_")
+
+    def uses_aggregates(self, aggregates):
+        """Returns True if the stage reads the given aggregates, which have
+        all the tables it needs, instead of the datasets."""
+        return (
+            aggregates is not None
+            and bool(self.aggregates)
+            and all(hasattr(aggregates, table) for table in self.aggregates)
+        )
+
+    def parameters(self, append: bool = False, n_shards: int = None, n_workers=1):
+        """Returns the parameters of a run that change the outputs of the
+        stage, which are the source of its company revenue features.
+
+        Parameters
+        ----------
+        append : bool, optional
+            Whether the run appends to the persisted aggregates, by default
+            False.
+        n_shards : int, optional
+            Number of shards of the sharded aggregates of the run, by
+            default None.
+        n_workers : int, optional
+            Number of worker processes of the run, by default 1.
+
+        Returns
+        -------
+        dict
+            Returns the JSON serializable parameters, empty when the stage
+            builds its features from the datasets.
+        """
+        if (
+            append
+            and self.aggregates
+            and set(self.aggregates) <= set(AGGREGATES_TABLES)
+        ):
+            return {"aggregates": "append"}
+        if n_shards and self.aggregates:
+            return {"aggregates": "sharded", "shards": n_shards, "workers": n_workers}
+        return {}
+
+    def is_up_to_date(self, parameters: dict = None):
+        """Returns True if all the outputs exist and are newer than all the
+        inputs, as in make, and were produced by a run with the same
+        parameters.
+
+        Parameters
+        ----------
+        parameters : dict, optional
+            Parameters of the run, as returned by `parameters`, by default
+            none.
+        """
+        parameters = parameters or {}
+        inputs = list(self.inputs)
+        if parameters.get("aggregates") == "append":
+            inputs += AGGREGATES_FILES
+
+        if not all(map(os.path.exists, self.outputs + inputs + [self.stamp])):
+            return False
+
+        with open(self.stamp, "r", encoding="utf-8") as f:
+            if json.load(f) != parameters:
+                return False
+
+        if not inputs:
+            return True
+
+        oldest_output = min(os.path.getmtime(path) for path in self.outputs)
+        newest_input = max(os.path.getmtime(path) for path in inputs)
+
+        return oldest_output >= newest_input
+
+
+def train_stage(name: str):
+    """Returns the function training one of the models of TRAINING_JOBS."""
+
+    def train(*datasets, **kwargs):
+        from src.models.train_model import run_training_job
+
+        return run_training_job(name, *datasets, **kwargs)
+
+    return train
+
+
+def answer_q1():
+    """Prints the answer to question 1."""
+    from src.reports.reports import answer_first_question, header_q1
+
+    header_q1()
+    answer_first_question()
+
+
+def answer_q2():
+    """Prints the answer to question 2."""
+    from src.reports.reports import answer_second_question, header_q2
+
+    header_q2()
+    answer_second_question(plot=False)
+
+
+def answer_q3():
+    """Prints the answer to question 3."""
+    from src.reports.reports import answer_third_question, header_q3
+
+    header_q3()
+    answer_third_question(plot=False)
+
+
+def answer_q4(df_daily_revenue):
+    """Prints the answer to question 4."""
+    from src.reports.reports import answer_fourth_question, header_q4
+
+    header_q4()
+    answer_fourth_question(df_daily_revenue)
+
+
+def answer_covid(df_listings, df_daily_revenue, aggregates=None):
+    """Prints the estimated revenue loss due to covid-19."""
+    from src.reports.reports import (
+        answer_covid_impact_on_revenue,
+        header_covid_impact_on_revenue,
+    )
+
+    header_covid_impact_on_revenue()
+    answer_covid_impact_on_revenue(
+        df_listings, df_daily_revenue, plot=False, aggregates=aggregates
+    )
+
+
+def answer_extra(df_daily_revenue):
+    """Prints the complementary data analysis."""
+    from src.reports.reports import answer_complementary_data_analysis
+
+    answer_complementary_data_analysis(df_daily_revenue, plot=False)
+
+
+def plot_stage(name: str):
+    """Returns the function running one of the plots of visualize.py."""
+
+    def plot(*datasets):
+        from src.visualization import visualize
+
+        getattr(visualize, name)(*datasets)
+
+    return plot
+
+
+def _training(name, datasets, path_preprocessor, path_regressor, aggregates=()):
+    return Stage(
+        "train_" + name,
+        train_stage(name),
+        datasets,
+        DATA_FILES + SOURCES_TRAINING,
+        [path_preprocessor, path_regressor],
+        threaded=True,
+        aggregates=aggregates,
+    )
+
+
+def _plot(name, datasets, inputs, output):
+    return Stage(
+        name,
+        plot_stage(name),
+        datasets,
+        DATA_FILES + SOURCES_PLOTS + inputs,
+        [output],
+    )
+
+
+MODELS_Q1 = [
+    PATH_PREPROCESSOR_PRICE_MODEL_Q1,
+    PATH_REGRESSOR_PRICE_MODEL_Q1,
+    PATH_PREPROCESSOR_REVENUE_MODEL_Q1,
+    PATH_REGRESSOR_REVENUE_MODEL_Q1,
+]
+
+MODEL_Q2 = [PATH_PREPROCESSOR_REVENUE_MODEL_Q2, PATH_REGRESSOR_REVENUE_MODEL_Q2]
+
+MODEL_Q3 = [
+    PATH_PREPROCESSOR_RESERVATIONS_MODEL_Q3,
+    PATH_REGRESSOR_RESERVATIONS_MODEL_Q3,
+]
+
+MODEL_COVID = [PATH_PREPROCESSOR_COVID_IMPACT, PATH_REGRESSOR_COVID_IMPACT]
+
+BOTH = ["listings", "daily_revenue"]
+
+# Stages in the order they run serially, which is a topological order.
+STAGES = [
+    _training("price_model_q1", BOTH, *MODELS_Q1[:2]),
+    _training("revenue_model_q1", BOTH, *MODELS_Q1[2:], ["per_group"]),
+    Stage("answer_q1", answer_q1, [], SOURCES_REPORTS + MODELS_Q1),
+    _training("revenue_model_q2", BOTH, *MODEL_Q2, ["per_date"]),
+    Stage("answer_q2", answer_q2, [], SOURCES_REPORTS + MODEL_Q2),
+    _plot("plot_real_pred_data", BOTH, MODEL_Q2, PATH_REVENUE_COMPARISON),
+    _plot("plot_seasonal_decomposed_q2", BOTH, [], PATH_SEASONAL_DECOMPOSE_REVENUE),
+    _training("reservations_model_q3", ["daily_revenue"], *MODEL_Q3, ["reservations"]),
+    Stage("answer_q3", answer_q3, [], SOURCES_REPORTS + MODEL_Q3),
+    _plot(
+        "plot_seasonal_decomposed_q3",
+        ["daily_revenue"],
+        [],
+        PATH_SEASONAL_DECOMPOSE_RESERVATIONS,
+    ),
+    Stage("answer_q4", answer_q4, ["daily_revenue"], DATA_FILES + SOURCES_REPORTS),
+    _training("covid_impact_model", BOTH, *MODEL_COVID, ["per_date"]),
+    Stage(
+        "answer_covid",
+        answer_covid,
+        BOTH,
+        DATA_FILES + SOURCES_REPORTS + MODEL_COVID,
+        aggregates=["per_date"],
+    ),
+    _plot("plot_revenue_loss_due_to_covid", BOTH, MODEL_COVID, PATH_COVID_IMPACT_GRAPH),
+    Stage(
+        "answer_extra", answer_extra, ["daily_revenue"], DATA_FILES + SOURCES_REPORTS
+    ),
+    _plot("plot_revenue_per_date", ["daily_revenue"], [], PATH_PLOT_REVENUE_PER_DATE),
+    _plot(
+        "plot_hist_reservation_advance",
+        ["daily_revenue"],
+        [],
+        PATH_HISTOGRAM_BOOKINGS,
+    ),
+]
+
+STAGES_BY_NAME = {stage.name: stage for stage in STAGES}
+
+
+def stage_dependencies(stages: list = STAGES):
+    """Maps each stage to the stages producing its inputs.
+
+    Parameters
+    ----------
+    stages : list, optional
+        Stages of the pipeline, by default STAGES.
+
+    Returns
+    -------
+    dict
+        Returns the names of the upstream stages of each stage name.
+    """
+    producers = {path: stage.name for stage in stages for path in stage.outputs}
+
+    return {
+        stage.name: sorted(
+            {producers[path] for path in stage.inputs if path in producers}
+        )
+        for stage in stages
+    }
+
+
+def plan_pipeline(
+    targets: list,
+    train: bool = True,
+    force: bool = False,
+    append: bool = False,
+    n_shards: int = None,
+    n_workers: int = 1,
+):
+    """Selects the stages needed by the targets and the ones to be run.
+
+    A stage is run when it is forced, when any of its inputs or outputs is
+    missing, when an output is older than an input, when its outputs were
+    produced with other parameters (see `Stage.parameters`) or when an
+    upstream stage is run.
+
+    Parameters
+    ----------
+    targets : list
+        Names of the stages whose outputs are wanted.
+    train : bool, optional
+        Whether the training stages may run, by default True. Otherwise
+        the models stored on disk are used as they are.
+    force : bool, optional
+        Whether to run every selected stage, by default False.
+    append : bool, optional
+        Whether the run appends to the persisted aggregates, by default
+        False.
+    n_shards : int, optional
+        Number of shards of the sharded aggregates of the run, by default
+        None.
+    n_workers : int, optional
+        Number of worker processes of the run, by default 1.
+
+    Returns
+    -------
+    tuple
+        Returns the selected stages, in order, the set of the names of the
+        stages to be run, the dependencies of each stage and the parameters
+        of each stage.
+    """
+    dependencies = stage_dependencies()
+
+    selected = set()
+    pending = list(targets)
+    while pending:
+        name = pending.pop()
+        if name in selected or (not train and STAGES_BY_NAME[name].is_training()):
+            continue
+        selected.add(name)
+        pending.extend(dependencies[name])
+
+    stages = [stage for stage in STAGES if stage.name in selected]
+    dependencies = {
+        stage.name: [name for name in dependencies[stage.name] if name in selected]
+        for stage in stages
+    }
+
+    parameters = {
+        stage.name: stage.parameters(append, n_shards, n_workers) for stage in stages
+    }
+
+    stale = set()
+    for stage in stages:
+        if (
+            force
+            or any(name in stale for name in dependencies[stage.name])
+            or not stage.is_up_to_date(parameters[stage.name])
+        ):
+            stale.add(stage.name)
+
+    return stages, stale, dependencies, parameters
+
+
+def run_stage(name: str, n_jobs: int = None, parameters: dict = None):
+    """Runs a stage, capturing and storing the text it prints. Used as the
+    entry point of the pipeline worker processes.
+
+    Parameters
+    ----------
+    name : str
+        Name of the stage.
+    n_jobs : int, optional
+        Number of threads of the stage, by default None (no limit).
+    parameters : dict, optional
+        Parameters of the run, stored in the stamp of the stage, by default
+        none.
+
+    Returns
+    -------
+    tuple
+        Returns the printed text, the wall time in seconds and the value
+        returned by the stage function.
+    """
+    stage = STAGES_BY_NAME[name]
+    datasets = [_DATASETS.get(dataset) for dataset in stage.datasets]
+    kwargs = {"n_jobs": n_jobs} if stage.threaded else {}
+    if stage.uses_aggregates(_DATASETS.get("aggregates")):
+        kwargs["aggregates"] = _DATASETS["aggregates"]
+
+    start = time.perf_counter()
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output), trace_span("stage." + name):
+        result = stage.function(*datasets, **kwargs)
+    wall = time.perf_counter() - start
+
+    os.makedirs(PATH_ANSWERS, exist_ok=True)
+    with open(stage.text_output, "w", encoding="utf-8") as f:
+        f.write(output.getvalue())
+
+    # Outputs left untouched, like models reused from the registry, are
+    # marked as rebuilt so the stage is not stale on the next run.
+    for path in stage.outputs:
+        if os.path.exists(path):
+            os.utime(path)
+
+    with open(stage.stamp, "w", encoding="utf-8") as f:
+        json.dump(parameters or {}, f, sort_keys=True)
+
+    return output.getvalue(), wall, result
+
+
+def _load_datasets():
+    """Loads the datasets into _DATASETS, unless already loaded."""
+    if "daily_revenue" not in _DATASETS:
+        from src.data.make_dataset import load_data
+
+        df_listings, df_daily_revenue = load_data()
+        _DATASETS.update(listings=df_listings, daily_revenue=df_daily_revenue)
+
+
+def _init_worker(datasets: dict):
+    _DATASETS.update(datasets)
+
+
+def run_pipeline(
+    targets: list,
+    train: bool = True,
+    force: bool = False,
+    n_workers: int = 1,
+    n_threads: int = None,
+    append: bool = False,
+    n_shards: int = None,
+):
+    """Runs the stages needed by the targets, skipping the up to date ones.
+
+    Stages whose inputs are ready run concurrently on a pool of worker
+    processes. The datasets are only loaded if a stage that needs them has
+    to run, and are shared with the workers when they start. The text
+    printed by each stage is echoed when it finishes; for the skipped
+    stages the text of their last run is echoed instead.
+
+    Parameters
+    ----------
+    targets : list
+        Names of the stages whose outputs are wanted.
+    train : bool, optional
+        Whether the training stages may run, by default True.
+    force : bool, optional
+        Whether to run every selected stage, by default False.
+    n_workers : int, optional
+        Number of worker processes, by default 1 (the stages run one at a
+        time in the current process).
+    n_threads : int, optional
+        Number of threads of each stage, by default None (the number of
+        cores divided by the number of workers).
+    append : bool, optional
+        Whether to ingest the rows appended to the daily revenue file into
+        the persisted aggregates of `src.data.incremental` first, and build
+        the company revenue features of the stages accepting aggregates
+        from them instead of the datasets, by default False.
+    n_shards : int, optional
+        If given, the company revenue sums and the reservation counts are
+        computed once by `sharded_aggregates` over this number of shards of
+        listings, with n_workers processes, and the stages accepting
+        aggregates build their features from them, by default None.
+
+    The mean absolute error and the regressor path of each model trained
+    are printed at the end and stored by `save_training_results`.
+
+    Returns
+    -------
+    dict
+        Returns the wall time in seconds of each stage that ran.
+    """
+    if append and n_shards:
+        raise ValueError("append and n_shards are mutually exclusive")
+
+    if append:
+        from src.data.incremental import update_daily_aggregates
+
+        _DATASETS["aggregates"], ingested = update_daily_aggregates()
+        for source, rows in ingested.items():
+            print("Ingested {:d} rows of {}".format(rows, source))
+
+    stages, stale, dependencies, parameters = plan_pipeline(
+        targets, train, force, append, n_shards, n_workers
+    )
+
+    for stage in stages:
+        if stage.name not in stale:
+            print("[up to date] " + stage.name)
+            with open(stage.text_output, "r", encoding="utf-8") as f:
+                print(f.read(), end="")
+
+    if not stale:
+        return {}
+
+    if n_shards and any(stage.aggregates for stage in stages if stage.name in stale):
+        from src.features.sharded import sharded_aggregates
+
+        _load_datasets()
+        _DATASETS["aggregates"] = sharded_aggregates(
+            _DATASETS["listings"], _DATASETS["daily_revenue"], n_shards, n_workers
+        )
+
+    needed = {
+        dataset
+        for stage in stages
+        if stage.name in stale
+        and not stage.uses_aggregates(_DATASETS.get("aggregates"))
+        for dataset in stage.datasets
+    }
+    if needed:
+        _load_datasets()
+
+    if n_threads is None and n_workers > 1:
+        n_threads = max(1, (os.cpu_count() or 1) // n_workers)
+
+    done = {stage.name for stage in stages if stage.name not in stale}
+    waiting = [stage.name for stage in stages if stage.name in stale]
+    timings = {}
+    training_results = {}
+
+    def report(name, output, wall, result):
+        print("[{:.1f} s] {}".format(wall, name))
+        print(output, end="")
+        done.add(name)
+        timings[name] = wall
+        if STAGES_BY_NAME[name].is_training():
+            training_results[name[len("train_") :]] = result
+
+    def ready():
+        names = [
+            name
+            for name in waiting
+            if all(dependency in done for dependency in dependencies[name])
+        ]
+        for name in names:
+            waiting.remove(name)
+        return names
+
+    if n_workers <= 1:
+        for name in waiting:
+            report(name, *run_stage(name, n_threads, parameters[name]))
+    else:
+        with ProcessPoolExecutor(
+            max_workers=n_workers, initializer=_init_worker, initargs=(_DATASETS,)
+        ) as executor:
+            running = {}
+            while waiting or running:
+                for name in ready():
+                    future = executor.submit(
+                        run_stage, name, n_threads, parameters[name]
+                    )
+                    running[future] = name
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    report(running.pop(future), *future.result())
+
+    if training_results:
+        from src.models.train_model import save_training_results
+
+        save_training_results(training_results)
+        print("Trained models:")
+        for name, (score, path_regressor) in training_results.items():
+            print("  {}: MAE(teste) = {:.2f} ({})".format(name, score, path_regressor))
+
+    return timings
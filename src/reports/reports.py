@@ -22,22 +22,18 @@ from src.features.build_features import (
     build_date_features,
     return_date_of_quantile_sold_q4,
 )
+from src.features.company_revenue import get_company_revenue_per_date
+from src.features.pickup import PickupCurves
 from src.models.preprocessing import preprocess_transform
 from src.commons import (
     get_date_from_ymd,
     load_pickle,
     to_date,
 )
-from src.visualization.visualize import (
-    plot_hist_reservation_advance,
-    plot_real_pred_data,
-    plot_revenue_loss_due_to_covid,
-    plot_revenue_per_date,
-    plot_seasonal_decomposed_q2,
-    plot_seasonal_decomposed_q3,
-)
+from src.instrumentation import traced
 
 
+@traced
 def print_reservation_advance_quantiles(df_daily_revenue: pd.DataFrame):
     """Prints distinct quantiles for the total booking advance dates distribution.
 
@@ -124,6 +120,7 @@ def header_covid_impact_on_revenue():
     )
 
 
+@traced
 def answer_first_question():
     """Script to obtain the answers to question 1."""
 
@@ -150,15 +147,24 @@ def answer_first_question():
     print("Modeled revenue R$: {:.2f}".format(revenue_model.predict(X_pred).sum()))
 
 
-def answer_second_question(df_listings: pd.DataFrame, df_daily_revenue: pd.DataFrame):
+@traced
+def answer_second_question(
+    df_listings: pd.DataFrame = None,
+    df_daily_revenue: pd.DataFrame = None,
+    plot: bool = True,
+):
     """Script to obtain the answers to question 2.
 
     Parameters
     ----------
-    df_listings : pd.DataFrame
-        Pandas dataframe with information about listings.
-    df_daily_revenue : pd.DataFrame
-        Pandas dataframe with information about daily revenue.
+    df_listings : pd.DataFrame, optional
+        Pandas dataframe with information about listings. Only needed for
+        the plots.
+    df_daily_revenue : pd.DataFrame, optional
+        Pandas dataframe with information about daily revenue. Only needed
+        for the plots.
+    plot : bool, optional
+        Whether to plot the figures of the question, by default True.
     """
 
     data_pred = pd.DataFrame()
@@ -177,17 +183,29 @@ def answer_second_question(df_listings: pd.DataFrame, df_daily_revenue: pd.DataF
 
     print("Expected revenue for 2022 R$: {:.2f}".format(revenue_2022))
 
+    if not plot:
+        return
+
+    from src.visualization.visualize import (
+        plot_real_pred_data,
+        plot_seasonal_decomposed_q2,
+    )
+
     plot_real_pred_data(df_listings, df_daily_revenue)
     plot_seasonal_decomposed_q2(df_listings, df_daily_revenue)
 
 
-def answer_third_question(df_daily_revenue: pd.DataFrame):
+@traced
+def answer_third_question(df_daily_revenue: pd.DataFrame = None, plot: bool = True):
     """Script to obtain the answers to question 3.
 
     Parameters
     ----------
-    df_daily_revenue : pd.DataFrame
-        Pandas dataframe with information about daily revenue.
+    df_daily_revenue : pd.DataFrame, optional
+        Pandas dataframe with information about daily revenue. Only needed
+        for the plot.
+    plot : bool, optional
+        Whether to plot the figure of the question, by default True.
     """
 
     data_pred = pd.DataFrame()
@@ -212,15 +230,23 @@ def answer_third_question(df_daily_revenue: pd.DataFrame):
         "Expected reservations per day for 2022: {:d}".format(mean_reservations_per_day)
     )
 
+    if not plot:
+        return
+
+    from src.visualization.visualize import plot_seasonal_decomposed_q3
+
     plot_seasonal_decomposed_q3(df_daily_revenue)
 
 
+@traced
 def answer_fourth_question(df_daily_revenue):
     """Script to obtain the answers to question 4."""
 
+    curves = PickupCurves(df_daily_revenue, by_day_of_year=True)
+
     for percent in [0.1, 0.5, 0.8]:
         date_of_new_year_reservations = return_date_of_quantile_sold_q4(
-            df_daily_revenue, percent
+            df_daily_revenue, percent, curves
         )
         print(
             "{:d} percent of new year's nights should be sold by: ".format(
@@ -230,7 +256,10 @@ def answer_fourth_question(df_daily_revenue):
         )
 
 
-def answer_covid_impact_on_revenue(df_listings, df_daily_revenue):
+@traced
+def answer_covid_impact_on_revenue(
+    df_listings, df_daily_revenue, plot: bool = True, aggregates=None
+):
     """Script to obtain the answers to covid impact on revenue.
 
     Parameters
@@ -239,23 +268,17 @@ def answer_covid_impact_on_revenue(df_listings, df_daily_revenue):
         Pandas dataframe with information about listings.
     df_daily_revenue : pd.DataFrame
         Pandas dataframe with information about daily revenue.
+    plot : bool, optional
+        Whether to plot the figure of the analysis, by default True.
+    aggregates : DailyAggregates or ShardedAggregates, optional
+        Company revenue sums read instead of the datasets, by default None.
+        The plot still needs the datasets.
     """
 
-    data = pd.merge(
-        df_daily_revenue,
-        df_listings[["Código", "Comissão"]],
-        left_on="listing",
-        right_on="Código",
-        how="left",
-    )
-
-    data["company_revenue"] = data["Comissão"] * data["revenue"]
-
-    data = (
-        data.groupby("date")
-        .agg(company_revenue=("company_revenue", "sum"))
-        .reset_index()
-    )
+    if aggregates is not None:
+        data = aggregates.per_date.copy()
+    else:
+        data = get_company_revenue_per_date(df_listings, df_daily_revenue)
 
     data_pred = pd.DataFrame()
     data_pred["date"] = pd.date_range(
@@ -282,18 +305,35 @@ def answer_covid_impact_on_revenue(df_listings, df_daily_revenue):
         )
     )
 
+    if not plot:
+        return
+
+    from src.visualization.visualize import plot_revenue_loss_due_to_covid
+
     plot_revenue_loss_due_to_covid(df_listings, df_daily_revenue)
 
 
-def answer_complementary_data_analysis(df_daily_revenue):
+@traced
+def answer_complementary_data_analysis(df_daily_revenue, plot: bool = True):
     """Complementary data analysis of the dataset provided.
 
     Parameters
      ----------
      df_daily_revenue : pd.DataFrame
          Pandas dataframe with information about daily revenue.
+     plot : bool, optional
+         Whether to plot the figures of the analysis, by default True.
     """
 
     print_reservation_advance_quantiles(df_daily_revenue)
+
+    if not plot:
+        return
+
+    from src.visualization.visualize import (
+        plot_hist_reservation_advance,
+        plot_revenue_per_date,
+    )
+
     plot_revenue_per_date(df_daily_revenue)
     plot_hist_reservation_advance(df_daily_revenue)
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+
+# Dependencies:
+
+import numpy as np
+from src import PLOT_MAX_POINTS
+
+
+def count_day_offsets(chunks):
+    """Counts the integer day values of a stream of chunks, such as the
+    reservation advance days, with np.bincount. Missing and fractional
+    values are dropped, as np.histogram would drop the missing ones.
+
+    Parameters
+    ----------
+    chunks : Iterable
+        Arrays or series of day values, read one at a time, so the counts of
+        a column too large for memory can be accumulated chunk by chunk.
+
+    Returns
+    -------
+    tuple
+        Returns the first day counted and the number of occurrences of each
+        day from it, as an int64 array (empty if there is no value).
+    """
+    first, counts = 0, np.zeros(0, dtype=np.int64)
+
+    for chunk in chunks:
+        values = np.asarray(chunk, dtype=np.float64)
+        values = values[np.isfinite(values)]
+        values = values[values == np.floor(values)].astype(np.int64)
+        if not len(values):
+            continue
+
+        low = values.min()
+        if not len(counts):
+            first = low
+        elif low < first:
+            counts = np.concatenate([np.zeros(first - low, dtype=np.int64), counts])
+            first = low
+
+        chunk_counts = np.bincount(values - first)
+        if len(chunk_counts) > len(counts):
+            counts = np.concatenate(
+                [counts, np.zeros(len(chunk_counts) - len(counts), dtype=np.int64)]
+            )
+        counts[: len(chunk_counts)] += chunk_counts
+
+    return first, counts
+
+
+def histogram_from_day_counts(first: int, counts: np.ndarray, bins: int = 100):
+    """Groups the counts of consecutive days into equal width bins between
+    the smallest and the largest day counted, giving the same counts and
+    edges as np.histogram over the days themselves.
+
+    Parameters
+    ----------
+    first : int
+        First day counted.
+    counts : np.ndarray
+        Number of occurrences of each day from the first one.
+    bins : int, optional
+        Number of bins, by default 100.
+
+    Returns
+    -------
+    tuple
+        Returns the count of each bin and the bin edges.
+    """
+    days = first + np.flatnonzero(counts)
+    if not len(days):
+        return np.histogram([], bins=bins)
+
+    counts = counts[days - first]
+    edges = np.histogram_bin_edges(days, bins=bins)
+
+    # Each day falls in the last edge on its left, and the last edge closes
+    # the last bin, as in np.histogram.
+    positions = np.searchsorted(edges, days, side="right") - 1
+    positions = np.minimum(positions, bins - 1)
+
+    return (
+        np.bincount(positions, weights=counts, minlength=bins).astype(np.int64),
+        edges,
+    )
+
+
+def day_histogram(values, bins: int = 100, chunksize: int = 10_000_000):
+    """Computes the histogram of integer day values in chunks, without
+    sorting or copying the whole column at once.
+
+    Parameters
+    ----------
+    values : array-like
+        Day values, missing values being ignored.
+    bins : int, optional
+        Number of bins, by default 100.
+    chunksize : int, optional
+        Number of values counted at a time, by default 10_000_000.
+
+    Returns
+    -------
+    tuple
+        Returns the count of each bin and the bin edges.
+    """
+    values = np.asarray(values)
+    chunks = (
+        values[start : start + chunksize] for start in range(0, len(values), chunksize)
+    )
+
+    return histogram_from_day_counts(*count_day_offsets(chunks), bins=bins)
+
+
+def minmax_indices(y: np.ndarray, n_points: int = PLOT_MAX_POINTS):
+    """Selects the points of a line keeping the first, the last, the
+    minimum and the maximum of each of n_points / 2 consecutive buckets, so
+    every vertical extent drawn at that horizontal resolution is preserved.
+
+    Parameters
+    ----------
+    y : np.ndarray
+        Values of the line.
+    n_points : int, optional
+        Maximum number of points kept, by default PLOT_MAX_POINTS.
+
+    Returns
+    -------
+    np.ndarray
+        Returns the sorted indices of the kept points.
+    """
+    n = len(y)
+    if n <= n_points:
+        return np.arange(n)
+
+    y = np.asarray(y, dtype=np.float64)
+    n_buckets = max((n_points - 2) // 2, 1)
+    bounds = np.linspace(1, n - 1, n_buckets + 1).astype(np.int64)
+    starts, sizes = bounds[:-1], np.diff(bounds)
+
+    # Pads the buckets to the same width, so the argmin and argmax of all of
+    # them are taken at once.
+    width = sizes.max()
+    positions = starts[:, None] + np.arange(width)[None, :]
+    valid = np.arange(width)[None, :] < sizes[:, None]
+    positions = np.where(valid, positions, starts[:, None])
+    values = y[positions]
+
+    lows = np.where(valid & ~np.isnan(values), values, np.inf).argmin(axis=1)
+    highs = np.where(valid & ~np.isnan(values), values, -np.inf).argmax(axis=1)
+    rows = np.arange(n_buckets)
+
+    return np.unique(
+        np.concatenate([[0, n - 1], positions[rows, lows], positions[rows, highs]])
+    )
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_points: int = PLOT_MAX_POINTS):
+    """Selects the points of a line with the Largest-Triangle-Three-Buckets
+    algorithm, which keeps in each bucket the point forming the largest
+    triangle with the point kept before and the mean of the next bucket.
+
+    Parameters
+    ----------
+    x : np.ndarray
+        Horizontal coordinates of the line, numeric or datetime64, sorted.
+    y : np.ndarray
+        Values of the line.
+    n_points : int, optional
+        Number of points kept, by default PLOT_MAX_POINTS.
+
+    Returns
+    -------
+    np.ndarray
+        Returns the sorted indices of the kept points.
+    """
+    n = len(y)
+    if n <= n_points or n_points < 3:
+        return np.arange(n)
+
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64):
+        x = x.astype("datetime64[ns]").astype(np.int64)
+    x = x.astype(np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    bounds = np.linspace(1, n - 1, n_points - 1).astype(np.int64)
+    indices = np.empty(n_points, dtype=np.int64)
+    indices[0], indices[-1] = 0, n - 1
+
+    for bucket in range(n_points - 2):
+        start, end = bounds[bucket], bounds[bucket + 1]
+        if bucket + 2 < len(bounds):
+            next_x = x[end : bounds[bucket + 2]].mean()
+            next_y = y[end : bounds[bucket + 2]].mean()
+        else:
+            next_x, next_y = x[n - 1], y[n - 1]
+
+        previous = indices[bucket]
+        areas = np.abs(
+            (x[previous] - next_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (next_y - y[previous])
+        )
+        indices[bucket + 1] = start + np.nanargmax(areas) if end > start else start
+
+    return np.unique(indices)
+
+
+def downsample_line(
+    x: np.ndarray,
+    y: np.ndarray,
+    n_points: int = PLOT_MAX_POINTS,
+    method: str = "minmax",
+):
+    """Reduces a line to at most about n_points points, keeping its shape.
+
+    Parameters
+    ----------
+    x : np.ndarray
+        Horizontal coordinates of the line, sorted.
+    y : np.ndarray
+        Values of the line.
+    n_points : int, optional
+        Target number of points, by default PLOT_MAX_POINTS, two per pixel
+        column of the figures.
+    method : str, optional
+        "minmax", which keeps every peak and trough, or "lttb", by default
+        "minmax".
+
+    Returns
+    -------
+    tuple
+        Returns the kept x and y values.
+    """
+    if method == "minmax":
+        indices = minmax_indices(y, n_points)
+    elif method == "lttb":
+        indices = lttb_indices(x, y, n_points)
+    else:
+        raise ValueError("Unknown downsampling method: " + str(method))
+
+    return np.asarray(x)[indices], np.asarray(y)[indices]
@@ -2,10 +2,14 @@
 
 # Dependencies:
 
+import argparse
+import numpy as np
 import pandas as pd
 import seaborn as sns
-import matplotlib.pyplot as plt
-from statsmodels.tsa.seasonal import seasonal_decompose
+import matplotlib
+from concurrent.futures import ProcessPoolExecutor
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 from src import (
     PATH_COVID_IMPACT_GRAPH,
     PATH_HISTOGRAM_BOOKINGS,
@@ -17,62 +21,253 @@ from src import (
     PATH_REVENUE_COMPARISON,
     PATH_SEASONAL_DECOMPOSE_RESERVATIONS,
     PATH_SEASONAL_DECOMPOSE_REVENUE,
+    PLOT_HISTOGRAM_BINS,
 )
 from src.commons import get_date_from_ymd, load_pickle
+from src.instrumentation import traced
 from src.features.build_features import (
     build_date_features,
     build_features_revenue_model_q2,
 )
+from src.features.company_revenue import get_company_revenue_per_date
+from src.features.decomposition import COMPONENTS, decompose_series
+from src.features.reservations import count_reservations_per_creation_date
 from src.models.preprocessing import preprocess_transform
+from src.visualization.reduction import day_histogram, downsample_line
 
+# Each figure is rendered from a job (draw function, data, path, figure size)
+# holding only the aggregated arrays drawn, so it can be sent to a worker.
+SIZE_DECOMPOSITION = (10, 10)
 
-def plot_revenue_per_date(df_daily_revenue: pd.DataFrame):
-    """Plots a graph of revenue per date.
+
+def plot_style():
+    """Returns the name of the seaborn matplotlib style, which was renamed
+    in matplotlib 3.6."""
+    if "seaborn" in matplotlib.style.available:
+        return "seaborn"
+    return "seaborn-v0_8"
+
+
+def render_figure(job: tuple):
+    """Renders a figure job to a PNG file with the Agg backend.
+
+    The figure is an explicit Figure object drawn under the default
+    settings plus the seaborn style, inside a temporary rc context, so it
+    neither depends on nor changes the global matplotlib state, and the
+    same job always gives the same bytes, in any process.
+
+    Parameters
+    ----------
+    job : tuple
+        The draw function, which receives the figure and the data as
+        keyword arguments, the data dict, the path of the PNG file and the
+        figure size in inches (None for the style default).
+
+    Returns
+    -------
+    str
+        Returns the path of the PNG file.
+    """
+    draw, data, path, figsize = job
+
+    with matplotlib.rc_context():
+        matplotlib.rcdefaults()
+        matplotlib.style.use(plot_style())
+
+        figure = Figure(figsize=figsize)
+        FigureCanvasAgg(figure)
+        draw(figure, **data)
+        figure.tight_layout()
+        figure.savefig(path)
+
+    return path
+
+
+def render_figures(jobs: list, n_workers: int = 1):
+    """Renders figure jobs, in a pool of worker processes if n_workers is
+    greater than 1.
+
+    Parameters
+    ----------
+    jobs : list
+        Figure jobs, see `render_figure`.
+    n_workers : int, optional
+        Number of worker processes, by default 1.
+
+    Returns
+    -------
+    list
+        Returns the paths of the PNG files.
+    """
+    if n_workers <= 1:
+        return [render_figure(job) for job in jobs]
+
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        return list(executor.map(render_figure, jobs))
+
+
+def draw_revenue_per_date(figure: Figure, dates: np.ndarray, revenue: np.ndarray):
+    """Draws the mean daily revenue per date."""
+    ax = figure.subplots()
+    sns.lineplot(x=dates, y=revenue, ax=ax)
+    ax.tick_params(axis="x", labelrotation=45)
+    ax.set_xlabel("Date")
+    ax.set_ylabel("Mean Daily Revenue (R$)")
+
+
+def draw_histogram(
+    figure: Figure,
+    counts: np.ndarray,
+    edges: np.ndarray,
+    xlabel: str,
+    ylabel: str,
+):
+    """Draws a histogram from its precomputed counts and bin edges."""
+    ax = figure.subplots()
+    ax.hist(edges[:-1], bins=edges, weights=counts)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+
+
+def draw_real_pred(
+    figure: Figure,
+    dates: np.ndarray,
+    real: np.ndarray,
+    predicted: np.ndarray,
+    real_dates: np.ndarray = None,
+    predicted_dates: np.ndarray = None,
+    real_label: str = "Real revenue",
+    predicted_label: str = "Predicted revenue",
+    ylabel: str = "Revenue (R$)",
+    rotate: bool = True,
+):
+    """Draws a real and a predicted series on the same axes."""
+    ax = figure.subplots()
+    ax.plot(
+        dates if real_dates is None else real_dates, real, label=real_label, alpha=0.8
+    )
+    ax.plot(
+        dates if predicted_dates is None else predicted_dates,
+        predicted,
+        label=predicted_label,
+        color="orange",
+        alpha=0.8,
+    )
+    if rotate:
+        ax.tick_params(axis="x", labelrotation=45)
+    ax.set_xlabel("Date")
+    ax.set_ylabel(ylabel)
+    ax.legend()
+
+
+def draw_seasonal_decomposition(
+    figure: Figure,
+    index: np.ndarray,
+    observed: np.ndarray,
+    trend: np.ndarray,
+    seasonal: np.ndarray,
+    resid: np.ndarray,
+    name: str,
+):
+    """Draws the components of a seasonal decomposition as the plot method
+    of statsmodels does."""
+    axes = figure.subplots(4, 1, sharex=True)
+    xlim = (index[0], index[-1])
+
+    for ax, values, label in zip(
+        axes,
+        [observed, trend, seasonal, resid],
+        [name, "Trend", "Seasonal", "Resid"],
+    ):
+        if label == "Resid":
+            ax.plot(index, values, marker="o", linestyle="none")
+            ax.plot(xlim, (0, 0), color="#000000", zorder=-3)
+        else:
+            ax.plot(index, values)
+        (ax.set_title if ax is axes[0] else ax.set_ylabel)(label)
+        ax.set_xlim(xlim)
+
+    axes[-1].set_xlabel("Days")
+
+
+def decomposition_job(series: pd.Series, path: str):
+    """Decomposes a daily series with a yearly period and returns the
+    figure job drawing its components.
+
+    Parameters
+    ----------
+    series : pd.Series
+        Series indexed by date to be decomposed.
+    path : str
+        Path of the PNG file.
+
+    Returns
+    -------
+    tuple
+        Returns the figure job.
+    """
+    components = decompose_series(series)
+
+    data = {name: components[name].to_numpy() for name in COMPONENTS}
+    data["index"] = np.arange(len(components))
+    data["name"] = str(series.name)
+
+    return draw_seasonal_decomposition, data, path, SIZE_DECOMPOSITION
+
+
+def figure_revenue_per_date(df_daily_revenue: pd.DataFrame):
+    """Returns the figure job of the revenue per date.
 
     Parameters
     ----------
     df_daily_revenue : pd.DataFrame
         Pandas dataframe with information about daily revenue.
+
+    Returns
+    -------
+    tuple
+        Returns the figure job.
     """
     temp = df_daily_revenue.groupby("date")[["revenue"]].mean().reset_index()
 
-    plt.style.use("seaborn")
-    sns.lineplot(data=temp, x="date", y="revenue")
-    plt.xticks(rotation=45)
-    plt.xlabel("Date")
-    plt.ylabel("Mean Daily Revenue (R$)")
-    plt.tight_layout()
-    plt.savefig(PATH_PLOT_REVENUE_PER_DATE)
-    plt.close()
+    dates, revenue = downsample_line(
+        temp["date"].to_numpy(), temp["revenue"].to_numpy()
+    )
 
-    print("Exporting graph revenue_per_date to path: " + PATH_PLOT_REVENUE_PER_DATE)
+    data = {"dates": dates, "revenue": revenue}
 
+    return draw_revenue_per_date, data, PATH_PLOT_REVENUE_PER_DATE, None
 
-def plot_hist_reservation_advance(df_daily_revenue: pd.DataFrame):
-    """Plots a histogram with the distribution of booking advance days.
+
+def figure_hist_reservation_advance(df_daily_revenue: pd.DataFrame):
+    """Returns the figure job of the histogram of booking advance days.
 
     Parameters
     ----------
     df_daily_revenue : pd.DataFrame
         Pandas dataframe with information about daily revenue.
+
+    Returns
+    -------
+    tuple
+        Returns the figure job.
     """
+    counts, edges = day_histogram(
+        df_daily_revenue["reservation_advance_days"], bins=PLOT_HISTOGRAM_BINS
+    )
 
-    plt.style.use("seaborn")
-    plt.hist(df_daily_revenue["reservation_advance_days"].dropna(), bins=100)
-    plt.xlabel("Reservation advance (days)")
-    plt.ylabel("Number of reservations")
-    plt.tight_layout()
-    plt.savefig(PATH_HISTOGRAM_BOOKINGS)
-    plt.close()
+    data = {
+        "counts": counts,
+        "edges": edges,
+        "xlabel": "Reservation advance (days)",
+        "ylabel": "Number of reservations",
+    }
 
-    print(
-        "Exporting graph histogram_reservation_advance to path: "
-        + PATH_HISTOGRAM_BOOKINGS
-    )
+    return draw_histogram, data, PATH_HISTOGRAM_BOOKINGS, None
 
 
-def plot_real_pred_data(df_listings: pd.DataFrame, df_daily_revenue: pd.DataFrame):
-    """Plots a graph comparing the real and the predicted revenue.
+def figure_real_pred_data(df_listings: pd.DataFrame, df_daily_revenue: pd.DataFrame):
+    """Returns the figure job comparing the real and the predicted revenue.
 
     Parameters
     ----------
@@ -80,19 +275,19 @@ def plot_real_pred_data(df_listings: pd.DataFrame, df_daily_revenue: pd.DataFram
         Pandas dataframe with information about listings.
     df_daily_revenue : pd.DataFrame
         Pandas dataframe with information about daily revenue.
+
+    Returns
+    -------
+    tuple
+        Returns the figure job.
     """
 
     X, y = build_features_revenue_model_q2(df_listings, df_daily_revenue)
 
-    X["date"] = X.apply(
-        lambda x: pd.to_datetime(
-            str(int(x["year"])) + "-" + str(int(x["month"])) + "-" + str(int(x["day"]))
-        ),
-        axis=1,
-    )
+    dates = get_date_from_ymd(X)
 
     data_pred = pd.DataFrame()
-    data_pred["date"] = pd.date_range(start=X["date"].min(), end=X["date"].max())
+    data_pred["date"] = pd.date_range(start=dates.min(), end=dates.max())
 
     data_pred = build_date_features(data_pred, "date")
 
@@ -103,27 +298,73 @@ def plot_real_pred_data(df_listings: pd.DataFrame, df_daily_revenue: pd.DataFram
 
     y_pred = model.predict(X_pred)
 
-    plt.style.use("seaborn")
-    plt.plot(X["date"], y, label="Real revenue", alpha=0.8)
-    plt.plot(X["date"], y_pred, label="Predicted revenue", color="orange", alpha=0.8)
-    plt.xticks(rotation=45)
-    plt.xlabel("Date")
-    plt.ylabel("Revenue (R$)")
-    plt.legend()
-    plt.tight_layout()
-    plt.savefig(PATH_REVENUE_COMPARISON)
-    plt.close()
+    real_dates, real = downsample_line(dates.to_numpy(), y.to_numpy())
+    predicted_dates, predicted = downsample_line(dates.to_numpy(), np.asarray(y_pred))
 
-    print(
-        "Exporting graph real_versus_predicted_revenue to path: "
-        + PATH_REVENUE_COMPARISON
+    data = {
+        "dates": real_dates,
+        "real": real,
+        "predicted": predicted,
+        "predicted_dates": predicted_dates,
+    }
+
+    return draw_real_pred, data, PATH_REVENUE_COMPARISON, None
+
+
+def figure_seasonal_decomposed_q2(
+    df_listings: pd.DataFrame, df_daily_revenue: pd.DataFrame
+):
+    """Returns the figure job of the seasonal decomposition for question 2.
+
+    Parameters
+    ----------
+    df_listings : pd.DataFrame
+        Pandas dataframe with information about listings.
+    df_daily_revenue : pd.DataFrame
+        Pandas dataframe with information about daily revenue.
+
+    Returns
+    -------
+    tuple
+        Returns the figure job.
+    """
+
+    data = get_company_revenue_per_date(df_listings, df_daily_revenue)
+
+    data = data.loc[data["company_revenue"].notna()]
+
+    return decomposition_job(
+        data.set_index("date")["company_revenue"], PATH_SEASONAL_DECOMPOSE_REVENUE
     )
 
 
-def plot_seasonal_decomposed_q2(
+def figure_seasonal_decomposed_q3(df_daily_revenue: pd.DataFrame):
+    """Returns the figure job of the seasonal decomposition for question 3.
+
+    Parameters
+    ----------
+    df_daily_revenue : pd.DataFrame
+        Pandas dataframe with information aboutt daily revenue.
+
+    Returns
+    -------
+    tuple
+        Returns the figure job.
+    """
+
+    data_q3 = count_reservations_per_creation_date(df_daily_revenue)
+
+    return decomposition_job(
+        data_q3.set_index("creation_date")["qt_reservations"],
+        PATH_SEASONAL_DECOMPOSE_RESERVATIONS,
+    )
+
+
+def figure_revenue_loss_due_to_covid(
     df_listings: pd.DataFrame, df_daily_revenue: pd.DataFrame
 ):
-    """Plots the graphs of seasonal decomposition for question 2.
+    """Returns the figure job comparing the revenue expected and the real
+    revenue, to compare the loss due to covid-19 pandemic.
 
     Parameters
     ----------
@@ -131,50 +372,112 @@ def plot_seasonal_decomposed_q2(
         Pandas dataframe with information about listings.
     df_daily_revenue : pd.DataFrame
         Pandas dataframe with information about daily revenue.
+
+    Returns
+    -------
+    tuple
+        Returns the figure job.
     """
 
-    data = pd.merge(
-        df_daily_revenue,
-        df_listings[["Código", "Comissão"]],
-        left_on="listing",
-        right_on="Código",
-        how="left",
+    data = get_company_revenue_per_date(df_listings, df_daily_revenue)
+
+    data_pred = pd.DataFrame()
+    data_pred["date"] = pd.date_range(
+        start=data["date"].min(), end=data["date"].max()
+    ).to_list()
+
+    data_pred = build_date_features(data_pred, "date")
+
+    preprocessor = load_pickle(PATH_PREPROCESSOR_COVID_IMPACT)
+    model = load_pickle(PATH_REGRESSOR_COVID_IMPACT)
+
+    X_pred = preprocess_transform(data_pred, preprocessor)
+
+    dates, predicted = downsample_line(
+        get_date_from_ymd(data_pred).to_numpy(), np.asarray(model.predict(X_pred))
+    )
+    real_dates, real = downsample_line(
+        data["date"].to_numpy(), data["company_revenue"].to_numpy()
     )
 
-    data["company_revenue"] = data["Comissão"] * data["revenue"]
+    data = {
+        "dates": dates,
+        "predicted": predicted,
+        "real_dates": real_dates,
+        "real": real,
+        "real_label": "Real Company Revenue",
+        "predicted_label": "Predicted Company Revenue",
+        "ylabel": "Company Revenue (R$)",
+        "rotate": False,
+    }
+
+    return draw_real_pred, data, PATH_COVID_IMPACT_GRAPH, SIZE_DECOMPOSITION
+
+
+@traced
+def plot_revenue_per_date(df_daily_revenue: pd.DataFrame):
+    """Plots a graph of revenue per date.
+
+    Parameters
+    ----------
+    df_daily_revenue : pd.DataFrame
+        Pandas dataframe with information about daily revenue.
+    """
+    render_figure(figure_revenue_per_date(df_daily_revenue))
+
+    print("Exporting graph revenue_per_date to path: " + PATH_PLOT_REVENUE_PER_DATE)
+
+
+@traced
+def plot_hist_reservation_advance(df_daily_revenue: pd.DataFrame):
+    """Plots a histogram with the distribution of booking advance days.
+
+    Parameters
+    ----------
+    df_daily_revenue : pd.DataFrame
+        Pandas dataframe with information about daily revenue.
+    """
+    render_figure(figure_hist_reservation_advance(df_daily_revenue))
 
-    data_revenue = (
-        data.groupby("date")
-        .agg(company_revenue=("company_revenue", "sum"))
-        .reset_index()
+    print(
+        "Exporting graph histogram_reservation_advance to path: "
+        + PATH_HISTOGRAM_BOOKINGS
     )
 
-    data_revenue = build_date_features(data_revenue, "date")
-
-    data = data_revenue.loc[data_revenue["company_revenue"].notna()]
-
-    try:
-        tsmodel = seasonal_decompose(
-            data["company_revenue"],
-            model="additive",
-            extrapolate_trend="freq",
-            freq=365,
-        )
-    except Exception as err:
-        tsmodel = seasonal_decompose(
-            data["company_revenue"],
-            model="additive",
-            extrapolate_trend="freq",
-            period=365,
-        )
-
-    plt.style.use("seaborn")
-    plt.rcParams.update({"figure.figsize": (10, 10)})
-    tsmodel.plot()
-    plt.xlabel("Days")
-    plt.tight_layout()
-    plt.savefig(PATH_SEASONAL_DECOMPOSE_REVENUE)
-    plt.close()
+
+@traced
+def plot_real_pred_data(df_listings: pd.DataFrame, df_daily_revenue: pd.DataFrame):
+    """Plots a graph comparing the real and the predicted revenue.
+
+    Parameters
+    ----------
+    df_listings : pd.DataFrame
+        Pandas dataframe with information about listings.
+    df_daily_revenue : pd.DataFrame
+        Pandas dataframe with information about daily revenue.
+    """
+    render_figure(figure_real_pred_data(df_listings, df_daily_revenue))
+
+    print(
+        "Exporting graph real_versus_predicted_revenue to path: "
+        + PATH_REVENUE_COMPARISON
+    )
+
+
+@traced
+def plot_seasonal_decomposed_q2(
+    df_listings: pd.DataFrame, df_daily_revenue: pd.DataFrame
+):
+    """Plots the graphs of seasonal decomposition for question 2.
+
+    Parameters
+    ----------
+    df_listings : pd.DataFrame
+        Pandas dataframe with information about listings.
+    df_daily_revenue : pd.DataFrame
+        Pandas dataframe with information about daily revenue.
+    """
+    render_figure(figure_seasonal_decomposed_q2(df_listings, df_daily_revenue))
 
     print(
         "Exporting graph seasonal_decompose_revenue to path: "
@@ -182,6 +485,7 @@ def plot_seasonal_decomposed_q2(
     )
 
 
+@traced
 def plot_seasonal_decomposed_q3(df_daily_revenue: pd.DataFrame):
     """Plots the graphs of seasonal decomposition for question 3.
 
@@ -190,38 +494,7 @@ def plot_seasonal_decomposed_q3(df_daily_revenue: pd.DataFrame):
     df_daily_revenue : pd.DataFrame
         Pandas dataframe with information aboutt daily revenue.
     """
-
-    df_q3 = df_daily_revenue[
-        (df_daily_revenue["occupancy"] == 1) & (df_daily_revenue["blocked"] == 0)
-    ]
-
-    data_q3 = df_q3.groupby(["creation_date"]).count().iloc[:, 0:1].reset_index()
-    data_q3.columns = ["creation_date", "qt_reservations"]
-
-    data_q3 = build_date_features(data_q3, "creation_date")
-
-    try:
-        tsmodel = seasonal_decompose(
-            data_q3["qt_reservations"],
-            model="additive",
-            extrapolate_trend="freq",
-            freq=365,
-        )
-    except Exception as err:
-        tsmodel = seasonal_decompose(
-            data_q3["qt_reservations"],
-            model="additive",
-            extrapolate_trend="freq",
-            period=365,
-        )
-
-    plt.style.use("seaborn")
-    plt.rcParams.update({"figure.figsize": (10, 10)})
-    tsmodel.plot()
-    plt.xlabel("Days")
-    plt.tight_layout()
-    plt.savefig(PATH_SEASONAL_DECOMPOSE_RESERVATIONS)
-    plt.close()
+    render_figure(figure_seasonal_decomposed_q3(df_daily_revenue))
 
     print(
         "Exporting graph seasonal_decompose_reservations to path: "
@@ -229,6 +502,7 @@ def plot_seasonal_decomposed_q3(df_daily_revenue: pd.DataFrame):
     )
 
 
+@traced
 def plot_revenue_loss_due_to_covid(
     df_listings: pd.DataFrame, df_daily_revenue: pd.DataFrame
 ):
@@ -242,55 +516,62 @@ def plot_revenue_loss_due_to_covid(
     df_daily_revenue : pd.DataFrame
         Pandas dataframe with information about daily revenue.
     """
+    render_figure(figure_revenue_loss_due_to_covid(df_listings, df_daily_revenue))
 
-    data = pd.merge(
-        df_daily_revenue,
-        df_listings[["Código", "Comissão"]],
-        left_on="listing",
-        right_on="Código",
-        how="left",
-    )
+    print("Exporting graph covid_impact_on_revenue to path: " + PATH_COVID_IMPACT_GRAPH)
 
-    data["company_revenue"] = data["Comissão"] * data["revenue"]
 
-    data = (
-        data.groupby("date")
-        .agg(company_revenue=("company_revenue", "sum"))
-        .reset_index()
-    )
+@traced
+def plot_all_figures(
+    df_listings: pd.DataFrame, df_daily_revenue: pd.DataFrame, n_workers: int = 1
+):
+    """Plots the six figures of the report. The data of every figure is
+    aggregated in this process and the figures are rendered in a pool of
+    worker processes, which only receive the aggregated arrays.
 
-    data_pred = pd.DataFrame()
-    data_pred["date"] = pd.date_range(
-        start=data["date"].min(), end=data["date"].max()
-    ).to_list()
+    Parameters
+    ----------
+    df_listings : pd.DataFrame
+        Pandas dataframe with information about listings.
+    df_daily_revenue : pd.DataFrame
+        Pandas dataframe with information about daily revenue.
+    n_workers : int, optional
+        Number of worker processes, by default 1. The PNG files are the
+        same for any number of workers.
+
+    Returns
+    -------
+    list
+        Returns the paths of the PNG files.
+    """
+    jobs = [
+        figure_revenue_per_date(df_daily_revenue),
+        figure_hist_reservation_advance(df_daily_revenue),
+        figure_real_pred_data(df_listings, df_daily_revenue),
+        figure_seasonal_decomposed_q2(df_listings, df_daily_revenue),
+        figure_seasonal_decomposed_q3(df_daily_revenue),
+        figure_revenue_loss_due_to_covid(df_listings, df_daily_revenue),
+    ]
 
-    data_pred = build_date_features(data_pred, "date")
+    paths = render_figures(jobs, n_workers)
 
-    preprocessor = load_pickle(PATH_PREPROCESSOR_COVID_IMPACT)
-    model = load_pickle(PATH_REGRESSOR_COVID_IMPACT)
+    for path in paths:
+        print("Exporting graph to path: " + path)
 
-    X_pred = preprocess_transform(data_pred, preprocessor)
+    return paths
 
-    data_pred["predicted_company_revenue"] = model.predict(X_pred)
-    data_pred["date"] = get_date_from_ymd(data_pred)
 
-    plt.style.use("seaborn")
-    plt.rcParams.update({"figure.figsize": (10, 10)})
-    plt.plot(
-        data["date"], data["company_revenue"], label="Real Company Revenue", alpha=0.8
-    )
-    plt.plot(
-        data_pred["date"],
-        data_pred["predicted_company_revenue"],
-        label="Predicted Company Revenue",
-        color="orange",
-        alpha=0.8,
-    )
-    plt.xlabel("Date")
-    plt.ylabel("Company Revenue (R$)")
-    plt.legend()
-    plt.tight_layout()
-    plt.savefig(PATH_COVID_IMPACT_GRAPH)
-    plt.close()
+def main():
+    """Command line entry point rendering all the figures of the report."""
+    from src.data.make_dataset import load_data
 
-    print("Exporting graph covid_impact_on_revenue to path: " + PATH_COVID_IMPACT_GRAPH)
+    parser = argparse.ArgumentParser(description="Renders the report figures")
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    df_listings, df_daily_revenue = load_data()
+    plot_all_figures(df_listings, df_daily_revenue, args.workers)
+
+
+if __name__ == "__main__":
+    main()
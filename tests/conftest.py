@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import pytest
+from src import PATH_DAILY_REVENUE, PATH_LISTINGS
+from tests.datasets import ROOT, write_daily_revenue
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    """A project directory with the real listings and a small daily revenue
+    file at their usual relative paths, made the working directory."""
+    os.makedirs(tmp_path / os.path.dirname(PATH_LISTINGS))
+    shutil.copy(os.path.join(ROOT, PATH_LISTINGS), tmp_path / PATH_LISTINGS)
+    write_daily_revenue(tmp_path / PATH_DAILY_REVENUE)
+    monkeypatch.chdir(tmp_path)
+
+    return tmp_path
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+import os
+import numpy as np
+import pandas as pd
+from src import PATH_LISTINGS
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def write_daily_revenue(path: str, n_listings: int = 40, n_days: int = 90, seed=0):
+    """Writes a small daily revenue csv file of the first listings of the
+    real listings file, with the columns and formats of the raw export."""
+    rng = np.random.default_rng(seed)
+    codes = pd.read_csv(os.path.join(ROOT, PATH_LISTINGS), usecols=["Código"])
+    codes = codes["Código"].iloc[:n_listings].to_numpy()
+    dates = pd.date_range("2019-08-01", periods=n_days)
+
+    listing = np.repeat(codes, n_days)
+    date = pd.DatetimeIndex(np.tile(dates, n_listings))
+    occupancy = rng.random(len(date)) < 0.6
+    price = np.round(rng.uniform(100, 600, len(date)), 2)
+    lead = rng.integers(0, 120, len(date))
+
+    df = pd.DataFrame(
+        {
+            "listing": listing,
+            "date": date.strftime("%Y-%m-%d"),
+            "occupancy": occupancy.astype(int),
+            "blocked": (~occupancy & (rng.random(len(date)) < 0.1)).astype(int),
+            "revenue": np.where(occupancy, price, 0.0),
+            "last_offered_price": price,
+            "creation_date": np.where(
+                occupancy,
+                (date - pd.to_timedelta(lead, unit="D")).strftime("%Y-%m-%d"),
+                "",
+            ),
+        }
+    )
+    df.to_csv(path, index=False)
+
+    return df
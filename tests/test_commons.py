@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from pandas.testing import assert_frame_equal
+from src.commons import (
+    dump_dataframe_npz,
+    file_digest,
+    hash_files,
+    load_dataframe_npz,
+)
+from src import PATH_LISTINGS
+from src.data import make_dataset
+
+
+def test_npz_round_trip_keeps_values_and_dtypes(tmp_path):
+    df = pd.DataFrame(
+        {
+            "category": pd.Categorical(["b", None, "a", "b"], categories=["b", "a"]),
+            "date": pd.to_datetime(["2020-01-01", None, "2020-01-03", "2020-01-04"]),
+            "int8": pd.array([1, None, 3, -4], dtype="Int8"),
+            "float": [0.1, np.nan, 1e300, -2.5],
+            "float32": np.array([1.5, 2.5, np.nan, 0.0], dtype="float32"),
+            "bool": [True, False, True, False],
+            "text": ["x", None, "zé", ""],
+        }
+    )
+    df.attrs["rejected_categories"] = ["JRM"]
+    path = str(tmp_path / "frame.npz")
+
+    dump_dataframe_npz(df, path)
+
+    loaded = load_dataframe_npz(path)
+    assert_frame_equal(loaded, df, check_exact=True)
+    assert loaded.attrs == {"rejected_categories": ["JRM"]}
+    assert os.listdir(tmp_path) == ["frame.npz"]
+
+
+def test_npz_dump_replaces_the_archive_only_when_complete(tmp_path, monkeypatch):
+    path = str(tmp_path / "frame.npz")
+    dump_dataframe_npz(pd.DataFrame({"a": [1, 2]}), path)
+
+    def interrupted(f, **arrays):
+        f.write(b"partial")
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(np, "savez", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        dump_dataframe_npz(pd.DataFrame({"a": [3]}), path)
+
+    assert_frame_equal(load_dataframe_npz(path), pd.DataFrame({"a": [1, 2]}))
+    assert os.listdir(tmp_path) == ["frame.npz"]
+
+
+def test_file_digest_is_reused_until_the_file_changes(tmp_path, monkeypatch):
+    path, stamps = str(tmp_path / "raw.csv"), str(tmp_path / "stamps.json")
+    with open(path, "w") as f:
+        f.write("a,b\n1,2\n")
+
+    assert file_digest(path, stamps) == hash_files([path])
+
+    monkeypatch.setattr("src.commons.hash_files", None)
+    assert file_digest(path, stamps) == hash_files([path])
+
+    monkeypatch.undo()
+    with open(path, "a") as f:
+        f.write("3,4\n")
+    assert file_digest(path, stamps) == hash_files([path])
+
+
+def test_load_data_from_the_cache_equals_a_fresh_load(project):
+    df_listings, df_daily_revenue = make_dataset.load_data(use_cache=False)
+
+    cached = make_dataset.load_data()
+    reloaded = make_dataset.load_data()
+
+    for frames in [cached, reloaded]:
+        assert_frame_equal(frames[0], df_listings, check_exact=True)
+        assert_frame_equal(frames[1], df_daily_revenue, check_exact=True)
+        assert frames[0].attrs == df_listings.attrs
+
+
+def test_rejected_categories_survive_the_cache(project):
+    listings = pd.read_csv(PATH_LISTINGS)
+    listings.loc[:2, "Categoria"] = ["JRM", "TOPM", "NOPE"]
+    listings.to_csv(PATH_LISTINGS, index=False)
+
+    for use_cache in [False, True, True]:
+        df_listings, _ = make_dataset.load_data(use_cache=use_cache)
+        assert df_listings.attrs["rejected_categories"] == ["JRM", "NOPE"]
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+import pytest
+from src.features.decomposition import COMPONENTS, decompose_series
+
+seasonal_decompose = pytest.importorskip("statsmodels.tsa.seasonal").seasonal_decompose
+
+
+def daily_series(n_days: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    days = np.arange(n_days)
+    values = (
+        50 + 0.1 * days + 10 * np.sin(2 * np.pi * days / 7) + rng.normal(size=n_days)
+    )
+
+    return pd.Series(values, index=pd.date_range("2020-01-01", periods=n_days))
+
+
+@pytest.mark.parametrize("period, n_days", [(7, 14), (7, 100), (12, 61), (365, 800)])
+def test_decomposition_matches_statsmodels(period, n_days):
+    series = daily_series(n_days)
+
+    components = decompose_series(series, period)
+    # extrapolate_trend="freq", deprecated in recent statsmodels.
+    expected = seasonal_decompose(
+        series, model="additive", period=period, extrapolate_trend=period - 1
+    )
+
+    for name in COMPONENTS:
+        np.testing.assert_allclose(
+            components[name].to_numpy(),
+            getattr(expected, name).to_numpy(),
+            rtol=1e-9,
+            atol=1e-9,
+            err_msg=name,
+        )
+
+
+@pytest.mark.parametrize("period, n_days", [(7, 13), (365, 729)])
+def test_short_series_are_rejected_as_in_statsmodels(period, n_days):
+    series = daily_series(n_days)
+
+    with pytest.raises(ValueError) as expected:
+        seasonal_decompose(series, period=period, extrapolate_trend=period - 1)
+    with pytest.raises(ValueError) as error:
+        decompose_series(series, period)
+
+    assert str(error.value) == str(expected.value)
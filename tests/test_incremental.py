@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+import os
+import pandas as pd
+import pytest
+from pandas.testing import assert_frame_equal
+from src import PATH_DAILY_REVENUE, PATH_DATA_AGGREGATES
+from src.data import incremental
+from src.data.incremental import DailyAggregates, update_daily_aggregates
+from src.data.make_dataset import load_data
+from src.features.build_features import (
+    build_features_covid_impact_model,
+    build_features_revenue_model_q1,
+    build_features_revenue_model_q2,
+)
+from src.features.company_revenue import (
+    COMPANY_REVENUE_GROUPS,
+    get_company_revenue_nights,
+    sum_company_revenue,
+)
+
+
+@pytest.fixture
+def lines(project):
+    """The header and the rows of the daily revenue file of the project,
+    ordered by date as the export grows by a day of all listings."""
+    df = pd.read_csv(PATH_DAILY_REVENUE, dtype=str, keep_default_na=False)
+    df.sort_values("date", kind="stable").to_csv(PATH_DAILY_REVENUE, index=False)
+
+    with open(PATH_DAILY_REVENUE, "rb") as f:
+        return f.read().splitlines(keepends=True)
+
+
+def write(data: bytes, mode: str = "wb"):
+    with open(PATH_DAILY_REVENUE, mode) as f:
+        f.write(data)
+
+
+def edit_revenue(rows: list, position: int):
+    """Changes the first digit of the revenue of the last night with some
+    revenue up to a position, keeping the size of the row."""
+    while True:
+        fields = rows[position].split(b",")
+        if fields[4][:1] not in (b"", b"0"):
+            digit = b"1" if fields[4][:1] != b"1" else b"2"
+            fields[4] = digit + fields[4][1:]
+            rows[position] = b",".join(fields)
+            return
+        position -= 1
+
+
+def assert_full_load_sums(aggregates):
+    """Checks the sums against the ones of the datasets, bit for bit."""
+    nights = get_company_revenue_nights(*load_data(use_cache=False))
+
+    assert_frame_equal(aggregates.per_date, sum_company_revenue(nights))
+    assert_frame_equal(
+        aggregates.per_group, sum_company_revenue(nights, COMPANY_REVENUE_GROUPS)
+    )
+
+
+@pytest.mark.parametrize("chunksize", [7, 1000, 10**6])
+def test_appended_sums_equal_a_full_load(lines, chunksize):
+    header, rows = lines[0], lines[1:]
+
+    write(header + b"".join(rows[:1000]))
+    _, ingested = update_daily_aggregates(chunksize=chunksize)
+    assert ingested == {PATH_DAILY_REVENUE: 1000}
+
+    # A row being written is left for the next run.
+    write(b"".join(rows[1000:2000]) + rows[2000][:10], "ab")
+    _, ingested = update_daily_aggregates(chunksize=chunksize)
+    assert ingested == {PATH_DAILY_REVENUE: 1000}
+
+    write(rows[2000][10:] + b"".join(rows[2001:]), "ab")
+    aggregates, ingested = update_daily_aggregates(chunksize=chunksize)
+    assert ingested == {PATH_DAILY_REVENUE: len(rows) - 2000}
+
+    assert_full_load_sums(aggregates)
+    assert_full_load_sums(DailyAggregates.load())
+
+
+def test_answers_from_appended_sums_equal_the_ones_from_the_datasets(lines):
+    header, rows = lines[0], lines[1:]
+    write(header + b"".join(rows[:1500]))
+    update_daily_aggregates()
+    write(b"".join(rows[1500:]), "ab")
+    aggregates, _ = update_daily_aggregates()
+
+    df_listings, df_daily_revenue = load_data(use_cache=False)
+    for build in [
+        build_features_revenue_model_q1,
+        build_features_revenue_model_q2,
+        build_features_covid_impact_model,
+    ]:
+        X, y = build(df_listings, df_daily_revenue)
+        X_appended, y_appended = build(df_listings, df_daily_revenue, aggregates)
+
+        assert_frame_equal(X_appended, X)
+        pd.testing.assert_series_equal(y_appended, y)
+
+
+def test_unchanged_files_are_not_read_again(lines):
+    update_daily_aggregates()
+    state = os.path.join(PATH_DATA_AGGREGATES, "state.json")
+    saved = os.stat(state).st_mtime_ns
+
+    _, ingested = update_daily_aggregates()
+
+    assert ingested == {PATH_DAILY_REVENUE: 0}
+    assert os.stat(state).st_mtime_ns == saved
+
+
+@pytest.mark.parametrize("edit", ["same_size", "shorter", "tail_and_append"])
+def test_rewritten_files_are_ingested_again(lines, monkeypatch, edit):
+    # About the last ten rows ingested are hashed.
+    monkeypatch.setattr(incremental, "WATERMARK_WINDOW", 400)
+    header, rows = lines[0], lines[1:]
+    write(header + b"".join(rows[:-10]))
+    update_daily_aggregates()
+
+    if edit == "same_size":
+        edit_revenue(rows, 500)
+        write(header + b"".join(rows[:-10]))
+    elif edit == "shorter":
+        write(header + b"".join(rows[:-20]))
+    else:
+        edit_revenue(rows, len(rows) - 11)
+        write(header + b"".join(rows))
+
+    aggregates, ingested = update_daily_aggregates()
+
+    with open(PATH_DAILY_REVENUE, "rb") as f:
+        assert ingested == {PATH_DAILY_REVENUE: len(f.read().splitlines()) - 1}
+    assert_full_load_sums(aggregates)
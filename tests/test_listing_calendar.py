@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+import pytest
+from src.data.listing_calendar import CALENDAR_MISSING_LEAD_TIME, ListingCalendar
+
+
+def daily_revenue(**columns):
+    df = pd.DataFrame(
+        {
+            "listing": ["A", "B", "A"],
+            "date": pd.to_datetime(["2020-01-01", "2020-01-02", "2020-01-03"]),
+            "occupancy": [1, 0, 1],
+            "blocked": [0, 1, 0],
+            "revenue": [100.0, 0.0, 120.5],
+            "last_offered_price": [100.0, 90.0, 120.5],
+            "reservation_advance_days": [3.0, np.nan, 10.0],
+        }
+    )
+    for name, values in columns.items():
+        df[name] = values
+
+    return df
+
+
+def test_calendar_cells_match_the_nights():
+    calendar = ListingCalendar.from_daily_revenue(daily_revenue())
+
+    assert calendar.shape == (2, 3)
+    assert calendar.occupancy.tolist() == [[1, 255, 1], [255, 0, 255]]
+    assert calendar.lead_time.tolist() == [[3, -1, 10], [-1, -1, -1]]
+    assert calendar.to_frame()["revenue"].tolist() == [100.0, 120.5, 0.0]
+
+
+def test_nights_without_listing_or_date_are_left_out():
+    df = daily_revenue(
+        listing=["A", None, "B"],
+        date=pd.to_datetime(["2020-01-01", "2020-01-02", None]),
+    )
+
+    calendar = ListingCalendar.from_daily_revenue(df)
+
+    assert calendar.listings.tolist() == ["A", "B"]
+    assert calendar.shape == (2, 1)
+    assert calendar.occupancy.tolist() == [[1], [255]]
+
+
+def test_negative_lead_times_are_missing():
+    df = daily_revenue(reservation_advance_days=[-2.0, 1.0, 2.0])
+
+    calendar = ListingCalendar.from_daily_revenue(df)
+
+    assert calendar.lead_time[0, 0] == CALENDAR_MISSING_LEAD_TIME
+
+
+def test_lead_times_beyond_int16_are_rejected():
+    df = daily_revenue(reservation_advance_days=[1.0, 2.0, 40000.0])
+
+    with pytest.raises(ValueError, match="lead_time"):
+        ListingCalendar.from_daily_revenue(df)
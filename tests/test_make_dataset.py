@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+
+import pandas as pd
+import pytest
+from pandas.testing import assert_frame_equal
+from src.data.make_dataset import read_daily_revenue_dataset
+from tests.datasets import write_daily_revenue
+
+
+@pytest.fixture
+def shuffled_daily_revenue(tmp_path):
+    """A daily revenue file whose listings are not in sorted order."""
+    path = str(tmp_path / "daily_revenue.csv")
+    df = write_daily_revenue(path)
+    df.sample(frac=1, random_state=0).to_csv(path, index=False)
+
+    return path
+
+
+@pytest.mark.parametrize("chunksize", [7, 997, 5000, 10**6])
+def test_chunked_read_equals_a_single_pass(shuffled_daily_revenue, chunksize):
+    single_pass = read_daily_revenue_dataset(shuffled_daily_revenue, chunksize=None)
+    chunked = read_daily_revenue_dataset(shuffled_daily_revenue, chunksize)
+
+    assert_frame_equal(chunked, single_pass, check_exact=True)
+    assert (chunked["listing"].cat.codes == single_pass["listing"].cat.codes).all()
+
+
+def test_chunked_read_of_an_empty_file(tmp_path):
+    path = str(tmp_path / "daily_revenue.csv")
+    write_daily_revenue(path).iloc[:0].to_csv(path, index=False)
+
+    df = read_daily_revenue_dataset(path, chunksize=100)
+
+    assert len(df) == 0
+    assert isinstance(df["listing"].dtype, pd.CategoricalDtype)
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import pytest
+from src.pipeline import (
+    AGGREGATES_FILES,
+    DATA_FILES,
+    SOURCES_PLOTS,
+    SOURCES_REPORTS,
+    SOURCES_TRAINING,
+    STAGES_BY_NAME,
+    Stage,
+    plan_pipeline,
+    run_stage,
+)
+
+
+def touch(path: str, mtime: float = None):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a", encoding="utf-8"):
+        pass
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+def write_output(*datasets, **kwargs):
+    with open("out.txt", "w", encoding="utf-8") as f:
+        f.write("done")
+
+
+@pytest.fixture
+def stage(tmp_path, monkeypatch):
+    """A stage reading in.txt and writing out.txt in an empty working
+    directory, which accepts the daily aggregates."""
+    monkeypatch.chdir(tmp_path)
+    stage = Stage(
+        "s", write_output, [], ["in.txt"], ["out.txt"], aggregates=["per_date"]
+    )
+    monkeypatch.setitem(STAGES_BY_NAME, "s", stage)
+    touch("in.txt")
+
+    return stage
+
+
+def test_sources_are_found_from_the_project_root():
+    for path in set(SOURCES_TRAINING + SOURCES_REPORTS + SOURCES_PLOTS):
+        assert os.path.isabs(path) and os.path.exists(path)
+    assert any(path.endswith("visualize.py") for path in SOURCES_PLOTS)
+
+
+def test_stage_is_up_to_date_after_running(stage):
+    assert not stage.is_up_to_date()
+
+    run_stage("s")
+
+    assert stage.is_up_to_date()
+    with open(stage.stamp, "r", encoding="utf-8") as f:
+        assert json.load(f) == {}
+
+
+def test_stage_is_stale_when_an_input_is_newer(stage):
+    run_stage("s")
+
+    touch("in.txt", os.path.getmtime("out.txt") + 10)
+
+    assert not stage.is_up_to_date()
+
+
+def test_stage_is_stale_when_an_input_or_the_stamp_is_missing(stage):
+    run_stage("s")
+    os.remove("in.txt")
+
+    assert not stage.is_up_to_date()
+
+    touch("in.txt", os.path.getmtime("out.txt") - 10)
+    assert stage.is_up_to_date()
+
+    os.remove(stage.stamp)
+    assert not stage.is_up_to_date()
+
+
+def test_stage_is_stale_when_run_in_another_mode(stage):
+    appending = stage.parameters(append=True)
+    sharded = stage.parameters(n_shards=4, n_workers=2)
+    assert appending == {"aggregates": "append"}
+    assert sharded == {"aggregates": "sharded", "shards": 4, "workers": 2}
+
+    run_stage("s")
+    assert not stage.is_up_to_date(sharded)
+
+    run_stage("s", parameters=sharded)
+    assert stage.is_up_to_date(sharded)
+    assert not stage.is_up_to_date(stage.parameters(n_shards=8, n_workers=2))
+    assert not stage.is_up_to_date(stage.parameters(n_shards=4, n_workers=1))
+    assert not stage.is_up_to_date({})
+
+    # Appending also reads the persisted aggregates, which are missing.
+    run_stage("s", parameters=appending)
+    assert not stage.is_up_to_date(appending)
+
+    os.makedirs(AGGREGATES_FILES[0])
+    os.utime(AGGREGATES_FILES[0], (0, 0))
+    assert stage.is_up_to_date(appending)
+
+
+def test_mode_only_matters_to_stages_accepting_aggregates():
+    stage = Stage("s", write_output)
+
+    assert stage.parameters(append=True) == {}
+    assert stage.parameters(n_shards=4, n_workers=2) == {}
+
+    # The reservation counts are not kept by the appended aggregates.
+    stage = STAGES_BY_NAME["train_reservations_model_q3"]
+    assert stage.parameters(append=True) == {}
+
+
+def test_plan_pipeline_reruns_the_stages_of_another_mode(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    names = ["train_price_model_q1", "train_revenue_model_q1", "answer_q1"]
+    for path in DATA_FILES:
+        touch(path)
+    for name in names:
+        for path in STAGES_BY_NAME[name].outputs:
+            touch(path)
+        with open(STAGES_BY_NAME[name].stamp, "w", encoding="utf-8") as f:
+            json.dump({}, f)
+
+    _, stale, _, _ = plan_pipeline(["answer_q1"])
+    assert stale == set()
+
+    _, stale, _, parameters = plan_pipeline(["answer_q1"], n_shards=4, n_workers=1)
+    assert stale == {"train_revenue_model_q1", "answer_q1"}
+    assert parameters["train_price_model_q1"] == {}
+
+    _, stale, _, _ = plan_pipeline(["answer_q1"], train=False, n_shards=4)
+    assert stale == set()
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+import os
+import numpy as np
+import pytest
+from src.data.make_dataset import load_data
+from src.models.predict_service import PredictionService
+from src.models.preprocessing import preprocess_transform
+from src.models.train_model import train_price_model_q1, train_revenue_model_q1
+
+QUERY = {
+    "Localização": "JUR",
+    "Categoria": "MASTER",
+    "Quartos": 2,
+    "start": "2022-03-01",
+    "end": "2022-03-05",
+}
+
+
+@pytest.fixture
+def service(project):
+    """A prediction service with the question 1 models trained on the small
+    dataset of the project."""
+    os.makedirs(project / "models")
+    df_listings, df_daily_revenue = load_data()
+    train_price_model_q1(df_listings, df_daily_revenue, n_jobs=1)
+    train_revenue_model_q1(df_listings, df_daily_revenue, n_jobs=1)
+
+    return PredictionService(max_delay=0)
+
+
+def route(service, *requests):
+    """Starts the service and routes the requests, given as (method, path,
+    body) with the body as a JSON serializable object or raw bytes."""
+
+    async def run():
+        server = await service.start("127.0.0.1", 0)
+        try:
+            responses = []
+            for method, path, body in requests:
+                if not isinstance(body, bytes):
+                    body = json.dumps(body).encode("utf-8")
+                responses.append(await service.route(method, path, body))
+            return responses
+        finally:
+            server.close()
+            for task in service.tasks:
+                task.cancel()
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        b"{not json",
+        [],
+        1,
+        "x",
+        None,
+        {"model": "price"},
+        {"model": "unknown", "queries": [QUERY]},
+        {"queries": "x"},
+        {"queries": [1]},
+        {"queries": []},
+        {"queries": [dict(QUERY, Categoria="NOPE")]},
+        {"queries": [dict(QUERY, Categoria=None)]},
+        {"queries": [dict(QUERY, start="not a date")]},
+        {"queries": [{key: QUERY[key] for key in QUERY if key != "Quartos"}]},
+    ],
+)
+def test_malformed_requests_are_bad_requests(service, body):
+    [(status, response)] = route(service, ("POST", "/predict", body))
+
+    assert status == 400
+    assert set(response) == {"error"}
+
+
+def test_unknown_endpoints_are_not_found(service):
+    responses = route(service, ("GET", "/predict", b""), ("POST", "/stats", b""))
+
+    assert [status for status, _ in responses] == [404, 404]
+
+
+def test_failed_predictions_are_errors(service):
+    class Broken:
+        def predict(self, X):
+            raise RuntimeError("broken model")
+
+    async def run():
+        server = await service.start("127.0.0.1", 0)
+        service.batchers["price"].model = Broken()
+        try:
+            return await service.route(
+                "POST", "/predict", json.dumps({"queries": [QUERY]}).encode("utf-8")
+            )
+        finally:
+            server.close()
+            for task in service.tasks:
+                task.cancel()
+
+    assert asyncio.run(run()) == (500, {"error": "broken model"})
+
+
+def test_predictions_match_the_model(service):
+    queries = [QUERY, dict(QUERY, Categoria=5, Quartos=1, end="2022-03-02")]
+
+    [(status, response)] = route(
+        service, ("POST", "/predict", {"model": "revenue", "queries": queries})
+    )
+
+    X, spans, _ = service.make_design_matrix("revenue", queries)
+    _, preprocessor, model = service.models["revenue"]
+    y = model.predict(preprocess_transform(X, preprocessor))
+
+    assert status == 200
+    assert [len(result["dates"]) for result in response["results"]] == [5, 2]
+    for (start, stop), result in zip(spans, response["results"]):
+        assert result["predictions"] == y[start:stop].tolist()
+        assert result["total"] == float(np.sum(y[start:stop]))
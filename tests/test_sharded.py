@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+from pandas.testing import assert_frame_equal
+from src.data.make_dataset import load_data
+from src.features.company_revenue import (
+    COMPANY_REVENUE_GROUPS,
+    get_company_revenue_nights,
+    sum_company_revenue,
+)
+from src.features.reservations import count_reservations_per_creation_date
+from src.features.sharded import sharded_aggregates
+
+
+@pytest.mark.parametrize("n_shards, n_workers", [(1, 1), (3, 1), (8, 1), (4, 2)])
+def test_sharded_aggregates_equal_the_single_process_ones(project, n_shards, n_workers):
+    df_listings, df_daily_revenue = load_data(use_cache=False)
+    nights = get_company_revenue_nights(df_listings, df_daily_revenue)
+
+    aggregates = sharded_aggregates(
+        df_listings, df_daily_revenue, n_shards=n_shards, n_workers=n_workers
+    )
+
+    assert_frame_equal(aggregates.per_date, sum_company_revenue(nights))
+    assert_frame_equal(
+        aggregates.per_group, sum_company_revenue(nights, COMPANY_REVENUE_GROUPS)
+    )
+    assert_frame_equal(
+        aggregates.reservations, count_reservations_per_creation_date(df_daily_revenue)
+    )
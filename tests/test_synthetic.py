@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+from src import DAILY_REVENUE_DTYPES, PATH_DAILY_REVENUE
+from src.data.make_dataset import load_data
+from src.data.synthetic import make_daily_revenue, write_synthetic_dataset
+
+
+def write(path, **kwargs):
+    return write_synthetic_dataset(str(path), n_rows=5000, n_days=100, **kwargs)
+
+
+def test_synthetic_file_does_not_depend_on_the_workers(project):
+    assert write(project / "one.csv", chunksize=700) == 5000
+    assert write(project / "two.csv", chunksize=700, n_workers=2) == 5000
+
+    assert (project / "one.csv").read_bytes() == (project / "two.csv").read_bytes()
+
+
+def test_synthetic_file_is_read_as_the_raw_export(project):
+    write(PATH_DAILY_REVENUE, overwrite=True)
+
+    _, df_daily_revenue = load_data(use_cache=False)
+
+    assert list(df_daily_revenue.columns)[: len(DAILY_REVENUE_DTYPES)] == list(
+        DAILY_REVENUE_DTYPES
+    )
+    assert len(df_daily_revenue) == 5000
+    assert df_daily_revenue["date"].nunique() == 100
+
+
+def test_in_memory_dataset_is_the_written_one(project):
+    write(project / "synthetic.csv", chunksize=700)
+    df = make_daily_revenue(5000, n_days=100, chunksize=700)
+
+    assert df.to_csv(index=False) == (project / "synthetic.csv").read_text("utf-8")
+
+
+def test_the_raw_export_is_not_overwritten(project):
+    export = (project / PATH_DAILY_REVENUE).read_bytes()
+
+    with pytest.raises(FileExistsError):
+        write(PATH_DAILY_REVENUE)
+
+    assert (project / PATH_DAILY_REVENUE).read_bytes() == export
+    assert write(PATH_DAILY_REVENUE, overwrite=True) == 5000
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from src.models.train_model import TRAINING_JOBS, save_training_results
+
+
+def test_save_training_results_keeps_jobs_not_run(tmp_path):
+    path = str(tmp_path / "reports" / "training_results.json")
+
+    save_training_results({"price_model_q1": (1.5, "a.pickle")}, path)
+    stored = save_training_results({"revenue_model_q2": (2.5, "b.pickle")}, path)
+
+    expected = {
+        "price_model_q1": {"mae": 1.5, "regressor": "a.pickle"},
+        "revenue_model_q2": {"mae": 2.5, "regressor": "b.pickle"},
+    }
+    assert stored == expected
+    with open(path, "r", encoding="utf-8") as f:
+        assert json.load(f) == expected
+
+
+def test_training_jobs_name_their_regressor():
+    for name, (_, _, path_regressor) in TRAINING_JOBS.items():
+        assert path_regressor == "models/regressor_" + name + ".pickle"